@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Benchmark del análisis de la tabla horaria de AEMET.
+
+Compara la implementación anterior (BeautifulSoup con html.parser, cada fila
+serializada a texto y nueve expresiones regulares sobre ella) con la actual
+(lxml, una pasada por las celdas de cada fila) sobre las páginas de
+Tests/paginas_aemet.
+
+Esas páginas no son copias descargadas de AEMET: reproducen la estructura de
+su tabla horaria (cabecera con la fecha de cada día, una fila por hora con las
+columnas en el orden de COLUMNAS_HORARIAS) con fechas reales: 12-14 de marzo
+y 15-16 de julio de 2024 y del 31 de diciembre de 2024 al 2 de enero de 2025,
+esta última con temperaturas bajo cero.
+
+Ambas versiones deben coincidir en todas las filas salvo en una divergencia
+intencionada: las expresiones regulares anteriores solo reconocían enteros
+sin signo, así que en una fila con temperaturas negativas se saltaban esas
+celdas y tomaban los valores de las siguientes. El análisis por posición lee
+el signo; divergencias() comprueba que solo difieren esas filas.
+"""
+
+import sys
+import os
+import re
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bs4 import BeautifulSoup
+from aemet_scraper import analizar_tabla_horaria
+
+DIR_PAGINAS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "paginas_aemet")
+
+
+def paginas_guardadas() -> dict:
+    """Contenido (bytes) de cada página de ejemplo, por nombre de fichero."""
+    paginas = {}
+    for nombre in sorted(os.listdir(DIR_PAGINAS)):
+        if nombre.endswith(".html"):
+            with open(os.path.join(DIR_PAGINAS, nombre), "rb") as f:
+                paginas[nombre] = f.read()
+    return paginas
+
+
+def _extract_text(html_str: str, pattern: str, group: int = 1) -> str:
+    """Extrae texto usando regex (antes AemetScraper._extract_text)."""
+    match = re.search(pattern, html_str)
+    return match.group(group) if match else ''
+
+
+def _extract_number(html_str: str, pattern: str, group: int = 0) -> str:
+    """Extrae número usando regex (antes AemetScraper._extract_number)."""
+    try:
+        matches = re.findall(pattern, html_str)
+        if not matches:
+            return '0'
+        if isinstance(matches[0], tuple):
+            return matches[0][group] if group < len(matches[0]) else '0'
+        elif group < len(matches):
+            return matches[group]
+        return '0'
+    except (IndexError, TypeError, AttributeError):
+        return '0'
+
+
+def tabla_horaria_referencia(contenido) -> dict:
+    """Implementación original del análisis de AemetScraper.get_hourly_data."""
+    soup = BeautifulSoup(contenido, 'html.parser')
+    rows = soup.find_all('tr', class_='fila_hora cabecera_niv2')
+
+    hourly_data = {}
+    for row in rows:
+        row_str = str(row)
+        hora_match = re.search(r'>(\d{1,2})<\/td>', row_str)
+        if hora_match:
+            hora = hora_match.group(1).zfill(2)
+            hourly_data[hora] = {
+                'hora': hora,
+                'estadoCielo': _extract_text(row_str, r'title="([^"]+)"\/><\/td>'),
+                'temperatura': _extract_number(row_str, r'<td class="borde_rb">\s*(\d+)<\/td>', 0),
+                'sensacionTermica': _extract_number(row_str, r'<td class="borde_rb">\s*(\d+)<\/td>', 1),
+                'direccionViento': _extract_text(row_str, r'<div class="texto_viento">(\w+)<\/div>'),
+                'velocidadViento': _extract_number(row_str, r'<div class="texto_km_viento"><div>(\d+)<\/div>', 0),
+                'rachaMaxima': _extract_number(row_str, r'borde_rb">\s*(\d+)<\/td>\n<td class="borde_rb">\s*(\d+)', 0),
+                'precipitacion': _extract_number(row_str, r'borde_rb">\s*(\d+)<\/td>\n<td class="borde_rb">\s*(\d+)', 1),
+                'humedadRelativa': _extract_number(row_str, r'borde_rb">\s*(\d+)<\/td>\n<td class="borde_rb">\s*(\d+)<\/td>\n<td class="borde_rb">\s*(\d+)<\/td>\n<td class="borde_rb">\s*(\d+)', 3),
+            }
+    return hourly_data
+
+
+def divergencias(referencia: dict, nuevo: dict) -> list:
+    """
+    Horas en que ambas versiones difieren.
+
+    Falla si alguna no es la divergencia intencionada: una fila en la que el
+    análisis actual lee una temperatura o sensación térmica negativa.
+    """
+    assert list(nuevo) == list(referencia)
+    distintas = [hora for hora in nuevo if nuevo[hora] != referencia[hora]]
+    for hora in distintas:
+        fila = nuevo[hora]
+        assert fila['temperatura'].startswith('-') or fila['sensacionTermica'].startswith('-'), \
+            f"hora {hora}: {fila} != {referencia[hora]}"
+    return distintas
+
+
+def medir(funcion, contenido, repeticiones=20):
+    """Devuelve el mejor tiempo de varias ejecuciones y el último resultado."""
+    mejor = float("inf")
+    resultado = None
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        resultado = funcion(contenido)
+        mejor = min(mejor, time.perf_counter() - inicio)
+    return mejor, resultado
+
+
+def benchmark(repeticiones=20):
+    total_ref = total_new = 0.0
+    for nombre, contenido in paginas_guardadas().items():
+        t_ref, ref = medir(tabla_horaria_referencia, contenido, repeticiones)
+        t_new, nuevo = medir(analizar_tabla_horaria, contenido, repeticiones)
+        distintas = divergencias(ref, nuevo)
+        total_ref += t_ref
+        total_new += t_new
+        print(f"  {nombre:22s} {len(nuevo):3d} horas  anterior {t_ref * 1e3:7.2f} ms  lxml {t_new * 1e3:6.2f} ms"
+              f"  {len(distintas):2d} con negativos")
+
+    print(f"\n  Aceleración: {total_ref / total_new:.1f}x")
+    print("\n[OK] Tablas horarias idénticas salvo en valores negativos")
+    return total_ref, total_new
+
+
+if __name__ == "__main__":
+    benchmark()
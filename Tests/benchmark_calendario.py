@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Benchmark del cálculo de features de calendario.
+
+Compara la implementación anterior (fila a fila sobre todo el dataset, con
+inferencia de formato de fecha) con la actual (una vez por fecha distinta)
+y comprueba que ambas producen exactamente las mismas columnas.
+"""
+
+import sys
+import os
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+import pandas as pd
+from algorithms import _agregar_features_temporales
+from datos_sinteticos import generar_dataset
+
+
+def features_temporales_referencia(df: pd.DataFrame) -> pd.DataFrame:
+    """Implementación original de _agregar_features_temporales."""
+    df = df.copy()
+    df["fecha"] = pd.to_datetime(df["fecha"], dayfirst=True)
+    df["hora"] = df["fecha"].dt.hour
+    df["mes"] = df["fecha"].dt.month
+    df["dia_semana"] = df["fecha"].dt.dayofweek
+    df["es_fin_semana"] = (df["dia_semana"] >= 5).astype(int)
+    df["trimestre"] = df["fecha"].dt.quarter
+
+    df["hora_sin"] = np.sin(2 * np.pi * df["hora"] / 24)
+    df["hora_cos"] = np.cos(2 * np.pi * df["hora"] / 24)
+    df["mes_sin"] = np.sin(2 * np.pi * df["mes"] / 12)
+    df["mes_cos"] = np.cos(2 * np.pi * df["mes"] / 12)
+    df["dia_sin"] = np.sin(2 * np.pi * df["dia_semana"] / 7)
+    df["dia_cos"] = np.cos(2 * np.pi * df["dia_semana"] / 7)
+
+    df["es_noche"] = ((df["hora"] >= 22) | (df["hora"] < 6)).astype(int)
+    df["es_manana"] = ((df["hora"] >= 6) & (df["hora"] < 12)).astype(int)
+    df["es_tarde"] = ((df["hora"] >= 12) & (df["hora"] < 18)).astype(int)
+    df["es_trafico_punta"] = ((df["hora"] >= 7) & (df["hora"] <= 9)) | ((df["hora"] >= 17) & (df["hora"] <= 20))
+    df["es_trafico_punta"] = df["es_trafico_punta"].astype(int)
+
+    df["conditionsDay"] = df["conditionsDay"].fillna("unknown")
+    return df
+
+
+def medir(funcion, df, repeticiones=3):
+    """Devuelve el mejor tiempo de varias ejecuciones y el último resultado."""
+    mejor = float("inf")
+    resultado = None
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        resultado = funcion(df)
+        mejor = min(mejor, time.perf_counter() - inicio)
+    return mejor, resultado
+
+
+def benchmark(n_zonas=500, n_dias=14):
+    df = generar_dataset(n_zonas=n_zonas, n_dias=n_dias)
+    print(f"Dataset: {len(df):,} filas, {df['fecha'].nunique():,} fechas distintas\n")
+
+    t_ref, ref = medir(features_temporales_referencia, df)
+    t_new, nuevo = medir(_agregar_features_temporales, df)
+
+    pd.testing.assert_frame_equal(nuevo, ref, check_exact=True)
+
+    print(f"  Implementación anterior: {t_ref:8.3f} s")
+    print(f"  Tabla de calendario:     {t_new:8.3f} s")
+    print(f"  Aceleración:             {t_ref / t_new:8.1f}x")
+    print("\n[OK] Features idénticas")
+    return t_ref, t_new
+
+
+if __name__ == "__main__":
+    benchmark()
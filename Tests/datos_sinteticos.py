@@ -0,0 +1,55 @@
+"""
+Generador de datasets sintéticos con el mismo formato que el CSV de entrenamiento.
+
+Permite ejecutar las pruebas sin depender de 2024_DatasetSample.csv.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+CONDICIONES = ["clear", "partly-cloudy", "cloudy", "rain"]
+
+
+def generar_dataset(n_zonas: int = 20, n_dias: int = 14, semilla: int = 0) -> pd.DataFrame:
+    """Genera lecturas cada 15 minutos para n_zonas zonas durante n_dias días."""
+    rng = np.random.default_rng(semilla)
+    fechas = pd.date_range("2024-03-04", periods=n_dias * 96, freq="15min")
+    ids = np.arange(1001, 1001 + n_zonas)
+
+    fecha_rep = np.repeat(fechas.values, n_zonas)
+    id_rep = np.tile(ids, len(fechas))
+    n = len(fecha_rep)
+
+    horas = pd.DatetimeIndex(fecha_rep).hour.values
+    dia_semana = pd.DatetimeIndex(fecha_rep).dayofweek.values
+    base_zona = 100 + (id_rep - 1000) * 15
+    perfil = 1 + 0.8 * np.exp(-((horas - 8) ** 2) / 4) + 0.6 * np.exp(-((horas - 18) ** 2) / 6)
+    finde = np.where(dia_semana >= 5, 0.7, 1.0)
+    precip = np.where(rng.random(n) < 0.1, rng.gamma(2, 1.5, n), 0.0).round(1)
+    intensidad = base_zona * perfil * finde * (1 - 0.05 * (precip > 0)) + rng.normal(0, 10, n)
+
+    temp = (12 + 6 * np.sin(2 * np.pi * (horas - 9) / 24) + rng.normal(0, 1, n)).round(1)
+    return pd.DataFrame({
+        "id": id_rep,
+        "fecha": pd.DatetimeIndex(fecha_rep).strftime("%d/%m/%Y %H:%M"),
+        "intensidad": np.maximum(intensidad, 0).round(0),
+        "temp": temp,
+        "feelslike": (temp - 1.5).round(1),
+        "dew": (temp - 5).round(1),
+        "humidity": rng.uniform(40, 90, n).round(1),
+        "precip": precip,
+        "precipprob": np.where(precip > 0, 80, 10),
+        "windgust": rng.uniform(5, 30, n).round(1),
+        "windspeed": rng.uniform(0, 20, n).round(1),
+        "winddir": rng.integers(0, 360, n),
+        "cloudcover": rng.uniform(0, 100, n).round(1),
+        "visibility": rng.uniform(5, 20, n).round(1),
+        "conditionsDay": rng.choice(CONDICIONES, n),
+    })
+
+
+def escribir_dataset(ruta: str, **kwargs) -> str:
+    """Escribe un dataset sintético en formato CSV con separador ';'."""
+    generar_dataset(**kwargs).to_csv(ruta, sep=";", index=False)
+    return ruta
@@ -12,7 +12,7 @@ from aemet_scraper import AemetScraper
 from aemet_mapper import AemetMapper
 from algorithms import preparar_datos_prediccion
 import pandas as pd
-import joblib
+from formato_modelo import abrir_paquete_modelo
 import os
 
 
@@ -40,7 +40,7 @@ def ejemplo_completo():
     print(f"   Usando: {model_path}")
     
     try:
-        model_package = joblib.load(model_path)
+        model_package = abrir_paquete_modelo(model_path)
         trained_results = {
             'modelo': model_package['modelo'],
             'features_numericas': model_package.get('features_numericas', []),
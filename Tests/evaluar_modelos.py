@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 """
 Script de evaluación comparativa de modelos mejorados de predicción de tráfico.
-Compara el rendimiento de los 4 modelos disponibles.
+Compara el rendimiento de los modelos disponibles.
 """
 
 import sys
@@ -11,7 +11,7 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 import pandas as pd
 import numpy as np
 from datetime import datetime
-from algorithms import entrenar_modelo
+from algorithms import entrenar_modelos, backtest_modelo
 
 def print_header(text):
     """Imprimir encabezado formateado."""
@@ -23,12 +23,13 @@ def print_separator():
     """Imprimir separador."""
     print("-" * 80)
 
-def evaluar_modelos(path_csv):
+def evaluar_modelos(path_csv, backtest=False):
     """
     Evaluar todos los modelos disponibles.
     
     Args:
         path_csv: Ruta al archivo CSV de datos
+        backtest: Si además se evalúa cada modelo con el backtest semanal (origen móvil)
     """
     
     print_header("EVALUACION DE MODELOS DE PREDICCION DE TRAFICO")
@@ -36,48 +37,29 @@ def evaluar_modelos(path_csv):
     modelos_a_entrenar = [
         "Random Forest Mejorado",
         "Gradient Boosting",
+        "Gradient Boosting (histogramas)",
         "Deep Learning Mejorado",
         "Árbol de decisión optimizado"
     ]
     
-    resultados_todos = {}
+    # Entrenar todos los modelos en paralelo sobre la misma matriz de features
+    print_separator()
+    print(f"Entrenando {len(modelos_a_entrenar)} modelos en paralelo...")
+    print_separator()
+
+    tiempo_inicio = datetime.now()
+    resultados_todos, tabla = entrenar_modelos(path_csv, algoritmos=modelos_a_entrenar)
+    duracion_total = (datetime.now() - tiempo_inicio).total_seconds()
+
     tiempos_entrenamiento = {}
-    
-    # Cargar dataset una sola vez
-    print("Cargando dataset...")
-    df = pd.read_csv(path_csv, sep=";")
-    print(f"[OK] Dataset: {df.shape[0]:,} filas, {df.shape[1]} columnas\n")
-    
-    # Entrenar cada modelo
-    for idx, nombre_modelo in enumerate(modelos_a_entrenar, 1):
-        print_separator()
-        print(f"[{idx}/{len(modelos_a_entrenar)}] Entrenando: {nombre_modelo}")
-        print_separator() 
-        
-        try:
-            tiempo_inicio = datetime.now()
-            resultados, _ = entrenar_modelo(path_csv, algoritmo=nombre_modelo)
-            tiempo_final = datetime.now()
-            duracion = (tiempo_final - tiempo_inicio).total_seconds()
-            
-            resultados_todos[nombre_modelo] = resultados
-            tiempos_entrenamiento[nombre_modelo] = duracion
-            
-            print("[OK] Modelo entrenado correctamente\n")
-            print(f"Metricas de evaluacion:")
-            print(f"  RMSE:  {resultados['rmse']:.2f}")
-            print(f"  MAE:   {resultados['mae']:.2f}")
-            print(f"  R2:    {resultados['r2']:.4f}")
-            if not pd.isna(resultados['mape']):
-                print(f"  MAPE:  {resultados['mape']:.2%}")
-            print(f"\nTiempo de entrenamiento: {duracion:.2f} segundos")
-            
-        except Exception as e:
-            print(f"[ERROR] {str(e)}")
-            import traceback
-            traceback.print_exc()
-            resultados_todos[nombre_modelo] = None
-    
+    for fila in tabla.itertuples(index=False):
+        if resultados_todos[fila.Modelo] is None:
+            print(f"[ERROR] {fila.Modelo}: {fila.Error}")
+        else:
+            tiempos_entrenamiento[fila.Modelo] = resultados_todos[fila.Modelo]["tiempo_ajuste_s"]
+    print(f"\n[OK] Tiempo total (en paralelo): {duracion_total:.2f} segundos")
+    print(f"     Suma de tiempos de ajuste:   {sum(tiempos_entrenamiento.values()):.2f} segundos\n")
+
     # Resumen comparativo
     print_header("RESUMEN COMPARATIVO DE MODELOS")
     
@@ -129,6 +111,19 @@ def evaluar_modelos(path_csv):
                              key=lambda x: tiempos_entrenamiento[x]):
             t = tiempos_entrenamiento[nombre]
             print(f"  {nombre:40s}: {t:6.2f}s")
+
+    # Backtest temporal: la partición aleatoria mezcla lecturas futuras de la
+    # misma zona en entrenamiento y da un RMSE optimista
+    if backtest:
+        print_header("BACKTEST SEMANAL (ORIGEN MOVIL)")
+        for nombre in modelos_validos:
+            print_separator()
+            print(f"Backtest: {nombre}")
+            print_separator()
+            tabla_backtest = backtest_modelo(path_csv, algoritmo=nombre)
+            print(tabla_backtest.to_string(index=False, float_format=lambda v: f"{v:.4f}"))
+            print(f"\nRMSE medio backtest: {tabla_backtest['RMSE'].mean():.2f} "
+                  f"(partición aleatoria: {modelos_validos[nombre]['rmse']:.2f})\n")
     
     print_separator()
     print("\nRECOMENDACIONES:\n")
@@ -139,6 +134,7 @@ def evaluar_modelos(path_csv):
     print("   - Mejor relación rendimiento/velocidad")
     print("   - RECOMENDADO para producción")
     print("\n2. Gradient Boosting: Para máxima precisión si el tiempo no es crítico")
+    print("   - Gradient Boosting (histogramas): misma familia, multihilo y mucho más rápido")
     print("\n3. Deep Learning: Cuando se tienen muchos más datos disponibles")
     print("\n4. Árbol de Decisión: Para máxima interpretabilidad con rendimiento limitado")
     
@@ -150,7 +146,7 @@ if __name__ == "__main__":
     csv_path = "2024_DatasetSample.csv"
     
     try:
-        resultados, tiempos = evaluar_modelos(csv_path)
+        resultados, tiempos = evaluar_modelos(csv_path, backtest="--backtest" in sys.argv)
     except KeyboardInterrupt:
         print("\n\n[CANCELADO] Evaluacion interrumpida por el usuario")
         sys.exit(0)
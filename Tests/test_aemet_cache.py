@@ -0,0 +1,361 @@
+#!/usr/bin/env python3
+"""
+Pruebas de la caché de páginas de AEMET contra un servidor local que imita la web
+y del análisis de la tabla horaria sobre páginas guardadas.
+"""
+
+import sys
+import os
+import re
+import time
+import threading
+from datetime import date, datetime, timedelta
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from lxml import etree
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from aemet_scraper import AemetScraper, vaciar_cache_aemet, estadisticas_cache_aemet, _caducidad, analizar_tabla_horaria
+from aemet_scraper import filas_tabla_horaria, PrevisionHoraria, RefrescoPrevision
+from benchmark_aemet import paginas_guardadas, tabla_horaria_referencia, divergencias
+
+PAGINA = """<html><body><table>
+<tr class="fila_hora cabecera_niv2"><td>08</td><td><img title="Despejado"/></td>
+<td class="borde_rb"> 12</td>
+<td class="borde_rb"> 10</td></tr>
+<tr class="fila_hora cabecera_niv2"><td>09</td><td><img title="Nuboso"/></td>
+<td class="borde_rb"> 14</td>
+<td class="borde_rb"> 13</td></tr>
+</table></body></html>""".encode("utf-8")
+
+
+class ServidorAemet:
+    """
+    Servidor HTTP local con ETag que cuenta las peticiones recibidas
+    (fallar=True responde 503; pagina es el cuerpo de las respuestas 200).
+    """
+
+    def __init__(self, retardo_s=0.0):
+        self.retardo_s = retardo_s
+        self.etag = '"v1"'
+        self.fallar = False
+        self.pagina = PAGINA
+        self.peticiones = []
+        self.instantes = []
+        servidor = self
+
+        class Manejador(BaseHTTPRequestHandler):
+            def do_GET(self):
+                servidor.peticiones.append(dict(self.headers))
+                servidor.instantes.append(time.monotonic())
+                time.sleep(servidor.retardo_s)
+                if servidor.fallar:
+                    self.send_response(503)
+                    self.end_headers()
+                    return
+                if self.path != "/horas":
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                if self.headers.get("If-None-Match") == servidor.etag:
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("ETag", servidor.etag)
+                self.send_header("Last-Modified", "Tue, 12 Mar 2024 08:00:00 GMT")
+                self.send_header("Content-Length", str(len(servidor.pagina)))
+                self.end_headers()
+                self.wfile.write(servidor.pagina)
+
+            def log_message(self, formato, *args):
+                pass
+
+        self.http = ThreadingHTTPServer(("127.0.0.1", 0), Manejador)
+        self.http.daemon_threads = True
+        threading.Thread(target=self.http.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.http.server_address[1]}"
+
+    def cerrar(self):
+        self.http.shutdown()
+        self.http.server_close()
+
+
+def test_una_peticion_por_prediccion():
+    """test_connection descarga la página y get_hourly_data la toma de la caché."""
+    vaciar_cache_aemet()
+    servidor = ServidorAemet()
+    try:
+        scraper = AemetScraper(url_horaria=servidor.url + "/horas")
+        assert scraper.test_connection()
+        datos = scraper.get_hourly_data()
+        assert sorted(datos) == ["08", "09"]
+        assert datos["09"]["estadoCielo"] == "Nuboso"
+        # Otra instancia (otra predicción) tampoco vuelve a pedirla
+        assert AemetScraper(url_horaria=servidor.url + "/horas").get_hourly_data() == datos
+        assert len(servidor.peticiones) == 1
+
+        # Modificar el resultado no altera la caché
+        datos["08"]["temperatura"] = "99"
+        assert scraper.get_hourly_data()["08"]["temperatura"] != "99"
+
+        assert not AemetScraper(url_horaria=servidor.url + "/otra").test_connection()
+        e = estadisticas_cache_aemet()
+        print(f"  {e}")
+        assert e["descargas"] == 1 and e["aciertos"] == 3 and e["errores"] == 1
+    finally:
+        servidor.cerrar()
+    print("[OK] Una sola petición por predicción")
+
+
+def test_revalidacion_condicional():
+    """Al caducar se revalida con If-None-Match; un 304 conserva la página y un 200 la sustituye."""
+    vaciar_cache_aemet()
+    servidor = ServidorAemet()
+    try:
+        scraper = AemetScraper(url_horaria=servidor.url + "/horas", ttl_s=0)
+        primero = scraper.get_hourly_data()
+        assert scraper.get_hourly_data() == primero
+        assert servidor.peticiones[1]["If-None-Match"] == '"v1"'
+        assert servidor.peticiones[1]["If-Modified-Since"] == "Tue, 12 Mar 2024 08:00:00 GMT"
+
+        servidor.etag = '"v2"'
+        scraper.get_hourly_data()
+        e = estadisticas_cache_aemet()
+        assert e["descargas"] == 2 and e["revalidaciones"] == 1
+    finally:
+        servidor.cerrar()
+
+    # Validez alineada con las actualizaciones: hasta la siguiente hora en punto + margen
+    base = 1_710_230_400  # 12/03/2024 08:00 UTC
+    assert _caducidad(base + 60) == base + 300
+    assert _caducidad(base + 400) == base + 3600 + 300
+    print("[OK] Revalidación condicional")
+
+
+def test_peticiones_concurrentes_compartidas():
+    """Varios hilos que piden la página a la vez comparten una única descarga."""
+    vaciar_cache_aemet()
+    servidor = ServidorAemet(retardo_s=0.3)
+    try:
+        resultados = []
+        hilos = [
+            threading.Thread(target=lambda: resultados.append(
+                AemetScraper(url_horaria=servidor.url + "/horas").get_hourly_data()
+            ))
+            for _ in range(8)
+        ]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+        assert len(servidor.peticiones) == 1
+        assert len(resultados) == 8 and all(sorted(r) == ["08", "09"] for r in resultados)
+        e = estadisticas_cache_aemet()
+        assert e["descargas"] == 1 and e["compartidas"] + e["aciertos"] == 7
+    finally:
+        servidor.cerrar()
+    print("[OK] Peticiones concurrentes compartidas")
+
+
+def test_tabla_horaria_identica():
+    """
+    El análisis con lxml extrae lo mismo que el de BeautifulSoup y regex en
+    las páginas guardadas, salvo en las filas con temperaturas bajo cero, que
+    la versión anterior leía mal.
+    """
+    paginas = paginas_guardadas()
+    assert paginas
+    # Temperatura y sensación escritas en cada fila (la última de cada hora)
+    celdas = re.compile(r'headers="fecha">(\d\d)</td><td class="borde_rb">.*?</td>'
+                        r'<td class="borde_rb"> (-?\d+)</td><td class="borde_rb"> (-?\d+)</td>')
+    for nombre, contenido in paginas.items():
+        nuevo = analizar_tabla_horaria(contenido)
+        assert len(nuevo) == 24, nombre
+        escritas = {hora: (t, s) for hora, t, s in celdas.findall(contenido.decode("utf-8"))}
+        assert {hora: (f["temperatura"], f["sensacionTermica"]) for hora, f in nuevo.items()} == escritas
+
+        referencia = tabla_horaria_referencia(contenido)
+        distintas = divergencias(referencia, nuevo)
+        negativas = [hora for hora, (t, s) in escritas.items() if t.startswith("-") or s.startswith("-")]
+        assert distintas == negativas, nombre
+        for hora in distintas:
+            # La versión anterior se saltaba el signo y tomaba la celda siguiente
+            assert not referencia[hora]["temperatura"].startswith("-")
+    assert divergencias(tabla_horaria_referencia(paginas["madrid_enero.html"]),
+                        analizar_tabla_horaria(paginas["madrid_enero.html"]))
+    assert analizar_tabla_horaria(b"") == {}
+    # Documentos sin elementos: lxml no puede analizarlos, pero no hay filas
+    for contenido in (b"<!-- sin tabla -->", b'<?xml version="1.0"?>', "<!-- sin tabla -->"):
+        assert filas_tabla_horaria(contenido) == []
+    print("[OK] Tabla horaria idéntica")
+
+
+def test_tabla_horaria_por_posicion():
+    """Los campos se leen por columna: una celda sin número no desplaza a las siguientes."""
+    pagina = """<table><tr class="fila_hora cabecera_niv2"><td>7</td><td><img title="Niebla"/></td>
+<td class="borde_rb"> -2</td><td class="borde_rb"> -5</td>
+<td class="borde_rb"><div class="texto_viento">C</div><div class="texto_km_viento"><div>0</div></div></td>
+<td class="borde_rb"></td><td class="borde_rb">Ip</td><td class="borde_rb"> 0</td><td class="borde_rb"> 96</td>
+</tr><tr class="fila_hora cabecera_niv2"><td>08</td></tr></table>""".encode("utf-8")
+    datos = analizar_tabla_horaria(pagina)
+    assert sorted(datos) == ["07", "08"]
+    siete = datos["07"]
+    assert (siete["estadoCielo"], siete["temperatura"], siete["sensacionTermica"]) == ("Niebla", "-2", "-5")
+    assert (siete["direccionViento"], siete["velocidadViento"]) == ("C", "0")
+    assert (siete["rachaMaxima"], siete["precipitacion"], siete["humedadRelativa"]) == ("0", "0", "96")
+    # Fila incompleta: valores por defecto
+    assert datos["08"]["estadoCielo"] == "" and datos["08"]["humedadRelativa"] == "0"
+    print("[OK] Tabla horaria por posición")
+
+
+
+def test_prevision_por_fecha_y_hora():
+    """La tabla distingue los días de la página por sus cabeceras o, sin ellas, por la vuelta de 23 a 00."""
+    contenido = paginas_guardadas()["madrid_marzo.html"]
+    filas = filas_tabla_horaria(contenido)
+    prevision = PrevisionHoraria(filas, date(2024, 3, 12))
+    assert len(prevision) == len(filas) > 48
+    inicio, fin = prevision.horizonte()
+    assert inicio == datetime(2024, 3, 12, int(filas[0]["hora"])) and fin == datetime(2024, 3, 14, 23)
+
+    # Misma hora en días distintos: filas distintas; los minutos no cuentan
+    assert prevision.buscar(datetime(2024, 3, 13, 8, 45)) == filas[len(filas) - 48 + 8]
+    assert prevision.buscar(datetime(2024, 3, 14, 8)) == filas[len(filas) - 24 + 8]
+    assert prevision.buscar(datetime(2024, 3, 15, 8)) is None
+    assert prevision.buscar(datetime(2024, 3, 12, 0)) is None
+    # get_hourly_data conserva su forma: una entrada por hora (la del último día)
+    assert prevision.por_hora() == analizar_tabla_horaria(contenido)
+
+    # Con las cabeceras de día la fecha no depende del día de descarga:
+    # descargada o revalidada pasada la medianoche, la primera fila sigue siendo del 12
+    for referencia in (date(2024, 3, 12), date(2024, 3, 13), date(2024, 3, 14)):
+        desde_pagina = PrevisionHoraria.desde_pagina(contenido, referencia)
+        assert desde_pagina.fechas == prevision.fechas
+    # Fin de año: cada cabecera toma el año más cercano a la descarga
+    enero = PrevisionHoraria.desde_pagina(paginas_guardadas()["madrid_enero.html"], date(2025, 1, 1))
+    assert enero.fechas[0].date() == date(2024, 12, 31) and enero.horizonte()[1] == datetime(2025, 1, 2, 23)
+    assert enero.buscar(datetime(2025, 1, 1, 0)) is not None and enero.buscar(datetime(2024, 1, 1, 0)) is None
+
+    # A través del scraper, con una página sin cabeceras: la primera fila es del día de descarga
+    vaciar_cache_aemet()
+    servidor = ServidorAemet()
+    try:
+        scraper = AemetScraper(url_horaria=servidor.url + "/horas")
+        hoy = datetime.now().replace(minute=0, second=0, microsecond=0)
+        tabla = scraper.get_forecast_table()
+        assert tabla is AemetScraper(url_horaria=servidor.url + "/horas").get_forecast_table()
+        assert scraper.get_forecast_for_datetime(hoy.replace(hour=9))["estadoCielo"] == "Nuboso"
+        assert scraper.get_forecast_for_datetime(hoy.replace(hour=9) + timedelta(days=1)) is None
+        assert len(servidor.peticiones) == 1
+    finally:
+        servidor.cerrar()
+    print("[OK] Previsión por fecha y hora")
+
+
+def _esperar(condicion, limite_s=5.0):
+    fin = time.monotonic() + limite_s
+    while not condicion():
+        assert time.monotonic() < fin, "tiempo de espera agotado"
+        time.sleep(0.01)
+
+
+def test_refresco_en_segundo_plano():
+    """La tabla se sirve al instante aunque AEMET falle; los reintentos se espacian y el circuito se abre y se cierra."""
+    vaciar_cache_aemet()
+    servidor = ServidorAemet()
+    scraper = AemetScraper(url_horaria=servidor.url + "/horas", ttl_s=0.2)
+    refresco = RefrescoPrevision(
+        scraper, espera_inicial_s=0.05, espera_max_s=0.15, fallos_circuito=3, pausa_circuito_s=0.6, refresco_min_s=0.1
+    )
+    try:
+        assert refresco.actual() is None and refresco.describir() == "AEMET: descargando..."
+        refresco.iniciar()
+        _esperar(lambda: refresco.actual() is not None)
+        tabla = refresco.actual()
+        assert len(tabla) == 2 and refresco.estado()["circuito"] == "cerrado"
+
+        # AEMET deja de responder: se sigue sirviendo la última tabla buena sin esperar
+        servidor.fallar = True
+        _esperar(lambda: refresco.estado()["fallos"] >= 1)
+        inicio = time.perf_counter()
+        assert refresco.actual() is tabla
+        assert time.perf_counter() - inicio < 0.05
+        _esperar(lambda: refresco.estado()["circuito"] == "abierto")
+        e = refresco.estado()
+        assert e["fallos"] == 3 and e["caducada"] and "sin conexión" in refresco.describir()
+
+        # Espera exponencial entre fallos y ninguna petición con el circuito abierto
+        fallidas = servidor.instantes[-3:]
+        assert fallidas[2] - fallidas[1] > fallidas[1] - fallidas[0] >= 0.04
+        peticiones = len(servidor.peticiones)
+        time.sleep(0.3)
+        refresco.actual()
+        assert len(servidor.peticiones) == peticiones
+
+        # Pasada la pausa, el intento de prueba cierra el circuito
+        servidor.fallar = False
+        _esperar(lambda: refresco.estado()["fallos"] == 0)
+        assert refresco.estado()["circuito"] == "cerrado" and refresco.actual() is not None
+    finally:
+        refresco.detener()
+        servidor.cerrar()
+    print("[OK] Refresco en segundo plano")
+
+
+class ScraperAnalisisRoto(AemetScraper):
+    """Scraper cuyo análisis de la página lanza un error que no es de red."""
+
+    @staticmethod
+    def _prevision(entrada):
+        raise etree.ParserError("Document is empty")
+
+
+def test_refresco_respuestas_no_html():
+    """Una respuesta 200 vacía o sin tabla, o un error inesperado al analizarla, cuentan como fallos sin matar el hilo."""
+    for pagina in (b"", b"<!-- mantenimiento -->", b"Servicio no disponible"):
+        vaciar_cache_aemet()
+        servidor = ServidorAemet()
+        servidor.pagina = pagina
+        servidor.etag = f'"{len(pagina)}"'
+        refresco = RefrescoPrevision(
+            AemetScraper(url_horaria=servidor.url + "/horas", ttl_s=0.0),
+            espera_inicial_s=0.02, espera_max_s=0.05, fallos_circuito=2, pausa_circuito_s=0.3, refresco_min_s=0.05
+        ).iniciar()
+        try:
+            _esperar(lambda: refresco.estado()["circuito"] == "abierto")
+            assert refresco._hilo.is_alive() and refresco.actual() is None
+            assert "sin conexión" in refresco.describir()
+
+            # Vuelve la página buena: el mismo hilo se recupera
+            servidor.pagina = PAGINA
+            servidor.etag = '"v2"'
+            _esperar(lambda: refresco.actual() is not None)
+            assert refresco.estado()["fallos"] == 0
+        finally:
+            refresco.detener()
+            servidor.cerrar()
+
+    vaciar_cache_aemet()
+    servidor = ServidorAemet()
+    refresco = RefrescoPrevision(
+        ScraperAnalisisRoto(url_horaria=servidor.url + "/horas"), espera_inicial_s=0.02, fallos_circuito=3
+    ).iniciar()
+    try:
+        _esperar(lambda: refresco.estado()["fallos"] >= 2)
+        assert refresco._hilo.is_alive() and refresco.estado()["error"] == "Document is empty"
+    finally:
+        refresco.detener()
+        servidor.cerrar()
+    print("[OK] Refresco con respuestas no HTML")
+
+
+if __name__ == "__main__":
+    test_una_peticion_por_prediccion()
+    test_revalidacion_condicional()
+    test_peticiones_concurrentes_compartidas()
+    test_tabla_horaria_identica()
+    test_tabla_horaria_por_posicion()
+    test_prevision_por_fecha_y_hora()
+    test_refresco_en_segundo_plano()
+    test_refresco_respuestas_no_html()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Pruebas de la caché de resultados de predicción.
+"""
+
+import sys
+import os
+import tempfile
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cache_predicciones import CachePredicciones
+
+METEO = {"temp": 12.5, "conditionsDay": "rain"}
+FECHA = "14/01/2026 08:15"
+
+
+def test_cache_memoria_lru():
+    """Solo faltan las zonas no vistas; al superar el límite se expulsan las menos usadas."""
+    cache = CachePredicciones(max_entradas=4)
+    encontradas, faltan = cache.buscar("m1", [1, 2, 3], FECHA, METEO)
+    assert encontradas == {} and faltan == [1, 2, 3]
+    cache.guardar("m1", faltan, FECHA, METEO, [10.0, 20.0, 30.0])
+
+    encontradas, faltan = cache.buscar("m1", [3, 1, 4], FECHA, METEO)
+    assert encontradas == {3: 30.0, 1: 10.0} and faltan == [4]
+
+    # Otra meteorología, otra fecha u otro modelo no comparten entradas
+    assert cache.buscar("m1", [1], FECHA, {**METEO, "temp": 13.0})[1] == [1]
+    assert cache.buscar("m1", [1], "14/01/2026 08:30", METEO)[1] == [1]
+    assert cache.buscar("m2", [1], FECHA, METEO)[1] == [1]
+
+    # 2 es la menos usada: se expulsa al añadir dos zonas más
+    cache.guardar("m1", [4, 5], FECHA, METEO, [40.0, 50.0])
+    assert cache.buscar("m1", [2], FECHA, METEO)[1] == [2]
+
+    e = cache.estadisticas()
+    print(f"  {e}")
+    assert e["expulsiones_memoria"] == 1 and e["entradas_memoria"] == 4
+    assert e["aciertos_memoria"] == 2 and e["fallos"] == 8
+    assert abs(e["ratio_aciertos"] - 0.2) < 1e-9
+    assert "20% aciertos, 1 expulsiones" in cache.describir()
+    print("[OK] Caché de predicciones en memoria")
+
+
+def test_cache_disco():
+    """El nivel en disco sobrevive a la sesión y está acotado."""
+    with tempfile.TemporaryDirectory() as tmp:
+        ruta = os.path.join(tmp, "cache", "predicciones.sqlite")
+        cache = CachePredicciones(max_entradas=2, path_disco=ruta, max_entradas_disco=3)
+        cache.guardar("m1", [1, 2], FECHA, METEO, [10.0, 20.0])
+        cache.cerrar()
+
+        cache = CachePredicciones(max_entradas=2, path_disco=ruta, max_entradas_disco=3)
+        encontradas, faltan = cache.buscar("m1", [1, 2, 3], FECHA, METEO)
+        assert encontradas == {1: 10.0, 2: 20.0} and faltan == [3]
+        assert cache.estadisticas()["aciertos_disco"] == 2
+
+        cache.guardar("m1", [3, 4], FECHA, METEO, [30.0, 40.0])
+        e = cache.estadisticas()
+        assert e["expulsiones_disco"] == 1
+        cache.cerrar()
+    print("[OK] Caché de predicciones en disco")
+
+
+if __name__ == "__main__":
+    test_cache_memoria_lru()
+    test_cache_disco()
@@ -0,0 +1,405 @@
+#!/usr/bin/env python3
+"""
+Pruebas de los modos de entrenamiento sobre un dataset sintético.
+"""
+
+import sys
+import os
+import time
+import types
+import shutil
+import tempfile
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.preprocessing import StandardScaler
+import algorithms
+from algorithms import (
+    entrenar_modelo, entrenar_modelos, backtest_modelo, preparar_datos_prediccion, crear_paquete_modelo,
+    cargar_paquete_modelo, vaciar_cache_modelos, compactar_random_forest, resultados_compactados, huella_modelo,
+    ALGORITMO_INCREMENTAL, ALGORITMO_LINEA_BASE
+)
+from formato_modelo import guardar_paquete_modelo, abrir_paquete_modelo, leer_cabecera, PaqueteModelo
+from datos_sinteticos import escribir_dataset, generar_dataset
+
+
+def _guardar_y_cargar(resultados, ruta):
+    """Guarda el paquete igual que app._save_model y lo vuelve a cargar."""
+    guardar_paquete_modelo(crear_paquete_modelo(resultados), ruta)
+    return abrir_paquete_modelo(ruta)
+
+
+def test_entrenamiento_incremental():
+    """El modelo incremental se guarda y se usa para predecir como cualquier otro."""
+    print("PRUEBA ENTRENAMIENTO INCREMENTAL\n")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        csv = escribir_dataset(os.path.join(tmp, "datos.csv"), n_zonas=10, n_dias=14)
+        resultados, df = entrenar_modelo(csv, ALGORITMO_INCREMENTAL, tam_bloque=3_000)
+
+        print(f"  Filas: {resultados['n_filas']}, test: {len(resultados['y_test'])}")
+        print(f"  RMSE: {resultados['rmse']:.2f}  R2: {resultados['r2']:.4f}")
+        assert df is None
+        assert resultados["n_filas"] == 10 * 14 * 96
+        assert 0.1 < len(resultados["y_test"]) / resultados["n_filas"] < 0.3
+        assert resultados["r2"] > 0.5
+
+        paquete = _guardar_y_cargar(resultados, os.path.join(tmp, "modelo.mdl"))
+        df_pred = generar_dataset(n_zonas=3, n_dias=1, semilla=5).drop(columns="intensidad").head(10)
+        pred = paquete["modelo"].predict(preparar_datos_prediccion(df_pred, paquete))
+        assert pred.shape == (10,) and np.isfinite(pred).all()
+
+    print("\n[OK] Entrenamiento incremental correcto")
+
+
+def test_entrenamiento_incremental_sin_test():
+    """Sin filas de test las métricas son NaN; un CSV vacío da un ValueError claro."""
+    with tempfile.TemporaryDirectory() as tmp:
+        csv = escribir_dataset(os.path.join(tmp, "datos.csv"), n_zonas=4, n_dias=1)
+
+        original = algorithms._es_fila_test
+        algorithms._es_fila_test = lambda indices: np.zeros(len(indices), dtype=bool)
+        try:
+            resultados, _ = entrenar_modelo(csv, ALGORITMO_INCREMENTAL, tam_bloque=100)
+        finally:
+            algorithms._es_fila_test = original
+        assert len(resultados["y_test"]) == 0 and len(resultados["X_test"]) == 0
+        assert all(np.isnan(resultados[m]) for m in ("rmse", "mae", "r2", "mape"))
+
+        vacio = os.path.join(tmp, "vacio.csv")
+        generar_dataset(n_zonas=1, n_dias=1).head(0).to_csv(vacio, sep=";", index=False)
+        try:
+            entrenar_modelo(vacio, ALGORITMO_INCREMENTAL)
+            assert False, "un CSV sin filas debería fallar"
+        except ValueError as e:
+            assert "no tiene filas" in str(e)
+    print("[OK] Entrenamiento incremental sin test o sin filas")
+
+
+def test_boosting_histogramas():
+    """El boosting por histogramas trata conditionsDay como categórica nativa y admite categorías nuevas."""
+    with tempfile.TemporaryDirectory() as tmp:
+        csv = escribir_dataset(os.path.join(tmp, "datos.csv"), n_zonas=8, n_dias=7)
+        resultados, _ = entrenar_modelo(csv, "Gradient Boosting (histogramas)", usar_cache=False)
+
+        print(f"  RMSE: {resultados['rmse']:.2f}  R2: {resultados['r2']:.4f}  ajuste: {resultados['tiempo_ajuste_s']:.2f} s")
+        modelo = resultados["modelo"]
+        assert modelo.named_steps["model"].is_categorical_[-1]
+        assert resultados["r2"] > 0.8
+
+        df_pred = generar_dataset(n_zonas=2, n_dias=1).drop(columns="intensidad").head(4)
+        df_pred["conditionsDay"] = "snow"
+        pred = modelo.predict(preparar_datos_prediccion(df_pred, resultados))
+        assert np.isfinite(pred).all()
+    print("[OK] Boosting por histogramas correcto")
+
+
+def test_entrenamiento_paralelo():
+    """Entrenar en paralelo da los mismos modelos que entrenar uno a uno sobre la misma partición."""
+    algoritmos = ["Gradient Boosting (histogramas)", "Árbol de decisión optimizado"]
+    with tempfile.TemporaryDirectory() as tmp:
+        csv = escribir_dataset(os.path.join(tmp, "datos.csv"), n_zonas=6, n_dias=4)
+        resultados, tabla = entrenar_modelos(csv, algoritmos, n_procesos=2, usar_cache=False)
+        print(tabla.to_string(index=False))
+
+        assert sorted(tabla["Modelo"]) == sorted(algoritmos)
+        assert tabla["Error"].isna().all()
+        assert tabla["RMSE"].is_monotonic_increasing
+        # Línea base y lookups se construyen una vez y se comparten entre algoritmos
+        primero, segundo = (resultados[alg] for alg in algoritmos)
+        assert primero["linea_base"] is segundo["linea_base"]
+        assert primero["zona_lookup"] is segundo["zona_lookup"]
+
+        secuencial, _ = entrenar_modelo(csv, algoritmos[0], usar_cache=False)
+        paralelo = resultados[algoritmos[0]]
+        assert np.isclose(paralelo["rmse"], secuencial["rmse"])
+        np.testing.assert_array_equal(paralelo["y_test"].to_numpy(), secuencial["y_test"].to_numpy())
+
+        paquete = _guardar_y_cargar(paralelo, os.path.join(tmp, "modelo.mdl"))
+        df_pred = generar_dataset(n_zonas=2, n_dias=1).drop(columns="intensidad").head(4)
+        assert np.isfinite(paquete["modelo"].predict(preparar_datos_prediccion(df_pred, paquete))).all()
+    print("[OK] Entrenamiento en paralelo equivalente al secuencial")
+
+
+def test_busqueda_halving():
+    """El halving ajusta menos veces que el grid completo y respeta el presupuesto de tiempo."""
+    with tempfile.TemporaryDirectory() as tmp:
+        csv = escribir_dataset(os.path.join(tmp, "datos.csv"), n_zonas=6, n_dias=4)
+        resultados, _ = entrenar_modelo(csv, "Árbol de decisión optimizado", busqueda="halving", usar_cache=False)
+        busqueda = resultados["busqueda"]
+        print(f"  Halving: {busqueda['n_ajustes']} ajustes en {busqueda['tiempo_s']:.2f} s, rondas {busqueda['rondas']}")
+
+        assert busqueda["modo"] == "halving" and not busqueda["presupuesto_agotado"]
+        assert [r["n_candidatos"] for r in busqueda["rondas"]] == [24, 8, 3]
+        assert busqueda["rondas"][-1]["n_filas"] > busqueda["rondas"][0]["n_filas"]
+        assert busqueda["n_ajustes"] == (24 + 8 + 3) * 5 + 1
+        assert resultados["r2"] > 0.8
+
+        limitado, _ = entrenar_modelo(
+            csv, "Árbol de decisión optimizado", busqueda="halving", presupuesto_busqueda=1e-9, usar_cache=False
+        )
+        assert limitado["busqueda"]["presupuesto_agotado"]
+        assert limitado["busqueda"]["n_ajustes"] == 1
+        assert np.isfinite(limitado["y_pred"]).all()
+
+        # Reloj que avanza 1 s por consulta: el presupuesto se agota tras 130 comprobaciones,
+        # con la primera ronda (24 x 5) completa y dos candidatos de la segunda
+        consultas = iter(range(10**6))
+        reloj_original = algorithms.time
+        algorithms.time = types.SimpleNamespace(perf_counter=lambda: float(next(consultas)))
+        try:
+            cortado, _ = entrenar_modelo(
+                csv, "Árbol de decisión optimizado", busqueda="halving", presupuesto_busqueda=130, usar_cache=False
+            )
+        finally:
+            algorithms.time = reloj_original
+        rondas = cortado["busqueda"]["rondas"]
+        assert [(r["n_candidatos"], r["completa"]) for r in rondas] == [(24, True), (2, False)]
+        assert cortado["modelo"].best_score_ == rondas[0]["mejor_puntuacion"]
+    print("[OK] Búsqueda por halving correcta")
+
+
+def test_matriz_compacta():
+    """La matriz es float32/int16, los árboles no escalan y la predicción reproduce la matriz de entrenamiento."""
+    with tempfile.TemporaryDirectory() as tmp:
+        csv = escribir_dataset(os.path.join(tmp, "datos.csv"), n_zonas=4, n_dias=2)
+        resultados, _ = entrenar_modelo(csv, "Random Forest Mejorado", usar_cache=False)
+
+        X_train = resultados["X_train"]
+        assert X_train["hora"].dtype == np.int16 and X_train["temp"].dtype == np.float32
+        assert resultados["preprocesado"]["categoricas"] == "ordinal"
+        assert not resultados["preprocesado"]["escalado"]
+        pre = resultados["modelo"].named_steps["pre"]
+        assert pre.transform(X_train.head()).dtype == np.float32
+        assert not any(isinstance(t, StandardScaler) for _, t, _ in pre.transformers_)
+
+        # Reconstruir la matriz desde el CSV original con el paquete guardado
+        paquete = _guardar_y_cargar(resultados, os.path.join(tmp, "modelo.mdl"))
+        crudo = pd.read_csv(csv, sep=";").drop(columns="intensidad")
+        X_pred = preparar_datos_prediccion(crudo, paquete)
+        X = pd.concat([X_train, resultados["X_test"]]).sort_index()
+        pd.testing.assert_frame_equal(X_pred, X, check_exact=True)
+        np.testing.assert_array_equal(
+            paquete["modelo"].predict(X_pred.loc[resultados["X_test"].index]), resultados["y_pred"]
+        )
+    print("[OK] Matriz compacta y preprocesado reproducible")
+
+
+def test_backtest_semanal():
+    """Cada pliegue entrena solo con semanas anteriores a la de test."""
+    with tempfile.TemporaryDirectory() as tmp:
+        csv = escribir_dataset(os.path.join(tmp, "datos.csv"), n_zonas=4, n_dias=28)
+        tabla = backtest_modelo(csv, "Gradient Boosting (histogramas)", n_pliegues=2, n_procesos=2, usar_cache=False)
+        print(tabla.to_string(index=False))
+
+        filas_semana = 7 * 96 * 4
+        assert list(tabla["Semana test"]) == ["18/03/2024", "25/03/2024"]
+        assert list(tabla["Filas train"]) == [2 * filas_semana, 3 * filas_semana]
+        assert (tabla["Filas test"] == filas_semana).all()
+        assert (tabla["R2"] > 0.8).all()
+    print("[OK] Backtest semanal correcto")
+
+
+def test_backtest_semana_vacia():
+    """Una semana de test sin filas sale en la tabla con métricas NaN y no tumba el backtest."""
+    with tempfile.TemporaryDirectory() as tmp:
+        df = generar_dataset(n_zonas=4, n_dias=28)
+        fechas = pd.to_datetime(df["fecha"], format="%d/%m/%Y %H:%M")
+        semana = (fechas - fechas.min().normalize()).dt.days // 7
+        df = df[semana != 2].copy()
+        df.loc[df.index[::5], "temp"] = np.nan
+        csv = os.path.join(tmp, "datos.csv")
+        df.to_csv(csv, sep=";", index=False)
+
+        tabla = backtest_modelo(csv, "Gradient Boosting (histogramas)", n_pliegues=2, n_procesos=2, usar_cache=False)
+        print(tabla.to_string(index=False))
+
+        filas_semana = 7 * 96 * 4
+        assert list(tabla["Filas test"]) == [0, filas_semana]
+        assert list(tabla["Filas train"]) == [2 * filas_semana, 2 * filas_semana]
+        vacia, completa = tabla.iloc[0], tabla.iloc[1]
+        assert np.isnan(vacia["RMSE"]) and np.isnan(vacia["R2"]) and np.isnan(vacia["Tiempo (s)"])
+        assert completa["R2"] > 0.8
+    print("[OK] Backtest con semana vacía correcto")
+
+
+def test_cache_modelos():
+    """El segundo acceso al mismo .mdl (v1) sale de la caché y sobrescribirlo fuerza la recarga."""
+    vaciar_cache_modelos()
+    with tempfile.TemporaryDirectory() as tmp:
+        csv = escribir_dataset(os.path.join(tmp, "datos.csv"), n_zonas=4, n_dias=2)
+        resultados, _ = entrenar_modelo(csv, "Gradient Boosting (histogramas)", usar_cache=False)
+        ruta = os.path.join(tmp, "modelo.mdl")
+        joblib.dump(crear_paquete_modelo(resultados), ruta)
+
+        primero, info1 = cargar_paquete_modelo(ruta)
+        segundo, info2 = cargar_paquete_modelo(ruta)
+        print(f"  Carga: {info1['tiempo_s'] * 1e3:.1f} ms, acierto: {info2['tiempo_s'] * 1e3:.3f} ms")
+        assert not info1["desde_cache"] and info2["desde_cache"]
+        assert segundo is primero
+        assert (info2["aciertos"], info2["fallos"]) == (1, 1)
+
+        # Los arrays grandes quedan mapeados y el modelo predice igual
+        assert isinstance(primero["zona_lookup"].valores, np.memmap)
+        X_test = resultados["X_test"]
+        np.testing.assert_array_equal(primero["modelo"].predict(X_test), resultados["y_pred"])
+
+        os.utime(ruta, ns=(os.stat(ruta).st_atime_ns, os.stat(ruta).st_mtime_ns + 10**9))
+        tercero, info3 = cargar_paquete_modelo(ruta)
+        assert not info3["desde_cache"] and tercero is not primero
+    vaciar_cache_modelos()
+    print("[OK] Caché de modelos correcta")
+
+
+def test_formato_v2():
+    """La cabecera se lee sin deserializar el modelo, las secciones se cargan al usarlas y v1 sigue abriéndose."""
+    with tempfile.TemporaryDirectory() as tmp:
+        csv = escribir_dataset(os.path.join(tmp, "datos.csv"), n_zonas=4, n_dias=2)
+        resultados, _ = entrenar_modelo(csv, "Random Forest Mejorado", usar_cache=False)
+        paquete = crear_paquete_modelo(resultados)
+        v1, v2 = os.path.join(tmp, "v1.mdl"), os.path.join(tmp, "v2.mdl")
+        joblib.dump(paquete, v1)
+        guardar_paquete_modelo(paquete, v2)
+
+        cabecera = leer_cabecera(v2)
+        assert leer_cabecera(v1) is None
+        assert cabecera["version_formato"] == 2
+        assert cabecera["algoritmo"] == "Random Forest Mejorado"
+        assert cabecera["features_numericas"] == resultados["features_numericas"]
+        assert cabecera["huella_dataset"] == resultados["huella_dataset"]
+        assert np.isclose(cabecera["metricas"]["rmse"], resultados["rmse"])
+        # La cabecera ocupa una fracción mínima del fichero
+        assert cabecera["secciones"]["modelo"]["offset"] < os.path.getsize(v2) / 50
+
+        abierto = abrir_paquete_modelo(v2)
+        assert isinstance(abierto, PaqueteModelo)
+        assert abierto["preprocesado"] == paquete["preprocesado"]
+        assert abierto.secciones_cargadas == []
+        X_pred = preparar_datos_prediccion(resultados["X_test"].assign(fecha="05/03/2024 08:00"), abierto)
+        assert abierto.secciones_cargadas == ["estadisticas"]
+        # Mismos valores y dtypes (las columnas mapeadas son np.memmap)
+        assert abierto["zona_stats"].equals(paquete["zona_stats"])
+        np.testing.assert_array_equal(abierto["modelo"].predict(X_pred), paquete["modelo"].predict(X_pred))
+        assert sorted(abierto.secciones_cargadas) == ["estadisticas", "modelo"]
+        # Los arrays de las secciones se mapean desde el propio .mdl, salvo con mmap=False
+        assert isinstance(abierto["zona_lookup"].valores, np.memmap)
+        assert isinstance(abierto["linea_base"].tabla_, np.memmap)
+        np.testing.assert_array_equal(abierto["zona_lookup"].valores, paquete["zona_lookup"].valores)
+        copiado = abrir_paquete_modelo(v2, mmap=False)
+        assert not isinstance(copiado["zona_lookup"].valores, np.memmap)
+        np.testing.assert_array_equal(copiado["modelo"].predict(X_pred), paquete["modelo"].predict(X_pred))
+        assert set(abierto) == set(paquete) | {"version_formato"}
+
+        antiguo = abrir_paquete_modelo(v1)
+        assert isinstance(antiguo, dict)
+        np.testing.assert_array_equal(antiguo["modelo"].predict(X_pred), paquete["modelo"].predict(X_pred))
+
+        # Huella para la caché de predicciones: v2 por la cabecera (igual en una copia), v1 por ruta, tamaño y fecha
+        copia = os.path.join(tmp, "copia.mdl")
+        shutil.copyfile(v2, copia)
+        assert huella_modelo(copia) == huella_modelo(v2) != huella_modelo(v1)
+        otro, _ = entrenar_modelo(csv, "Gradient Boosting (histogramas)", usar_cache=False)
+        guardar_paquete_modelo(crear_paquete_modelo(otro), copia)
+        assert huella_modelo(copia) != huella_modelo(v2)
+        huella_v1 = huella_modelo(v1)
+        os.utime(v1, ns=(0, 0))
+        assert huella_modelo(v1) != huella_v1
+    print("[OK] Formato .mdl v2 correcto")
+
+
+def test_compactacion_random_forest():
+    """Las variantes compactas son más pequeñas y se guardan como un modelo normal."""
+    with tempfile.TemporaryDirectory() as tmp:
+        csv = escribir_dataset(os.path.join(tmp, "datos.csv"), n_zonas=10, n_dias=7)
+        resultados, _ = entrenar_modelo(csv, "Random Forest Mejorado", usar_cache=False)
+        variantes, tabla = compactar_random_forest(resultados, n_arboles=(10, 50), profundidades=(10,))
+        print(tabla.to_string(index=False))
+
+        assert list(tabla["Variante"]) == [
+            "Original", "Subconjunto de 10 árboles", "Subconjunto de 50 árboles", "Destilado (profundidad 10)"
+        ]
+        assert list(tabla["Árboles"]) == [250, 10, 50, 1]
+        original = tabla.iloc[0]
+        assert (tabla["Tamaño (MB)"].iloc[1:] < original["Tamaño (MB)"]).all()
+        # Con 50 de 250 árboles bien elegidos la precisión apenas cambia
+        assert tabla.iloc[2]["RMSE"] < original["RMSE"] * 1.05
+        assert np.isclose(original["RMSE"], resultados["rmse"])
+
+        compacto = resultados_compactados(resultados, variantes, tabla, "Subconjunto de 10 árboles")
+        assert len(compacto["modelo"].named_steps["model"].estimators_) == 10
+        assert len(resultados["modelo"].named_steps["model"].estimators_) == 250
+        cargado = _guardar_y_cargar(compacto, os.path.join(tmp, "compacto.mdl"))
+        assert cargado["compactacion"]["variante"] == "Subconjunto de 10 árboles"
+        assert np.isclose(cargado["metricas"]["rmse"], tabla.iloc[1]["RMSE"])
+        X_pred = preparar_datos_prediccion(resultados["X_test"].assign(fecha="05/03/2024 08:00"), cargado)
+        np.testing.assert_allclose(cargado["modelo"].predict(X_pred), compacto["modelo"].predict(X_pred))
+    print("[OK] Compactación de Random Forest")
+
+
+def test_linea_base():
+    """La línea base indexa medias por zona, día y cuarto de hora y viaja en la sección de estadísticas."""
+    with tempfile.TemporaryDirectory() as tmp:
+        csv = escribir_dataset(os.path.join(tmp, "datos.csv"), n_zonas=8, n_dias=14)
+        resultados, _ = entrenar_modelo(csv, ALGORITMO_LINEA_BASE, usar_cache=False)
+        print(f"  RMSE: {resultados['rmse']:.2f}  R2: {resultados['r2']:.4f}")
+        assert resultados["features_numericas"] == ["id", "dia_semana", "cuarto_hora", "precip"]
+        assert resultados["r2"] > 0.5
+
+        # Sin ajuste por lluvia, cada celda es la media de sus filas de entrenamiento
+        modelo = resultados["modelo"]
+        X_train, y_train = resultados["X_train"], resultados["y_train"]
+        celda = X_train.iloc[0]
+        mismas = ((X_train["id"] == celda["id"]) & (X_train["dia_semana"] == celda["dia_semana"])
+                  & (X_train["cuarto_hora"] == celda["cuarto_hora"]))
+        sin_lluvia = X_train.iloc[[0]].assign(precip=0.0)
+        assert np.isclose(modelo.predict(sin_lluvia)[0], y_train[mismas].mean(), rtol=1e-5)
+
+        paquete = crear_paquete_modelo(resultados)
+        cargado = _guardar_y_cargar(resultados, os.path.join(tmp, "base.mdl"))
+        df_pred = pd.DataFrame({
+            "id": [1001, 1004, 99_999], "fecha": "12/03/2024 08:15", "precip": [0.0, 3.0, 0.0], "conditionsDay": "rain"
+        })
+        esperado = paquete["modelo"].predict(preparar_datos_prediccion(df_pred, paquete))
+        np.testing.assert_allclose(cargado["modelo"].predict(preparar_datos_prediccion(df_pred, cargado)), esperado)
+        # La predicción directa (sin pandas) coincide y una zona no vista recibe el perfil común
+        directa = modelo.predecir_zonas([1001, 99_999], "12/03/2024 08:15", 0.0)
+        np.testing.assert_allclose(directa, esperado[[0, 2]])
+        assert np.isclose(directa[1], modelo.tabla_[-1, 1, 33])
+
+        inicio = time.perf_counter()
+        for _ in range(1000):
+            modelo.predecir_zonas([1001, 1002, 1003], "12/03/2024 08:15", 0.0)
+        t_directa = (time.perf_counter() - inicio) / 1000
+        print(f"  Predicción directa: {t_directa * 1e6:.0f} µs")
+        assert t_directa < 1e-3
+
+        # Cualquier modelo lleva su línea base de respaldo, legible sin cargar el estimador
+        resultados_rf, _ = entrenar_modelo(csv, "Random Forest Mejorado", usar_cache=False)
+        cargado = _guardar_y_cargar(resultados_rf, os.path.join(tmp, "rf.mdl"))
+        respaldo = cargado["linea_base"]
+        assert cargado.secciones_cargadas == ["estadisticas"]
+        np.testing.assert_allclose(respaldo.predecir_zonas([1001], "12/03/2024 08:15", 0.0), esperado[[0]], rtol=0.2)
+        # El respaldo guarda la tabla en float16: la mitad de bytes y casi la misma predicción
+        assert respaldo.tabla_.dtype == np.float16 and modelo.tabla_.dtype == np.float32
+        compacta = modelo.compacta()
+        assert compacta.tabla_.nbytes * 2 == modelo.tabla_.nbytes
+        np.testing.assert_allclose(compacta.predict(X_train), modelo.predict(X_train), rtol=1e-3)
+    print("[OK] Línea base")
+
+
+if __name__ == "__main__":
+    test_entrenamiento_incremental()
+    test_entrenamiento_incremental_sin_test()
+    test_boosting_histogramas()
+    test_entrenamiento_paralelo()
+    test_busqueda_halving()
+    test_matriz_compacta()
+    test_backtest_semanal()
+    test_backtest_semana_vacia()
+    test_cache_modelos()
+    test_formato_v2()
+    test_compactacion_random_forest()
+    test_linea_base()
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+Pruebas del feature engineering y de la caché de features en disco.
+"""
+
+import sys
+import os
+import tempfile
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+import pandas as pd
+import algorithms
+from algorithms import (
+    cargar_features_entrenamiento, _agregar_features_temporales, AcumuladorEstadisticas,
+    TablaLookup, preparar_datos_prediccion
+)
+from datos_sinteticos import escribir_dataset, generar_dataset
+from benchmark_calendario import features_temporales_referencia
+
+
+def test_cache_features():
+    """La segunda carga del mismo CSV sale de la caché y es idéntica a la primera."""
+    print("PRUEBA CACHÉ DE FEATURES\n")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        csv = escribir_dataset(os.path.join(tmp, "datos.csv"), n_zonas=5, n_dias=3)
+        cache_dir = os.path.join(tmp, "cache")
+
+        primera = cargar_features_entrenamiento(csv, directorio_cache=cache_dir)
+        segunda = cargar_features_entrenamiento(csv, directorio_cache=cache_dir)
+
+        print(f"  Primera carga desde caché: {primera['desde_cache']}")
+        print(f"  Segunda carga desde caché: {segunda['desde_cache']}")
+        assert not primera["desde_cache"]
+        assert segunda["desde_cache"]
+
+        pd.testing.assert_frame_equal(primera["df"], segunda["df"])
+        pd.testing.assert_frame_equal(primera["zona_stats"], segunda["zona_stats"])
+        assert primera["zona_defaults"] == segunda["zona_defaults"]
+        assert primera["huella_dataset"] == segunda["huella_dataset"]
+
+        # Cambiar el contenido del CSV invalida la entrada
+        escribir_dataset(csv, n_zonas=5, n_dias=3, semilla=1)
+        tercera = cargar_features_entrenamiento(csv, directorio_cache=cache_dir)
+        assert not tercera["desde_cache"]
+        assert tercera["huella_dataset"] != primera["huella_dataset"]
+
+        # Cambiar la versión del feature engineering también
+        version = algorithms.VERSION_FEATURES
+        try:
+            algorithms.VERSION_FEATURES = version + 1
+            assert not cargar_features_entrenamiento(csv, directorio_cache=cache_dir)["desde_cache"]
+        finally:
+            algorithms.VERSION_FEATURES = version
+
+    print("\n[OK] Caché de features correcta")
+
+
+def test_tabla_calendario_identica():
+    """Las features de calendario por fecha única coinciden bit a bit con el cálculo fila a fila."""
+    df = generar_dataset(n_zonas=7, n_dias=2)
+    df.loc[3, "conditionsDay"] = None
+    pd.testing.assert_frame_equal(
+        _agregar_features_temporales(df),
+        features_temporales_referencia(df),
+        check_exact=True
+    )
+    print("[OK] Tabla de calendario idéntica a la implementación fila a fila")
+
+
+def test_acumulador_estadisticas():
+    """Acumular por bloques (y combinar acumuladores) equivale a un groupby completo."""
+    rng = np.random.default_rng(0)
+    claves = rng.integers(0, 50, 10_000)
+    valores = rng.normal(200, 60, 10_000)
+
+    a, b = AcumuladorEstadisticas(), AcumuladorEstadisticas()
+    for inicio in range(0, 6_000, 1_000):
+        a.actualizar(claves[inicio:inicio + 1_000], valores[inicio:inicio + 1_000])
+    b.actualizar(claves[6_000:], valores[6_000:])
+    a.combinar(b)
+
+    esperado = pd.Series(valores).groupby(claves).agg(["mean", "std", "min", "max"])
+    obtenido = a.resultado().set_index("clave")
+    np.testing.assert_allclose(obtenido[["mean", "std", "min", "max"]].to_numpy(), esperado.to_numpy(), rtol=1e-9)
+    print("[OK] Acumulador incremental equivalente al groupby")
+
+
+def test_lectura_por_bloques():
+    """La lectura por bloques produce las mismas features que la lectura completa."""
+    with tempfile.TemporaryDirectory() as tmp:
+        df = generar_dataset(n_zonas=6, n_dias=3)
+        # Huecos en una columna entera solo en el último bloque: su array reservado pasa a float32
+        df.loc[df.index[-5:], "precipprob"] = np.nan
+        csv = os.path.join(tmp, "datos.csv")
+        df.to_csv(csv, sep=";", index=False)
+        completo = cargar_features_entrenamiento(csv, usar_cache=False)
+        bloques = cargar_features_entrenamiento(csv, usar_cache=False, tam_bloque=1_000)
+        assert bloques["memoria_pico_mb"] is None
+
+        medido = cargar_features_entrenamiento(csv, usar_cache=False, tam_bloque=1_000, medir_memoria=True)
+        print(f"  Memoria pico por bloques: {medido['memoria_pico_mb']:.2f} MB")
+        assert medido["memoria_pico_mb"] > 0
+        assert bloques["filas_leidas"] == len(completo["df"])
+        pd.testing.assert_frame_equal(bloques["df"], completo["df"], check_exact=False, rtol=1e-9)
+        pd.testing.assert_frame_equal(bloques["zona_stats"], completo["zona_stats"], check_exact=False, rtol=1e-9)
+        pd.testing.assert_frame_equal(bloques["hora_stats"], completo["hora_stats"], check_exact=False, rtol=1e-9)
+
+        muestra = cargar_features_entrenamiento(csv, usar_cache=False, tam_bloque=1_000, fraccion_muestra=0.25)
+        assert len(muestra["df"]) < len(completo["df"]) / 2
+        pd.testing.assert_frame_equal(muestra["zona_stats"], completo["zona_stats"], check_exact=False, rtol=1e-9)
+    print("[OK] Lectura por bloques equivalente a la lectura completa")
+
+
+def test_lectura_por_bloques_csv_vacio():
+    """Un CSV sin filas (solo cabecera o vacío) da un ValueError claro."""
+    with tempfile.TemporaryDirectory() as tmp:
+        cabecera = os.path.join(tmp, "cabecera.csv")
+        generar_dataset(n_zonas=1, n_dias=1).head(0).to_csv(cabecera, sep=";", index=False)
+        vacio = os.path.join(tmp, "vacio.csv")
+        open(vacio, "w").close()
+        for csv in (cabecera, vacio):
+            try:
+                cargar_features_entrenamiento(csv, usar_cache=False, tam_bloque=1_000)
+                assert False, "un CSV sin filas debería fallar"
+            except ValueError as e:
+                assert "no tiene filas" in str(e)
+    print("[OK] CSV sin filas rechazado")
+
+
+def _estadisticas_con_merge(df_feat, datos):
+    """Implementación anterior: merge por id y hora seguido de fillna con los valores por defecto."""
+    df_feat = df_feat.merge(datos["zona_stats"], on="id", how="left")
+    for col, valor in datos["zona_defaults"].items():
+        df_feat[col] = df_feat[col].fillna(valor)
+    df_feat = df_feat.merge(datos["hora_stats"], on="hora", how="left")
+    for col, valor in datos["hora_defaults"].items():
+        df_feat[col] = df_feat[col].fillna(valor)
+    return df_feat
+
+
+def test_lookup_equivale_merge():
+    """El gather sobre arrays densos da lo mismo que el merge, también para ids no vistos."""
+    with tempfile.TemporaryDirectory() as tmp:
+        csv = escribir_dataset(os.path.join(tmp, "datos.csv"), n_zonas=6, n_dias=2)
+        datos = cargar_features_entrenamiento(csv, usar_cache=False)
+
+    df_pred = generar_dataset(n_zonas=8, n_dias=1, semilla=3).drop(columns="intensidad")
+    df_pred.loc[0, "id"] = 99_999
+    df_feat = _agregar_features_temporales(df_pred)
+
+    esperado = _estadisticas_con_merge(df_feat, datos)
+    columnas = [c for c in esperado.columns if c.startswith(("zona_", "hora_"))]
+    paquete = {**datos, "median_values": {}}
+    obtenido = preparar_datos_prediccion(df_pred, paquete)
+    pd.testing.assert_frame_equal(obtenido[columnas], esperado[columnas], check_exact=True)
+    assert obtenido.loc[0, "zona_intensidad_media"] == datos["zona_defaults"]["zona_intensidad_media"]
+
+    # Ids flotantes, negativos o ausentes, y claves no enteras (búsqueda binaria)
+    lookup = TablaLookup(datos["zona_stats"], "id", datos["zona_defaults"])
+    ids = np.array([1001.0, 1003.0, 1003.5, -1.0, np.nan, 5e9])
+    assert list(lookup.posiciones(ids)) == [0, 2, 6, 6, 6, 6]
+    stats_float = datos["zona_stats"].assign(id=datos["zona_stats"]["id"] + 0.5)
+    lookup_float = TablaLookup(stats_float, "id", datos["zona_defaults"])
+    assert lookup_float.mapa is None
+    assert list(lookup_float.posiciones(np.array([1001.5, 1001.0, 1006.5]))) == [0, 6, 5]
+    print("[OK] Lookups densas equivalentes al merge")
+
+
+if __name__ == "__main__":
+    test_cache_features()
+    test_tabla_calendario_identica()
+    test_acumulador_estadisticas()
+    test_lectura_por_bloques()
+    test_lectura_por_bloques_csv_vacio()
+    test_lookup_equivale_merge()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Pruebas del modelo compilado: mismas predicciones que el Pipeline y menor latencia.
+"""
+
+import sys
+import os
+import time
+import tempfile
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+import pandas as pd
+from algorithms import entrenar_modelo, preparar_datos_prediccion, crear_paquete_modelo, cubo_prediccion
+from formato_modelo import guardar_paquete_modelo
+from inferencia import exportar_modelo_compilado, cargar_modelo_compilado, ruta_bundle
+from datos_sinteticos import escribir_dataset
+
+FECHA = "12/03/2024 08:15"
+LIMITE_UNA_ZONA_S = 1e-3
+METEO = {
+    "temp": 14.0, "feelslike": 12.0, "dew": 5.0, "humidity": 60.0, "precip": 0.0, "precipprob": 10,
+    "windgust": 20.0, "windspeed": 10.0, "winddir": 180, "cloudcover": 50.0, "visibility": 10.0,
+    "conditionsDay": "rain",
+}
+
+
+def _prediccion_pipeline(paquete, ids, meteo):
+    df = pd.DataFrame([{"id": i, "fecha": FECHA, **meteo} for i in ids])
+    return paquete["modelo"].predict(preparar_datos_prediccion(df, paquete))
+
+
+def test_modelo_compilado_equivalente():
+    """El .infer.npz predice lo mismo que el Pipeline, también con zonas y categorías no vistas."""
+    algoritmos = ["Random Forest Mejorado", "Gradient Boosting (histogramas)", "Deep Learning Mejorado"]
+    ids = [1001, 1004, 1006, 99_999]
+    with tempfile.TemporaryDirectory() as tmp:
+        csv = escribir_dataset(os.path.join(tmp, "datos.csv"), n_zonas=6, n_dias=4)
+        for algoritmo in algoritmos:
+            resultados, _ = entrenar_modelo(csv, algoritmo, usar_cache=False)
+            ruta = os.path.join(tmp, "modelo.mdl")
+            paquete = crear_paquete_modelo(resultados)
+            guardar_paquete_modelo(paquete, ruta)
+            assert exportar_modelo_compilado(paquete, ruta) == ruta_bundle(ruta)
+            compilado = cargar_modelo_compilado(ruta)
+            assert compilado is not None
+
+            for meteo in (METEO, {**METEO, "conditionsDay": "snow", "temp": None}):
+                esperado = _prediccion_pipeline(paquete, ids, meteo)
+                obtenido = compilado.predecir(compilado.matriz(ids, FECHA, meteo))
+                np.testing.assert_allclose(obtenido, esperado, rtol=1e-6, atol=1e-3)
+
+            inicio = time.perf_counter()
+            for _ in range(50):
+                compilado.predecir(compilado.matriz([1003], FECHA, METEO))
+            t_compilado = (time.perf_counter() - inicio) / 50
+            inicio = time.perf_counter()
+            for _ in range(5):
+                _prediccion_pipeline(paquete, [1003], METEO)
+            t_pipeline = (time.perf_counter() - inicio) / 5
+            print(f"  {algoritmo:35s} compilado {t_compilado * 1e3:.2f} ms  pipeline {t_pipeline * 1e3:.2f} ms")
+            assert t_compilado < t_pipeline
+
+            # Objetivo: una zona en bastante menos de 1 ms (medido: 0,05-0,45 ms según el
+            # algoritmo); la mediana de muchas llamadas absorbe las pausas puntuales
+            X = compilado.matriz([1003], FECHA, METEO)
+            tiempos = []
+            for _ in range(200):
+                inicio = time.perf_counter()
+                compilado.predecir(X)
+                tiempos.append(time.perf_counter() - inicio)
+            mediana = float(np.median(tiempos))
+            print(f"  {'':35s} una zona: mediana {mediana * 1e3:.3f} ms")
+            assert mediana < LIMITE_UNA_ZONA_S, mediana
+
+        # Un .mdl más reciente que su .infer.npz invalida el compilado
+        os.utime(ruta_bundle(ruta), (0, 0))
+        assert cargar_modelo_compilado(ruta) is None
+    print("[OK] Modelo compilado equivalente al Pipeline")
+
+
+def test_cubo_prediccion():
+    """El cubo zonas × cuartos de hora coincide con preparar_datos_prediccion sobre todas las combinaciones."""
+    with tempfile.TemporaryDirectory() as tmp:
+        csv = escribir_dataset(os.path.join(tmp, "datos.csv"), n_zonas=6, n_dias=3)
+        resultados, _ = entrenar_modelo(csv, "Random Forest Mejorado", usar_cache=False)
+    paquete = crear_paquete_modelo(resultados)
+
+    ids = [1001, 1003, 1006, 99_999]
+    meteo = [{**METEO, "temp": 5.0 + i % 20, "conditionsDay": "snow" if i % 7 == 0 else "rain"} for i in range(192)]
+    inicio = time.perf_counter()
+    cubo = cubo_prediccion(paquete, ids, "2024-03-12", horas=48, meteo=meteo, filas_por_lote=50)
+    print(f"  Cubo {cubo['intensidad'].shape} en {time.perf_counter() - inicio:.2f} s")
+
+    assert cubo["intensidad"].shape == (4, 192) and cubo["intensidad"].dtype == np.float32
+    assert cubo["fechas"][-1] == pd.Timestamp("2024-03-13 23:45")
+    filas = [{"id": i, "fecha": f.strftime("%d/%m/%Y %H:%M"), **m} for f, m in zip(cubo["fechas"], meteo) for i in ids]
+    esperado = paquete["modelo"].predict(preparar_datos_prediccion(pd.DataFrame(filas), paquete))
+    np.testing.assert_array_equal(cubo["intensidad"], esperado.reshape(192, 4).T.astype(np.float32))
+
+    # Misma meteorología para todo el horizonte
+    fijo = cubo_prediccion(paquete, ids, "2024-03-12 00:00", horas=24, meteo=METEO)
+    assert fijo["intensidad"].shape == (4, 96)
+    print("[OK] Cubo de previsión equivalente")
+
+
+if __name__ == "__main__":
+    test_modelo_compilado_equivalente()
+    test_cubo_prediccion()
@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+"""
+Pruebas de la meteorología por zona: descarga concurrente de varios municipios
+contra un servidor local y asignación de cada zona a la estación más cercana.
+"""
+
+import sys
+import os
+import time
+import tempfile
+import threading
+from datetime import datetime
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+import pandas as pd
+from aemet_scraper import vaciar_cache_aemet, estadisticas_cache_aemet, PrevisionHoraria
+from aemet_mapper import AemetMapper
+from algorithms import entrenar_modelo, crear_paquete_modelo, cubo_prediccion
+import meteo_zonas
+from meteo_zonas import (
+    descargar_previsiones, meteo_por_zona, coordenadas_zonas, estacion_mas_cercana, cargar_zonas,
+    RefrescoEstaciones, grupos_por_estacion, cubo_prediccion_zonas, seleccionar_zonas
+)
+from datos_sinteticos import escribir_dataset
+
+CIELOS = {"norte": "Despejado", "sur": "Cubierto con lluvia", "este": "Nuboso", "oeste": "Poco nuboso"}
+
+
+def pagina_municipio(nombre: str, temperatura: int) -> bytes:
+    """Tabla horaria de un día completo con la misma temperatura en todas las horas."""
+    filas = "\n".join(
+        f'<tr class="fila_hora cabecera_niv2"><td>{h:02d}</td><td><img title="{CIELOS[nombre]}"/></td>'
+        f'<td class="borde_rb"> {temperatura}</td><td class="borde_rb"> {temperatura}</td>'
+        f'<td class="borde_rb"><div class="texto_viento">N</div><div class="texto_km_viento"><div>5</div></div></td>'
+        f'<td class="borde_rb"> 10</td><td class="borde_rb"> 0</td><td class="borde_rb"> 0</td><td class="borde_rb"> 70</td></tr>'
+        for h in range(24)
+    )
+    return f"<html><body><table>\n{filas}\n</table></body></html>".encode("utf-8")
+
+
+class ServidorMunicipios:
+    """Servidor HTTP local con una página por municipio que registra las peticiones y cuántas hay a la vez."""
+
+    def __init__(self, retardo_s=0.0):
+        self.retardo_s = retardo_s
+        self.paginas = {f"/horas/{n}": pagina_municipio(n, t) for n, t in zip(CIELOS, (10, 20, 30, 40))}
+        self.peticiones = []
+        self.activas = 0
+        self.max_activas = 0
+        self._cerrojo = threading.Lock()
+        servidor = self
+
+        class Manejador(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with servidor._cerrojo:
+                    servidor.activas += 1
+                    servidor.max_activas = max(servidor.max_activas, servidor.activas)
+                    servidor.peticiones.append((self.path, time.monotonic()))
+                try:
+                    time.sleep(servidor.retardo_s)
+                    pagina = servidor.paginas.get(self.path)
+                    if pagina is None:
+                        self.send_response(404)
+                        self.end_headers()
+                        return
+                    self.send_response(200)
+                    self.send_header("Content-Length", str(len(pagina)))
+                    self.end_headers()
+                    self.wfile.write(pagina)
+                finally:
+                    with servidor._cerrojo:
+                        servidor.activas -= 1
+
+            def log_message(self, formato, *args):
+                pass
+
+        self.http = ThreadingHTTPServer(("127.0.0.1", 0), Manejador)
+        self.http.daemon_threads = True
+        threading.Thread(target=self.http.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.http.server_address[1]}"
+
+    def estaciones(self, nombres=tuple(CIELOS)):
+        # Cuatro puntos alrededor de Sol
+        posiciones = {"norte": (40.50, -3.70), "sur": (40.34, -3.70), "este": (40.42, -3.58), "oeste": (40.42, -3.82)}
+        return [
+            {"nombre": n, "url": f"{self.url}/horas/{n}", "lat": posiciones[n][0], "lon": posiciones[n][1]}
+            for n in nombres
+        ]
+
+    def cerrar(self):
+        self.http.shutdown()
+        self.http.server_close()
+
+
+def test_descarga_concurrente():
+    """Las descargas se solapan hasta el límite de conexiones y respetan el intervalo por servidor."""
+    vaciar_cache_aemet()
+    servidor = ServidorMunicipios(retardo_s=0.3)
+
+    # El intervalo se comprueba en el cliente, al salir del limitador: la llegada al
+    # servidor pasa por un hilo y puede acercar dos peticiones que salieron espaciadas
+    inicios = []
+    esperar_original = meteo_zonas._LimitadorHost.esperar
+
+    async def esperar_registrando(limitador, host):
+        await esperar_original(limitador, host)
+        inicios.append(time.monotonic())
+
+    meteo_zonas._LimitadorHost.esperar = esperar_registrando
+    try:
+        inicio = time.perf_counter()
+        previsiones = descargar_previsiones(servidor.estaciones(), max_conexiones=4, intervalo_host_s=0.05)
+        concurrente = time.perf_counter() - inicio
+        meteo_zonas._LimitadorHost.esperar = esperar_original
+        assert [len(p) for p in previsiones] == [24] * 4
+        assert servidor.max_activas > 1
+        # Secuencial serían 4 x 0.3 s
+        assert concurrente < 1.0, concurrente
+        # Margen solo para la resolución del reloj del bucle de eventos
+        assert len(inicios) == 4 and min(np.diff(inicios)) >= 0.045, np.diff(inicios)
+        print(f"  4 municipios en {concurrente:.2f} s (máx. {servidor.max_activas} conexiones)")
+
+        # Páginas vigentes: ninguna petición nueva
+        descargar_previsiones(servidor.estaciones(), max_conexiones=4, intervalo_host_s=0.05)
+        assert len(servidor.peticiones) == 4
+
+        vaciar_cache_aemet()
+        servidor.max_activas = 0
+        descargar_previsiones(servidor.estaciones(), max_conexiones=1, intervalo_host_s=0.0)
+        assert servidor.max_activas == 1
+
+        # Un municipio que falla devuelve una tabla vacía sin afectar a los demás
+        vaciar_cache_aemet()
+        estaciones = servidor.estaciones() + [{"nombre": "roto", "url": servidor.url + "/horas/roto", "lat": 0, "lon": 0}]
+        previsiones = descargar_previsiones(estaciones, max_conexiones=4, intervalo_host_s=0.0)
+        assert [len(p) for p in previsiones] == [24, 24, 24, 24, 0]
+        assert estadisticas_cache_aemet()["errores"] == 1
+
+        # Ni siquiera una URL imposible de interpretar hace fallar el lote
+        estaciones[-1]["url"] = "http://[estacion-mal-configurada/horas"
+        previsiones = descargar_previsiones(estaciones, max_conexiones=4, intervalo_host_s=0.0)
+        assert [len(p) for p in previsiones] == [24, 24, 24, 24, 0]
+    finally:
+        meteo_zonas._LimitadorHost.esperar = esperar_original
+        servidor.cerrar()
+    print("[OK] Descarga concurrente")
+
+
+def test_estacion_mas_cercana():
+    """Cada zona recibe la meteorología de la estación con datos más cercana."""
+    zonas = cargar_zonas()
+    lat, lon = coordenadas_zonas(zonas)
+    # Catálogo dentro de Madrid
+    assert 40.3 < lat.min() and lat.max() < 40.6 and -3.9 < lon.min() and lon.max() < -3.5
+    fila = zonas.index[zonas["id"] == 5902][0]
+    assert abs(lat[fila] - 40.481374117635) < 1e-9 and abs(lon[fila] + 3.71701445730745) < 1e-9
+
+    vaciar_cache_aemet()
+    servidor = ServidorMunicipios()
+    try:
+        estaciones = servidor.estaciones()
+        previsiones = descargar_previsiones(estaciones, intervalo_host_s=0.0)
+    finally:
+        servidor.cerrar()
+
+    hoy = datetime.now().replace(hour=8, minute=30)
+    inicio = time.perf_counter()
+    meteo = meteo_por_zona(hoy, zonas, estaciones, previsiones)
+    print(f"  {len(meteo):,} zonas asignadas en {(time.perf_counter() - inicio) * 1e3:.1f} ms")
+    assert len(meteo) == len(zonas) and (meteo["id"].to_numpy() == zonas["id"].to_numpy()).all()
+
+    # Mismo resultado que recorrer zona a zona
+    lat_est = np.array([e["lat"] for e in estaciones])
+    lon_est = np.array([e["lon"] for e in estaciones])
+    esperadas = [
+        estaciones[int(np.argmin(((la - lat_est) ** 2 + ((lo - lon_est) * np.cos(np.radians(lat_est.mean()))) ** 2)))]["nombre"]
+        for la, lo in zip(lat, lon)
+    ]
+    assert meteo["estacion"].tolist() == esperadas
+    assert set(meteo["estacion"]) == set(CIELOS)
+    temperaturas = {"norte": 10.0, "sur": 20.0, "este": 30.0, "oeste": 40.0}
+    assert (meteo["temp"] == meteo["estacion"].map(temperaturas)).all()
+    assert (meteo.loc[meteo["estacion"] == "sur", "conditionsDay"] != meteo.loc[meteo["estacion"] == "norte", "conditionsDay"].iloc[0]).all()
+
+    # Sin datos en una estación, sus zonas pasan a la siguiente más cercana
+    previsiones[1] = PrevisionHoraria([], hoy.date())
+    sin_sur = meteo_por_zona(hoy, zonas, estaciones, previsiones)
+    assert "sur" not in set(sin_sur["estacion"])
+    assert (sin_sur["estacion"] == meteo["estacion"])[meteo["estacion"] != "sur"].all()
+
+    # Fuera del horizonte de todas las estaciones
+    vacio = meteo_por_zona(datetime(2000, 1, 1), zonas, estaciones, previsiones)
+    assert list(vacio.columns) == ["id", "estacion"] and vacio["estacion"].isna().all()
+    assert estacion_mas_cercana([40.0], [-3.7], [40.5, 40.1], [-3.7, -3.7]).tolist() == [1]
+    print("[OK] Estación más cercana")
+
+
+def _esperar(condicion, limite_s=5.0):
+    fin = time.monotonic() + limite_s
+    while not condicion():
+        assert time.monotonic() < fin, "tiempo de espera agotado"
+        time.sleep(0.01)
+
+
+def test_refresco_estaciones():
+    """El refresco mantiene una tabla por estación; una estación que falla conserva la última buena."""
+    vaciar_cache_aemet()
+    servidor = ServidorMunicipios()
+    estaciones = servidor.estaciones() + [{"nombre": "roto", "url": servidor.url + "/horas/roto", "lat": 0, "lon": 0}]
+    refresco = RefrescoEstaciones(estaciones, intervalo_host_s=0.0, refresco_min_s=0.05).iniciar()
+    try:
+        _esperar(lambda: refresco.actual() is not None)
+        tablas = refresco.actual()
+        assert [len(t) for t in tablas] == [24, 24, 24, 24, 0]
+        assert refresco.estado()["fallos"] == 0
+
+        # El sur deja de responder: en la siguiente revalidación conserva su tabla
+        del servidor.paginas["/horas/sur"]
+        vaciar_cache_aemet()
+        refresco._caduca = 0.0
+        refresco._proximo_intento = 0.0
+        peticiones = len(servidor.peticiones)
+        refresco.actual()
+        _esperar(lambda: len(servidor.peticiones) >= peticiones + 5 and refresco.actual() is not tablas)
+        assert refresco.actual()[1] is tablas[1] and refresco.estado()["fallos"] == 0
+    finally:
+        refresco.detener()
+        servidor.cerrar()
+    print("[OK] Refresco de varias estaciones")
+
+
+def test_prediccion_por_estacion():
+    """Las zonas se predicen por grupos de estación con la meteorología de la suya."""
+    vaciar_cache_aemet()
+    servidor = ServidorMunicipios()
+    try:
+        estaciones = servidor.estaciones()
+        previsiones = descargar_previsiones(estaciones, intervalo_host_s=0.0)
+    finally:
+        servidor.cerrar()
+
+    # Zonas cerca del norte y del sur (coordenadas con el formato del CSV); 99999 no está en el catálogo
+    catalogo = pd.DataFrame({
+        "id": [1001, 1002, 1003, 1004],
+        "latitud": ["4.051", "4.049", "4.033", "4.035"],
+        "longitud": ["-3.700", "-3.701", "-3.700", "-3.699"],
+    })
+    ids = [1001, 1003, 99_999, 1002, 1004]
+    zonas = seleccionar_zonas(catalogo, ids)
+    assert zonas["id"].tolist() == ids and zonas["latitud"].isna().tolist() == [False, False, True, False, False]
+
+    hoy = datetime.now().replace(hour=8, minute=0, second=0, microsecond=0)
+    meteo = meteo_por_zona(hoy, zonas, estaciones, previsiones)
+    grupos = grupos_por_estacion(meteo)
+    # La zona sin coordenadas cuenta como Puerta del Sol, más cerca del sur
+    assert [g for g, _ in grupos] == [[1001, 1002], [1003, 99_999, 1004]]
+    assert [m["temp"] for _, m in grupos] == [10.0, 20.0]
+    assert grupos[0][1] == AemetMapper().create_prediction_dict(previsiones[0].buscar(hoy))
+    assert all(type(v) in (int, float, str) for _, m in grupos for v in m.values())
+    assert grupos_por_estacion(meteo_por_zona(datetime(2000, 1, 1), zonas, estaciones, previsiones)) == []
+
+    with tempfile.TemporaryDirectory() as tmp:
+        csv = escribir_dataset(os.path.join(tmp, "datos.csv"), n_zonas=4, n_dias=3)
+        resultados, _ = entrenar_modelo(csv, "Random Forest Mejorado", usar_cache=False)
+    paquete = crear_paquete_modelo(resultados)
+
+    # Mismo cubo que predecir cada grupo con la tabla de su estación, hora a hora
+    defecto = {"temp": 15.0, "conditionsDay": "Partially cloudy"}
+    inicio = hoy.replace(hour=0)
+    cubo = cubo_prediccion_zonas(paquete, ids, inicio, horas=24, zonas=catalogo,
+                                 estaciones=estaciones, previsiones=previsiones, meteo_defecto=defecto)
+    assert cubo["intensidad"].shape == (5, 96)
+    mapper = AemetMapper()
+    for filas, estacion in (([0, 3], 0), ([1, 2, 4], 1)):
+        tabla = [mapper.create_prediction_dict(previsiones[estacion].buscar(f)) for f in cubo["fechas"]]
+        esperado = cubo_prediccion(paquete, [ids[i] for i in filas], inicio, horas=24, meteo=tabla)
+        np.testing.assert_array_equal(cubo["intensidad"][filas], esperado["intensidad"])
+
+    # Fuera del horizonte de las tablas: valores por defecto
+    lejano = cubo_prediccion_zonas(paquete, ids, "2000-01-01", horas=24, zonas=catalogo,
+                                   estaciones=estaciones, previsiones=previsiones, meteo_defecto=defecto)
+    np.testing.assert_array_equal(
+        lejano["intensidad"], cubo_prediccion(paquete, ids, "2000-01-01", horas=24, meteo=defecto)["intensidad"]
+    )
+    print("[OK] Predicción por estación")
+
+
+if __name__ == "__main__":
+    test_descarga_concurrente()
+    test_estacion_mas_cercana()
+    test_refresco_estaciones()
+    test_prediccion_por_estacion()
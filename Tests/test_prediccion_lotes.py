@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Pruebas de la predicción por lotes sin interfaz gráfica.
+"""
+
+import sys
+import os
+import json
+import tempfile
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import time
+import numpy as np
+import pandas as pd
+from algorithms import entrenar_modelo, crear_paquete_modelo, niveles_trafico, redondear_fechas_a_15
+from formato_modelo import guardar_paquete_modelo
+from prediccion_lotes import predecir_csv, EXTENSION_PROGRESO
+from datos_sinteticos import escribir_dataset, generar_dataset
+
+
+class Interrupcion(Exception):
+    pass
+
+
+def test_redondeo_fechas():
+    """El redondeo vectorizado coincide con el de la pestaña de predicción."""
+    fechas = pd.Series(["14/01/2026 08:27", "14/01/2026 14:12", "14/01/2026 14:15", "31/12/2025 23:50", "sin fecha"])
+    esperado = ["14/01/2026 08:30", "14/01/2026 14:15", "14/01/2026 14:15", "01/01/2026 00:00", "sin fecha"]
+    assert list(redondear_fechas_a_15(fechas)) == esperado
+    print("[OK] Redondeo de fechas correcto")
+
+
+def test_niveles_trafico():
+    """La clasificación vectorizada coincide con el bucle por fila y usa los valores por defecto para zonas no vistas."""
+    rng = np.random.default_rng(0)
+    n = 5_000
+    zona_stats = pd.DataFrame({
+        "id": np.arange(1000, 1000 + n),
+        "zona_intensidad_media": rng.uniform(50, 800, n),
+        "zona_intensidad_std": np.where(rng.random(n) < 0.01, 0.0, rng.uniform(10, 200, n)),
+    })
+    paquete = {"zona_stats": zona_stats, "zona_defaults": {"zona_intensidad_media": 300.0, "zona_intensidad_std": 80.0}}
+    ids = np.append(zona_stats["id"].to_numpy(), [99_999, 5])
+    pred = rng.uniform(0, 1000, len(ids))
+
+    inicio = time.perf_counter()
+    esperado = []
+    estad = zona_stats.set_index("id")
+    for zona, p in zip(ids, pred):
+        media, std = estad.loc[zona].tolist() if zona in estad.index else (300.0, 80.0)
+        z = (p - media) / (std if std > 0 else 80.0)
+        esperado.append("Bajo" if z <= -0.5 else "Alto" if z >= 0.5 else "Medio")
+    t_bucle = time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    clasificacion = niveles_trafico(pred, paquete, ids)
+    t_vectorizado = time.perf_counter() - inicio
+    print(f"  {len(ids)} zonas: bucle {t_bucle * 1e3:.1f} ms, vectorizado {t_vectorizado * 1e3:.2f} ms")
+
+    assert clasificacion["niveles"].tolist() == esperado
+    assert sum(clasificacion["conteos"].values()) == len(ids)
+    assert clasificacion["conteos"]["Alto"] == esperado.count("Alto")
+    assert np.isclose(clasificacion["z"][-1], (pred[-1] - 300.0) / 80.0)
+
+    # Sin ids ni estadísticas: referencia común para todas las predicciones
+    sin_zonas = niveles_trafico([100.0, 300.0, 500.0], {"zona_defaults": paquete["zona_defaults"]})
+    assert sin_zonas["niveles"].tolist() == ["Bajo", "Medio", "Alto"]
+
+    # Una sola zona sin estadísticas: desviación NaN, se usa escala 1 y no hay z NaN
+    una = niveles_trafico([420.0], {}, [7])
+    assert una["z"].tolist() == [0.0] and una["niveles"].tolist() == ["Medio"]
+    iguales = niveles_trafico([10.0, 10.0], {"zona_defaults": {"zona_intensidad_media": 0.0}})
+    assert iguales["z"].tolist() == [10.0, 10.0] and iguales["conteos"]["Alto"] == 2
+    print("[OK] Clasificación de niveles vectorizada")
+
+
+def test_prediccion_por_bloques_reanudable():
+    """Por bloques, interrumpida y reanudada, la salida es idéntica a la de un único bloque."""
+    with tempfile.TemporaryDirectory() as tmp:
+        csv = escribir_dataset(os.path.join(tmp, "datos.csv"), n_zonas=4, n_dias=3)
+        resultados, _ = entrenar_modelo(csv, "Gradient Boosting (histogramas)", usar_cache=False)
+        modelo = os.path.join(tmp, "modelo.mdl")
+        guardar_paquete_modelo(crear_paquete_modelo(resultados), modelo)
+
+        ejemplares = generar_dataset(n_zonas=5, n_dias=1, semilla=7).drop(columns="intensidad")
+        ejemplares["fecha"] = ejemplares["fecha"].str[:-2] + "07"
+        entrada = os.path.join(tmp, "ejemplares.csv")
+        ejemplares.to_csv(entrada, sep=";", index=False)
+
+        completo = os.path.join(tmp, "completo.csv")
+        resumen = predecir_csv(entrada, modelo, completo, tam_bloque=10**6)
+        assert resumen["filas"] == len(ejemplares) and resumen["bloques"] == 1
+
+        # Interrumpir tras el segundo bloque y relanzar
+        por_bloques = os.path.join(tmp, "bloques.csv")
+
+        def interrumpir(filas):
+            if filas >= 200:
+                raise Interrupcion()
+
+        try:
+            predecir_csv(entrada, modelo, por_bloques, tam_bloque=100, progreso_cb=interrumpir)
+            assert False, "debía interrumpirse"
+        except Interrupcion:
+            pass
+        # Un bloque escrito a medias tras el punto de control se descarta al reanudar
+        with open(por_bloques, "a") as f:
+            f.write("basura parcial")
+        assert os.path.exists(por_bloques + EXTENSION_PROGRESO)
+        with open(por_bloques + EXTENSION_PROGRESO, encoding="utf-8") as f:
+            punto = json.load(f)
+        with open(entrada, "rb") as f:
+            assert punto["bytes_entrada"] == len(b"".join(f.readlines()[:201]))
+
+        # Reanudar salta a esa posición sin leer las filas ya hechas: se
+        # estropean (mismo tamaño y fecha, el trabajo sigue siendo el mismo)
+        # y la salida no cambia
+        st = os.stat(entrada)
+        with open(entrada, "r+b") as f:
+            f.seek(len(f.readline()))
+            f.write(b"x" * (punto["bytes_entrada"] - f.tell() - 1))
+        os.utime(entrada, ns=(st.st_atime_ns, st.st_mtime_ns))
+
+        resumen = predecir_csv(entrada, modelo, por_bloques, tam_bloque=100)
+        print(f"  {resumen['filas']} filas, {resumen['bloques']} bloques ({resumen['bloques_reanudados']} reanudados)")
+        assert resumen["bloques_reanudados"] == 2
+        assert resumen["bloques"] == -(-len(ejemplares) // 100)
+        assert not os.path.exists(por_bloques + EXTENSION_PROGRESO)
+
+        a = pd.read_csv(completo, sep=";")
+        b = pd.read_csv(por_bloques, sep=";")
+        pd.testing.assert_frame_equal(a, b)
+        assert set(a["nivel_trafico"]) <= {"Bajo", "Medio", "Alto"}
+        assert a["fecha"].str.endswith(("00", "15", "30", "45")).all()
+        assert len(a) == len(ejemplares)
+
+        # Una entrada con solo la cabecera da una salida con la misma cabecera que las demás
+        vacia = os.path.join(tmp, "vacia.csv")
+        ejemplares.head(0).to_csv(vacia, sep=";", index=False)
+        salida_vacia = os.path.join(tmp, "salida_vacia.csv")
+        assert predecir_csv(vacia, modelo, salida_vacia)["filas"] == 0
+        with open(salida_vacia, encoding="utf-8") as f, open(completo, encoding="utf-8") as g:
+            assert f.read() == g.readline()
+    print("[OK] Predicción por bloques reanudable")
+
+
+if __name__ == "__main__":
+    test_redondeo_fechas()
+    test_niveles_trafico()
+    test_prediccion_por_bloques_reanudable()
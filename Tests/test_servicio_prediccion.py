@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Pruebas del servicio HTTP local de predicción (solo con clientes locales).
+"""
+
+import sys
+import os
+import json
+import tempfile
+import urllib.request
+import urllib.error
+from concurrent.futures import ThreadPoolExecutor
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+import pandas as pd
+from algorithms import entrenar_modelo, crear_paquete_modelo, preparar_datos_prediccion
+from formato_modelo import guardar_paquete_modelo
+from inferencia import exportar_modelo_compilado
+from servicio_prediccion import ServicioPrediccion
+from datos_sinteticos import escribir_dataset
+
+METEO = {"temp": 14.0, "humidity": 60.0, "precip": 0.0, "windspeed": 10.0, "conditionsDay": "rain"}
+
+
+def _post(url, cuerpo):
+    peticion = urllib.request.Request(url, data=json.dumps(cuerpo).encode(), headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(peticion, timeout=30) as respuesta:
+        return json.loads(respuesta.read())
+
+
+def _probar_servicio(ruta_modelo, paquete):
+    servicio = ServicioPrediccion(ruta_modelo, ventana_ms=20)
+    host, puerto = servicio.iniciar(puerto=0)
+    url = f"http://{host}:{puerto}"
+    try:
+        peticiones = [
+            {"ids": [1001 + i % 4, 1002, 99_999], "fecha": f"{5 + i % 3:02d}/03/2024 {i % 24:02d}:15", "meteo": METEO}
+            for i in range(40)
+        ]
+        with ThreadPoolExecutor(max_workers=20) as pool:
+            respuestas = list(pool.map(lambda p: _post(url + "/predecir", p), peticiones))
+
+        for peticion, respuesta in zip(peticiones, respuestas):
+            df = pd.DataFrame([{"id": i, "fecha": peticion["fecha"], **METEO} for i in peticion["ids"]])
+            esperado = paquete["modelo"].predict(preparar_datos_prediccion(df, paquete))
+            np.testing.assert_allclose(respuesta["intensidades"], esperado, rtol=1e-6, atol=1e-3)
+            assert set(respuesta["niveles"]) <= {"Bajo", "Medio", "Alto"}
+
+        with urllib.request.urlopen(url + "/estadisticas", timeout=30) as r:
+            estadisticas = json.loads(r.read())
+        print(f"  {estadisticas['peticiones']} peticiones en {estadisticas['lotes']} lotes, "
+              f"p95 {estadisticas['latencia_p95_ms']:.1f} ms, compilado: {estadisticas['modelo_compilado']}")
+        assert estadisticas["peticiones"] == 40 and estadisticas["filas"] == 120
+        assert estadisticas["lotes"] < estadisticas["peticiones"]
+
+        # Una hora que no cae en :15 se redondea hacia arriba, como en la predicción por lotes
+        respuesta = _post(url + "/predecir", {"ids": [1001, 99_999], "fecha": "05/03/2024 23:50", "meteo": METEO})
+        df = pd.DataFrame([{"id": i, "fecha": "06/03/2024 00:00", **METEO} for i in (1001, 99_999)])
+        esperado = paquete["modelo"].predict(preparar_datos_prediccion(df, paquete))
+        np.testing.assert_allclose(respuesta["intensidades"], esperado, rtol=1e-6, atol=1e-3)
+
+        invalidas = (
+            {"ids": [1001], "fecha": "mañana"},
+            {"ids": [1001], "fecha": "05/03/2024 08:15", "meteo": [1]},
+            {"ids": [], "fecha": "05/03/2024 08:15", "meteo": METEO},
+        )
+        for invalida in invalidas:
+            try:
+                _post(url + "/predecir", invalida)
+                assert False, "debía rechazarse"
+            except urllib.error.HTTPError as e:
+                assert e.code == 400
+
+        # Una meteorología imposible de convertir en el mismo lote que otras dos:
+        # solo esa petición falla y las demás reciben su predicción
+        fecha = "05/03/2024 08:15"
+        futuros = [
+            servicio.predecir([1001, 1002], fecha, METEO),
+            servicio.predecir([1003], fecha, {**METEO, "temp": "caliente"}),
+            servicio.predecir([1004], fecha, METEO),
+        ]
+        buenos = [futuros[0].result(timeout=30), futuros[2].result(timeout=30)]
+        try:
+            futuros[1].result(timeout=30)
+            assert False, "debía fallar"
+        except ValueError:
+            pass
+        df = pd.DataFrame([{"id": i, "fecha": fecha, **METEO} for i in (1001, 1002, 1004)])
+        esperado = paquete["modelo"].predict(preparar_datos_prediccion(df, paquete))
+        np.testing.assert_allclose(buenos[0]["intensidades"] + buenos[1]["intensidades"], esperado, rtol=1e-6, atol=1e-3)
+        final = servicio.estadisticas()
+        assert final["errores"] == 1 and final["lotes_repetidos"] == 1
+    finally:
+        servicio.detener()
+    return estadisticas
+
+
+def test_servicio_agrupa_peticiones():
+    """Peticiones concurrentes se agrupan en lotes y dan lo mismo que el Pipeline, con y sin modelo compilado."""
+    with tempfile.TemporaryDirectory() as tmp:
+        csv = escribir_dataset(os.path.join(tmp, "datos.csv"), n_zonas=4, n_dias=2)
+        resultados, _ = entrenar_modelo(csv, "Gradient Boosting (histogramas)", usar_cache=False)
+        paquete = crear_paquete_modelo(resultados)
+        ruta = os.path.join(tmp, "modelo.mdl")
+        guardar_paquete_modelo(paquete, ruta)
+
+        assert not _probar_servicio(ruta, paquete)["modelo_compilado"]
+        exportar_modelo_compilado(paquete, ruta)
+        assert _probar_servicio(ruta, paquete)["modelo_compilado"]
+    print("[OK] Servicio de predicción con micro-batching")
+
+
+if __name__ == "__main__":
+    test_servicio_agrupa_peticiones()
@@ -1,13 +1,248 @@
 """
 Web scraping mejorado para AEMET.
 Extrae datos meteorológicos de la página de predicción de AEMET.
+
+Las páginas descargadas se guardan en una caché compartida por todas las
+instancias del proceso: una respuesta vale hasta la siguiente actualización
+de AEMET (a la hora en punto, con un margen) y después se revalida con una
+petición condicional (If-None-Match / If-Modified-Since). Si varios hilos
+piden la misma página a la vez, solo uno la descarga y el resto esperan su
+resultado.
+
+La tabla horaria se analiza con lxml en una sola pasada: cada fila se recorre
+celda a celda y los campos se toman por su posición en la tabla.
 """
 
+import time
+import threading
 import requests
 import re
+from concurrent.futures import Future
 from bs4 import BeautifulSoup
+from lxml import etree, html as lxml_html
 from typing import Dict, List, Any, Optional
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
+
+# AEMET publica las predicciones por municipios como mucho una vez por hora,
+# unos minutos después de la hora en punto
+MARGEN_PUBLICACION_S = 300
+
+_paginas = {}
+_en_vuelo = {}
+_cerrojo_paginas = threading.Lock()
+_estadisticas_paginas = {"aciertos": 0, "descargas": 0, "revalidaciones": 0, "compartidas": 0, "errores": 0}
+
+# Posición de cada campo en las filas de la tabla horaria (la celda 4 es la del
+# viento: dirección y velocidad; la 7, nieve, no se usa)
+COLUMNAS_HORARIAS = {
+    "hora": 0, "estadoCielo": 1, "temperatura": 2, "sensacionTermica": 3, "viento": 4,
+    "rachaMaxima": 5, "precipitacion": 6, "humedadRelativa": 8,
+}
+_NUMERO = re.compile(r"-?\d+")
+
+# Cabeceras de día de la tabla horaria ("jueves 12 de marzo", o "12/03")
+MESES = ["enero", "febrero", "marzo", "abril", "mayo", "junio", "julio", "agosto",
+         "septiembre", "octubre", "noviembre", "diciembre"]
+_FECHA_CABECERA = re.compile(r"\b(\d{1,2})\s+de\s+(" + "|".join(MESES) + r")\b", re.IGNORECASE)
+_FECHA_CABECERA_NUMERICA = re.compile(r"\b(\d{1,2})/(\d{1,2})\b")
+
+
+def _caducidad(ahora: float) -> float:
+    """Instante de la siguiente actualización de AEMET (hora en punto + margen) posterior a ahora."""
+    return ((ahora - MARGEN_PUBLICACION_S) // 3600 + 1) * 3600 + MARGEN_PUBLICACION_S
+
+
+def vaciar_cache_aemet():
+    """Descarta las páginas guardadas y reinicia los contadores."""
+    with _cerrojo_paginas:
+        _paginas.clear()
+        for clave in _estadisticas_paginas:
+            _estadisticas_paginas[clave] = 0
+
+
+def pagina_vigente(url: str) -> bool:
+    """True si la página está en la caché y todavía no hay que revalidarla."""
+    with _cerrojo_paginas:
+        entrada = _paginas.get(url)
+        return entrada is not None and time.time() < entrada["caduca"]
+
+
+def caducidad_pagina(url: str) -> float:
+    """Instante (time.time()) en que caduca la página guardada; 0 si no está en la caché."""
+    with _cerrojo_paginas:
+        entrada = _paginas.get(url)
+        return entrada["caduca"] if entrada is not None else 0.0
+
+
+def estadisticas_cache_aemet() -> dict:
+    """Aciertos, descargas completas, revalidaciones (304), peticiones compartidas y errores."""
+    with _cerrojo_paginas:
+        return dict(_estadisticas_paginas)
+
+
+def _numero_celda(celdas, posicion: int) -> str:
+    """Primer entero del texto de la celda, o '0' si no hay celda o no contiene ninguno."""
+    if posicion >= len(celdas):
+        return '0'
+    encontrado = _NUMERO.search(celdas[posicion].text_content())
+    return encontrado.group() if encontrado else '0'
+
+
+def _dia_cabecera(texto: str) -> Optional[tuple]:
+    """(día, mes) escrito en una cabecera de día de la tabla, o None."""
+    encontrado = _FECHA_CABECERA.search(texto)
+    if encontrado:
+        return int(encontrado.group(1)), MESES.index(encontrado.group(2).lower()) + 1
+    encontrado = _FECHA_CABECERA_NUMERICA.search(texto)
+    if encontrado and 1 <= int(encontrado.group(2)) <= 12:
+        return int(encontrado.group(1)), int(encontrado.group(2))
+    return None
+
+
+def _recorrer_tabla_horaria(contenido) -> List[tuple]:
+    """
+    Filas de la tabla horaria en orden, cada una con el (día, mes) de la
+    última cabecera de día anterior (None si aún no ha aparecido ninguna).
+
+    Cada fila se recorre una sola vez y los campos se leen por posición
+    (COLUMNAS_HORARIAS), sin serializar la fila ni aplicarle expresiones
+    regulares. Las filas sin hora se descartan; una página sin elementos
+    (vacía, solo comentarios) no tiene filas.
+    """
+    if not contenido or not contenido.strip():
+        return []
+    try:
+        arbol = lxml_html.fromstring(contenido)
+    except (etree.LxmlError, ValueError):
+        return []
+    c = COLUMNAS_HORARIAS
+    filas = []
+    cabecera = None
+
+    for fila in arbol.iter('tr'):
+        clase = fila.get('class')
+        if clase == 'cabecera_niv1':
+            cabecera = _dia_cabecera(fila.text_content()) or cabecera
+            continue
+        if clase != 'fila_hora cabecera_niv2':
+            continue
+        celdas = fila.findall('td')
+        if not celdas:
+            continue
+        hora = celdas[c["hora"]].text_content().strip()
+        if not (hora.isdigit() and len(hora) <= 2):
+            continue
+
+        estado_cielo, direccion, velocidad = '', '', '0'
+        if len(celdas) > c["estadoCielo"]:
+            icono = celdas[c["estadoCielo"]].find('.//img')
+            if icono is not None:
+                estado_cielo = icono.get('title', '')
+        if len(celdas) > c["viento"]:
+            viento = celdas[c["viento"]]
+            direccion = (viento.findtext('.//div[@class="texto_viento"]') or '').strip()
+            km = _NUMERO.search(viento.findtext('.//div[@class="texto_km_viento"]/div') or '')
+            velocidad = km.group() if km else '0'
+
+        filas.append((cabecera, {
+            'hora': hora.zfill(2),
+            'estadoCielo': estado_cielo,
+            'temperatura': _numero_celda(celdas, c["temperatura"]),
+            'sensacionTermica': _numero_celda(celdas, c["sensacionTermica"]),
+            'direccionViento': direccion,
+            'velocidadViento': velocidad,
+            'rachaMaxima': _numero_celda(celdas, c["rachaMaxima"]),
+            'precipitacion': _numero_celda(celdas, c["precipitacion"]),
+            'humedadRelativa': _numero_celda(celdas, c["humedadRelativa"]),
+        }))
+    return filas
+
+
+def filas_tabla_horaria(contenido) -> List[Dict[str, Any]]:
+    """Extrae las filas de la tabla de predicción por horas de AEMET, en orden."""
+    return [fila for _, fila in _recorrer_tabla_horaria(contenido)]
+
+
+def analizar_tabla_horaria(contenido) -> Dict[str, Dict[str, Any]]:
+    """
+    Filas de la tabla horaria indexadas solo por hora.
+
+    Si una hora se repite (varios días en la tabla), prevalece la última;
+    PrevisionHoraria distingue los días.
+
+    Returns:
+        Diccionario {hora: {datos meteorológicos}}
+    """
+    return {fila['hora']: fila for fila in filas_tabla_horaria(contenido)}
+
+
+def _fecha_mas_cercana(dia_mes: tuple, referencia: date) -> Optional[date]:
+    """Fecha con ese día y mes del año anterior, el mismo o el siguiente al de referencia, la más cercana."""
+    candidatas = []
+    for anio in (referencia.year - 1, referencia.year, referencia.year + 1):
+        try:
+            candidatas.append(date(anio, dia_mes[1], dia_mes[0]))
+        except ValueError:
+            pass
+    return min(candidatas, key=lambda fecha: abs(fecha - referencia)) if candidatas else None
+
+
+class PrevisionHoraria:
+    """
+    Tabla de predicción horaria de AEMET indexada por (fecha, hora).
+
+    La página horaria cubre varios días seguidos, cada uno tras una cabecera
+    con su fecha ("jueves 12 de marzo"), que es la que se usa; el año es el
+    que deja la fecha más cerca de referencia (el día de descarga), de modo
+    que una descarga o revalidación cerca de medianoche o de fin de año no
+    desplaza el índice. Las filas sin cabecera de día (páginas antiguas o
+    recortadas) se fechan como antes: la primera en referencia y cada vez
+    que la hora retrocede (23 -> 00) empieza el día siguiente. buscar() es
+    una consulta a un diccionario, sin volver a descargar ni analizar la
+    página.
+    """
+
+    def __init__(self, filas: List[Dict[str, Any]], referencia: date, dias: List[Optional[tuple]] = None):
+        self.filas = []
+        self.fechas = []
+        self._indice = {}
+        resueltos = {}
+        dia, anterior = referencia, None
+        for fila, dia_mes in zip(filas, dias or [None] * len(filas)):
+            hora = int(fila['hora'])
+            if dia_mes is not None:
+                if dia_mes not in resueltos:
+                    resueltos[dia_mes] = _fecha_mas_cercana(dia_mes, referencia)
+                dia = resueltos[dia_mes] or dia
+            elif anterior is not None and hora < anterior:
+                dia += timedelta(days=1)
+            anterior = hora
+            instante = datetime(dia.year, dia.month, dia.day, hora)
+            self._indice[(dia, hora)] = len(self.filas)
+            self.filas.append(fila)
+            self.fechas.append(instante)
+
+    @classmethod
+    def desde_pagina(cls, contenido, referencia: date) -> "PrevisionHoraria":
+        """Analiza la página horaria (una sola pasada) y fecha sus filas con las cabeceras de día."""
+        recorrido = _recorrer_tabla_horaria(contenido)
+        return cls([fila for _, fila in recorrido], referencia, [dia_mes for dia_mes, _ in recorrido])
+
+    def __len__(self) -> int:
+        return len(self.filas)
+
+    def buscar(self, instante: datetime) -> Optional[Dict[str, Any]]:
+        """Copia de la fila de la hora de instante (se ignoran los minutos), o None si está fuera de la tabla."""
+        posicion = self._indice.get((instante.date(), instante.hour))
+        return dict(self.filas[posicion]) if posicion is not None else None
+
+    def horizonte(self) -> Optional[tuple]:
+        """Primera y última hora de la tabla, o None si está vacía."""
+        return (self.fechas[0], self.fechas[-1]) if self.fechas else None
+
+    def por_hora(self) -> Dict[str, Dict[str, Any]]:
+        """Copia {hora: datos} como la de get_hourly_data (prevalece el último día)."""
+        return {fila['hora']: dict(fila) for fila in self.filas}
 
 
 class AemetScraper:
@@ -22,62 +257,115 @@ class AemetScraper:
         'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
     }
     
-    def __init__(self, timeout: int = 10):
-        """Inicializa el scraper."""
+    def __init__(self, timeout: int = 10, url_horaria: str = None, ttl_s: float = None,
+                 session: requests.Session = None):
+        """
+        Inicializa el scraper.
+
+        url_horaria sustituye a la página de Madrid y ttl_s fija la validez de
+        la caché en segundos (por defecto, hasta la siguiente actualización).
+        session permite compartir una sesión (y su pool de conexiones) entre
+        varios scrapers.
+        """
         self.timeout = timeout
-        self.session = requests.Session()
-        self.session.headers.update(self.HEADERS)
+        self.url_horaria = url_horaria or self.MADRID_HOURLY_URL
+        self.ttl_s = ttl_s
+        if session is None:
+            session = requests.Session()
+            session.headers.update(self.HEADERS)
+        self.session = session
+
+    def _descargar(self, url: str) -> dict:
+        """
+        Página de AEMET a través de la caché compartida.
+
+        Devuelve la entrada de la caché (contenido, validadores y, una vez
+        analizada, los datos extraídos). Lanza requests.RequestException si
+        no se puede descargar.
+        """
+        with _cerrojo_paginas:
+            entrada = _paginas.get(url)
+            if entrada is not None and time.time() < entrada["caduca"]:
+                _estadisticas_paginas["aciertos"] += 1
+                return entrada
+            vuelo = _en_vuelo.get(url)
+            lider = vuelo is None
+            if lider:
+                vuelo = _en_vuelo[url] = Future()
+            else:
+                _estadisticas_paginas["compartidas"] += 1
+        if not lider:
+            return vuelo.result()
+
+        try:
+            cabeceras = {}
+            if entrada is not None and entrada["etag"]:
+                cabeceras["If-None-Match"] = entrada["etag"]
+            if entrada is not None and entrada["modificada"]:
+                cabeceras["If-Modified-Since"] = entrada["modificada"]
+            response = self.session.get(url, timeout=self.timeout, headers=cabeceras)
+            ahora = time.time()
+            caduca = ahora + self.ttl_s if self.ttl_s is not None else _caducidad(ahora)
+
+            if response.status_code == 304 and entrada is not None:
+                entrada = {**entrada, "caduca": caduca}
+                contador = "revalidaciones"
+            else:
+                response.raise_for_status()
+                entrada = {
+                    "contenido": response.content,
+                    "etag": response.headers.get("ETag"),
+                    "modificada": response.headers.get("Last-Modified"),
+                    "caduca": caduca,
+                    # Referencia para el año de las cabeceras de día de la tabla horaria
+                    "dia": datetime.now().date(),
+                }
+                contador = "descargas"
+            with _cerrojo_paginas:
+                _paginas[url] = entrada
+                _estadisticas_paginas[contador] += 1
+            vuelo.set_result(entrada)
+            return entrada
+        except Exception as e:
+            with _cerrojo_paginas:
+                _estadisticas_paginas["errores"] += 1
+            vuelo.set_exception(e)
+            raise
+        finally:
+            with _cerrojo_paginas:
+                _en_vuelo.pop(url, None)
     
+    def get_forecast_table(self) -> PrevisionHoraria:
+        """
+        Predicción horaria de todo el horizonte publicado, indexada por (fecha, hora).
+
+        La tabla se construye una vez por página descargada y se comparte
+        (no se modifica; buscar() devuelve copias). Si no se puede descargar,
+        devuelve una tabla vacía.
+        """
+        try:
+            entrada = self._descargar(self.url_horaria)
+        except requests.RequestException as e:
+            print(f"Error en request AEMET: {e}")
+            return PrevisionHoraria([], datetime.now().date())
+        return self._prevision(entrada)
+
+    @staticmethod
+    def _prevision(entrada: dict) -> PrevisionHoraria:
+        # La página ya analizada se reutiliza mientras no cambie
+        if "prevision" not in entrada:
+            entrada["prevision"] = PrevisionHoraria.desde_pagina(entrada["contenido"], entrada["dia"])
+        return entrada["prevision"]
+
     def get_hourly_data(self) -> Dict[str, Dict[str, Any]]:
         """
         Obtiene datos de predicción por horas.
         
         Returns:
-            Diccionario {hora: {datos meteorológicos}}
+            Diccionario {hora: {datos meteorológicos}}; si la tabla incluye
+            varios días, cada hora es la del último (ver get_forecast_table)
         """
-        try:
-            response = self.session.get(self.MADRID_HOURLY_URL, timeout=self.timeout)
-            response.encoding = 'utf-8'
-            soup = BeautifulSoup(response.content, 'html.parser')
-            
-            # Buscar filas de datos horarios
-            rows = soup.find_all('tr', class_='fila_hora cabecera_niv2')
-            
-            hourly_data = {}
-            
-            for row in rows:
-                try:
-                    row_str = str(row)
-                    
-                    # Extraer hora
-                    hora_match = re.search(r'>(\d{1,2})<\/td>', row_str)
-                    if hora_match:
-                        hora = hora_match.group(1).zfill(2)
-                        
-                        # Extraer datos
-                        data = {
-                            'hora': hora,
-                            'estadoCielo': self._extract_text(row_str, r'title="([^"]+)"\/><\/td>'),
-                            'temperatura': self._extract_number(row_str, r'<td class="borde_rb">\s*(\d+)<\/td>', 0),
-                            'sensacionTermica': self._extract_number(row_str, r'<td class="borde_rb">\s*(\d+)<\/td>', 1),
-                            'direccionViento': self._extract_text(row_str, r'<div class="texto_viento">(\w+)<\/div>'),
-                            'velocidadViento': self._extract_number(row_str, r'<div class="texto_km_viento"><div>(\d+)<\/div>', 0),
-                            'rachaMaxima': self._extract_number(row_str, r'borde_rb">\s*(\d+)<\/td>\n<td class="borde_rb">\s*(\d+)', 0),
-                            'precipitacion': self._extract_number(row_str, r'borde_rb">\s*(\d+)<\/td>\n<td class="borde_rb">\s*(\d+)', 1),
-                            'humedadRelativa': self._extract_number(row_str, r'borde_rb">\s*(\d+)<\/td>\n<td class="borde_rb">\s*(\d+)<\/td>\n<td class="borde_rb">\s*(\d+)<\/td>\n<td class="borde_rb">\s*(\d+)', 3),
-                        }
-                        
-                        hourly_data[hora] = data
-                        
-                except Exception as e:
-                    print(f"Error procesando fila horaria: {e}")
-                    pass
-            
-            return hourly_data
-            
-        except requests.RequestException as e:
-            print(f"Error en request AEMET: {e}")
-            return {}
+        return self.get_forecast_table().por_hora()
     
     def get_daily_data(self) -> Dict[str, Dict[str, Any]]:
         """
@@ -102,27 +390,6 @@ class AemetScraper:
             print(f"Error en request AEMET (daily): {e}")
             return {}
     
-    @staticmethod
-    def _extract_text(html_str: str, pattern: str, group: int = 1) -> str:
-        """Extrae texto usando regex."""
-        match = re.search(pattern, html_str)
-        return match.group(group) if match else ''
-    
-    @staticmethod
-    def _extract_number(html_str: str, pattern: str, group: int = 0) -> str:
-        """Extrae número usando regex."""
-        try:
-            matches = re.findall(pattern, html_str)
-            if not matches:
-                return '0'
-            if isinstance(matches[0], tuple):
-                return matches[0][group] if group < len(matches[0]) else '0'
-            elif group < len(matches):
-                return matches[group]
-            return '0'
-        except (IndexError, TypeError, AttributeError):
-            return '0'
-    
     def get_forecast_for_datetime(self, target_date: datetime) -> Optional[Dict[str, Any]]:
         """
         Obtiene predicción para una fecha/hora específica.
@@ -131,30 +398,167 @@ class AemetScraper:
             target_date: datetime con fecha y hora
             
         Returns:
-            Diccionario con datos meteorológicos o None
+            Diccionario con datos meteorológicos o None si queda fuera del
+            horizonte de la tabla horaria
         """
-        # Si es hoy o mañana, usar datos horarios
-        today = datetime.now()
-        tomorrow = today + timedelta(days=1)
-        
-        if target_date.date() == today.date() or target_date.date() == tomorrow.date():
-            hourly_data = self.get_hourly_data()
-            hora = str(target_date.hour).zfill(2)
-            
-            if hora in hourly_data:
-                return hourly_data[hora]
-        
-        return None
+        return self.get_forecast_table().buscar(target_date)
     
     def test_connection(self) -> bool:
-        """Prueba la conexión a AEMET."""
+        """
+        Prueba la conexión a AEMET.
+
+        Descarga (o revalida) la propia página horaria, de modo que el
+        get_hourly_data posterior la toma de la caché sin otra petición.
+        """
         try:
-            response = self.session.get(self.MADRID_HOURLY_URL, timeout=5)
-            return response.status_code == 200
-        except:
+            self._descargar(self.url_horaria)
+            return True
+        except requests.RequestException:
             return False
 
 
+class RefrescoPrevision:
+    """
+    Hilo que mantiene al día la tabla horaria de AEMET en segundo plano.
+
+    actual() devuelve al instante la última tabla buena, aunque esté
+    caducada (stale-while-revalidate): si lo está, despierta al hilo para
+    que la revalide, pero no espera a la red. Tras un fallo reintenta con
+    espera exponencial (espera_inicial_s, el doble cada vez, hasta
+    espera_max_s); tras fallos_circuito fallos seguidos abre el circuito y
+    no vuelve a pedir la página hasta pasados pausa_circuito_s, momento en
+    que hace un único intento de prueba. Entre dos revalidaciones pasan al
+    menos refresco_min_s segundos.
+    """
+
+    def __init__(self, scraper: AemetScraper = None, espera_inicial_s: float = 5.0, espera_max_s: float = 300.0,
+                 fallos_circuito: int = 3, pausa_circuito_s: float = 900.0, refresco_min_s: float = 60.0):
+        self.scraper = scraper or AemetScraper()
+        self.refresco_min_s = refresco_min_s
+        self.espera_inicial_s = espera_inicial_s
+        self.espera_max_s = espera_max_s
+        self.fallos_circuito = fallos_circuito
+        self.pausa_circuito_s = pausa_circuito_s
+        self._cerrojo = threading.Lock()
+        self._despertar = threading.Event()
+        self._parar = threading.Event()
+        self._hilo = None
+        self._tabla = None
+        self._actualizada = None
+        self._caduca = 0.0
+        self._fallos = 0
+        self._abierto_hasta = 0.0
+        self._proximo_intento = 0.0
+        self._ultimo_error = None
+
+    def iniciar(self):
+        """Arranca el hilo (la primera descarga empieza de inmediato)."""
+        if self._hilo is None:
+            self._hilo = threading.Thread(target=self._bucle, daemon=True)
+            self._hilo.start()
+        return self
+
+    def detener(self):
+        self._parar.set()
+        self._despertar.set()
+        if self._hilo is not None:
+            self._hilo.join()
+            self._hilo = None
+
+    def actual(self) -> Optional[PrevisionHoraria]:
+        """Última tabla buena (None si aún no se ha conseguido ninguna); nunca espera a la red."""
+        with self._cerrojo:
+            tabla, caducada = self._tabla, time.time() >= self._caduca
+        if caducada:
+            self._despertar.set()
+        return tabla
+
+    def _refrescar(self) -> float:
+        """Un intento de descarga si toca; devuelve los segundos hasta el siguiente."""
+        ahora = time.time()
+        with self._cerrojo:
+            if ahora < self._abierto_hasta:
+                return self._abierto_hasta - ahora
+            if ahora < self._proximo_intento:
+                return self._proximo_intento - ahora
+        tabla, caduca = self._descargar_tabla()
+
+        with self._cerrojo:
+            self._tabla = tabla
+            self._actualizada = time.time()
+            self._caduca = caduca
+            self._fallos = 0
+            self._abierto_hasta = 0.0
+            self._ultimo_error = None
+            # Siguiente revalidación cuando caduque la página
+            self._proximo_intento = max(self._caduca, self._actualizada + self.refresco_min_s)
+            return self._proximo_intento - time.time()
+
+    def _descargar_tabla(self) -> tuple:
+        """Descarga (o revalida) la tabla horaria; devuelve la tabla y el instante en que caduca."""
+        entrada = self.scraper._descargar(self.scraper.url_horaria)
+        tabla = self.scraper._prevision(entrada)
+        if not len(tabla):
+            raise ValueError("la página de AEMET no contiene la tabla horaria")
+        return tabla, entrada["caduca"]
+
+    def _fallo(self, error: Exception) -> float:
+        """Cuenta un intento fallido; devuelve la espera (exponencial, o la pausa si se abre el circuito)."""
+        with self._cerrojo:
+            self._fallos += 1
+            self._ultimo_error = str(error) or type(error).__name__
+            espera = min(self.espera_inicial_s * 2 ** (self._fallos - 1), self.espera_max_s)
+            if self._fallos >= self.fallos_circuito:
+                espera = self.pausa_circuito_s
+                self._abierto_hasta = time.time() + espera
+            self._proximo_intento = time.time() + espera
+        return espera
+
+    def _bucle(self):
+        while not self._parar.is_set():
+            try:
+                espera = self._refrescar()
+            except Exception as e:
+                # Cualquier error (red, página que no se puede analizar...)
+                # es un fallo más: el hilo sigue vivo y reintenta con espera
+                espera = self._fallo(e)
+            self._despertar.wait(espera)
+            self._despertar.clear()
+
+    def estado(self) -> dict:
+        """Antigüedad de la tabla, si está caducada, fallos seguidos y estado del circuito."""
+        ahora = time.time()
+        with self._cerrojo:
+            if ahora < self._abierto_hasta:
+                circuito = "abierto"
+            elif self._fallos >= self.fallos_circuito:
+                circuito = "semiabierto"
+            else:
+                circuito = "cerrado"
+            return {
+                "disponible": self._tabla is not None,
+                "antiguedad_s": ahora - self._actualizada if self._actualizada is not None else None,
+                "caducada": ahora >= self._caduca,
+                "fallos": self._fallos,
+                "circuito": circuito,
+                "reintento_s": max(self._proximo_intento - ahora, 0.0) if self._fallos else None,
+                "error": self._ultimo_error,
+            }
+
+    def describir(self) -> str:
+        """Texto corto para las etiquetas de la interfaz."""
+        e = self.estado()
+        if not e["disponible"]:
+            return "AEMET: sin conexión" if e["fallos"] else "AEMET: descargando..."
+        minutos = int(e["antiguedad_s"] // 60)
+        texto = f"AEMET: hace {minutos} min" if minutos else "AEMET: actualizado"
+        if e["fallos"]:
+            texto += f" (sin conexión, reintento en {int(e['reintento_s'] // 60) + 1} min)"
+        elif e["caducada"]:
+            texto += " (actualizando)"
+        return texto
+
+
 if __name__ == "__main__":
     # Prueba del scraper
     print("Probando conexión a AEMET...")
@@ -1,55 +1,236 @@
 # algoritmos.py
 
+import os
+import io
+import copy
+import shutil
+import hashlib
+import json
+import tracemalloc
+import time
+import tempfile
+import multiprocessing
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import pandas as pd
-from sklearn.model_selection import train_test_split, GridSearchCV
-from sklearn.preprocessing import StandardScaler, OneHotEncoder, LabelEncoder
+import joblib
+from sklearn.base import BaseEstimator, RegressorMixin, clone
+from sklearn.model_selection import train_test_split, GridSearchCV, KFold, ParameterGrid
+from sklearn.preprocessing import StandardScaler, OneHotEncoder, OrdinalEncoder, LabelEncoder
 from sklearn.metrics import mean_squared_error, r2_score, mean_absolute_error, mean_absolute_percentage_error
 from sklearn.tree import DecisionTreeRegressor
-from sklearn.ensemble import RandomForestRegressor, GradientBoostingRegressor
+from sklearn.ensemble import RandomForestRegressor, GradientBoostingRegressor, HistGradientBoostingRegressor
 from sklearn.neural_network import MLPRegressor
 from sklearn.compose import ColumnTransformer
 from sklearn.pipeline import Pipeline
 import numpy as np
+from formato_modelo import abrir_paquete_modelo, leer_cabecera
 import warnings
 warnings.filterwarnings('ignore')
 
 
-def _agregar_features_temporales(df: pd.DataFrame) -> pd.DataFrame:
-    """Aplica el mismo feature engineering temporal y de interacciones usado en entrenamiento."""
-    df = df.copy()
-    df["fecha"] = pd.to_datetime(df["fecha"], dayfirst=True)
-    df["hora"] = df["fecha"].dt.hour
-    df["mes"] = df["fecha"].dt.month
-    df["dia_semana"] = df["fecha"].dt.dayofweek
-    df["es_fin_semana"] = (df["dia_semana"] >= 5).astype(int)
-    df["trimestre"] = df["fecha"].dt.quarter
+FEATURES_NUMERICAS = [
+    "hora_sin", "hora_cos", "mes_sin", "mes_cos", "dia_sin", "dia_cos",
+    "hora", "mes", "es_fin_semana", "es_noche", "es_manana", "es_tarde", "es_trafico_punta",
+    "id", "zona_intensidad_media", "zona_intensidad_std", "zona_intensidad_min", "zona_intensidad_max",
+    "hora_intensidad_media", "hora_intensidad_std",
+    "temp", "feelslike", "dew", "humidity", "precip", "precipprob",
+    "windgust", "windspeed", "winddir", "cloudcover", "visibility"
+]
+
+FEATURES_CATEGORICAS = [
+    "conditionsDay"
+]
+
+# Representación compacta de la matriz de features: int16 para las columnas
+# de calendario y float32 para el resto (el id incluido, exacto hasta 2**24).
+# Al combinarse int16 y float32 la matriz que llega a los modelos es float32
+DTYPES_COMPACTOS = {
+    "hora": "int16", "mes": "int16", "es_fin_semana": "int16", "es_noche": "int16",
+    "es_manana": "int16", "es_tarde": "int16", "es_trafico_punta": "int16",
+}
+
+
+def dtypes_compactos(features_numericas) -> dict:
+    """dtype compacto de cada feature numérica."""
+    return {col: DTYPES_COMPACTOS.get(col, "float32") for col in features_numericas}
+
+
+def compactar_features(df: pd.DataFrame, dtypes: dict) -> pd.DataFrame:
+    """
+    Convierte las columnas presentes en df a los dtypes indicados.
+
+    Una columna entera con huecos se deja en float32 para no perder los NaN.
+    """
+    conversiones = {}
+    for col, dtype in dtypes.items():
+        if col not in df.columns or df[col].dtype == dtype:
+            continue
+        if np.issubdtype(np.dtype(dtype), np.integer) and df[col].isna().any():
+            dtype = "float32"
+        conversiones[col] = dtype
+    return df.astype(conversiones) if conversiones else df
+
+
+FORMATO_FECHA = "%d/%m/%Y %H:%M"
+
+
+def _parsear_fechas(valores) -> pd.Series:
+    """Convierte fechas "DD/MM/YYYY HH:MM" con formato explícito (o inferido si no encaja)."""
+    try:
+        return pd.to_datetime(valores, format=FORMATO_FECHA)
+    except (ValueError, TypeError):
+        return pd.to_datetime(valores, dayfirst=True)
+
+
+def tabla_calendario(fechas: pd.Series) -> pd.DataFrame:
+    """Calcula las features de calendario para una serie de fechas ya convertidas."""
+    tabla = pd.DataFrame(index=fechas.index)
+    tabla["hora"] = fechas.dt.hour
+    tabla["mes"] = fechas.dt.month
+    tabla["dia_semana"] = fechas.dt.dayofweek
+    tabla["es_fin_semana"] = (tabla["dia_semana"] >= 5).astype(int)
+    tabla["trimestre"] = fechas.dt.quarter
 
     # Cíclicas
-    df["hora_sin"] = np.sin(2 * np.pi * df["hora"] / 24)
-    df["hora_cos"] = np.cos(2 * np.pi * df["hora"] / 24)
-    df["mes_sin"] = np.sin(2 * np.pi * df["mes"] / 12)
-    df["mes_cos"] = np.cos(2 * np.pi * df["mes"] / 12)
-    df["dia_sin"] = np.sin(2 * np.pi * df["dia_semana"] / 7)
-    df["dia_cos"] = np.cos(2 * np.pi * df["dia_semana"] / 7)
+    tabla["hora_sin"] = np.sin(2 * np.pi * tabla["hora"] / 24)
+    tabla["hora_cos"] = np.cos(2 * np.pi * tabla["hora"] / 24)
+    tabla["mes_sin"] = np.sin(2 * np.pi * tabla["mes"] / 12)
+    tabla["mes_cos"] = np.cos(2 * np.pi * tabla["mes"] / 12)
+    tabla["dia_sin"] = np.sin(2 * np.pi * tabla["dia_semana"] / 7)
+    tabla["dia_cos"] = np.cos(2 * np.pi * tabla["dia_semana"] / 7)
 
     # Interacciones
-    df["es_noche"] = ((df["hora"] >= 22) | (df["hora"] < 6)).astype(int)
-    df["es_manana"] = ((df["hora"] >= 6) & (df["hora"] < 12)).astype(int)
-    df["es_tarde"] = ((df["hora"] >= 12) & (df["hora"] < 18)).astype(int)
-    df["es_trafico_punta"] = ((df["hora"] >= 7) & (df["hora"] <= 9)) | ((df["hora"] >= 17) & (df["hora"] <= 20))
-    df["es_trafico_punta"] = df["es_trafico_punta"].astype(int)
+    hora = tabla["hora"]
+    tabla["es_noche"] = ((hora >= 22) | (hora < 6)).astype(int)
+    tabla["es_manana"] = ((hora >= 6) & (hora < 12)).astype(int)
+    tabla["es_tarde"] = ((hora >= 12) & (hora < 18)).astype(int)
+    tabla["es_trafico_punta"] = (((hora >= 7) & (hora <= 9)) | ((hora >= 17) & (hora <= 20))).astype(int)
+    return tabla
+
+
+def _agregar_features_temporales(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Aplica el mismo feature engineering temporal y de interacciones usado en entrenamiento.
+
+    Las features de calendario se calculan una sola vez por fecha distinta
+    (un dataset tiene muchas zonas por instante) y se reparten a las filas
+    con un índice entero.
+    """
+    df = df.copy()
+    codigos, fechas_unicas = pd.factorize(df["fecha"], use_na_sentinel=False)
+    fechas = pd.Series(_parsear_fechas(pd.Series(fechas_unicas, dtype=object)))
+    tabla = tabla_calendario(fechas)
+
+    df["fecha"] = fechas.to_numpy()[codigos]
+    for col in tabla.columns:
+        df[col] = tabla[col].to_numpy()[codigos]
 
     df["conditionsDay"] = df["conditionsDay"].fillna("unknown")
     return df
 
-def entrenar_modelo(path_csv, algoritmo="Random Forest Mejorado"):
+# ==================== CACHÉ DE FEATURES ====================
+
+# Incrementar cuando cambie el feature engineering para invalidar la caché en disco
+VERSION_FEATURES = 2
+DIRECTORIO_CACHE = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".safedrive_cache")
+MAX_ENTRADAS_CACHE = 4
+
+_huellas_calculadas = {}
+
+
+def huella_fichero(path: str) -> str:
+    """SHA-256 del contenido del fichero (memorizado por ruta, tamaño y fecha de modificación)."""
+    st = os.stat(path)
+    clave = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    if clave not in _huellas_calculadas:
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for bloque in iter(lambda: f.read(1 << 20), b""):
+                h.update(bloque)
+        _huellas_calculadas[clave] = h.hexdigest()
+    return _huellas_calculadas[clave]
+
+
+def huella_modelo(path: str) -> str:
     """
-    Entrena un modelo para predecir intensidad de tráfico usando solo features disponibles a priori.
+    Identificador de un .mdl para la caché de predicciones, sin leer el fichero entero.
 
-    Se guardan las estadísticas calculadas en entrenamiento (medianas, agregados
-    por zona y hora) para poder reutilizarlas al predecir y así permitir que el
-    CSV de predicción solo contenga las columnas base (sin las derivadas).
+    En v2, SHA-256 de la cabecera (métricas, huella del dataset y longitud de
+    cada sección) y del tamaño: no cambia al copiar o mover el fichero. Los
+    v1 no tienen cabecera y se identifican por ruta, tamaño y fecha de
+    modificación, como en cargar_paquete_modelo.
     """
+    st = os.stat(path)
+    cabecera = leer_cabecera(path)
+    if cabecera is not None:
+        texto = json.dumps(cabecera, sort_keys=True, default=str) + f"|{st.st_size}"
+    else:
+        texto = f"{os.path.abspath(path)}|{st.st_size}|{st.st_mtime_ns}"
+    return hashlib.sha256(texto.encode("utf-8")).hexdigest()
+
+
+def _guardar_cache_features(ruta: str, datos: dict) -> None:
+    """Guarda el DataFrame de features (un .npy por columna) y las estadísticas aprendidas."""
+    tmp = f"{ruta}.tmp{os.getpid()}"
+    os.makedirs(tmp, exist_ok=True)
+    df = datos["df"]
+    columnas = []
+    for i, col in enumerate(df.columns):
+        serie = df[col]
+        categorias = None
+        if serie.dtype == object or pd.api.types.is_string_dtype(serie.dtype):
+            codigos, cats = pd.factorize(serie, use_na_sentinel=False)
+            valores = codigos.astype(np.int32)
+            categorias = np.asarray(cats, dtype=object).tolist()
+        else:
+            valores = serie.to_numpy()
+        np.save(os.path.join(tmp, f"col_{i}.npy"), valores, allow_pickle=False)
+        columnas.append({"nombre": col, "categorias": categorias, "dtype": str(serie.dtype)})
+
+    meta = {k: v for k, v in datos.items() if k not in ("df", "desde_cache", "memoria_pico_mb")}
+    meta["columnas"] = columnas
+    joblib.dump(meta, os.path.join(tmp, "meta.joblib"))
+
+    if os.path.isdir(ruta):
+        shutil.rmtree(ruta, ignore_errors=True)
+    os.replace(tmp, ruta)
+    _podar_cache(os.path.dirname(ruta))
+
+
+def _cargar_cache_features(ruta: str):
+    """Carga una entrada de la caché de features o None si no existe o está dañada."""
+    if not os.path.isfile(os.path.join(ruta, "meta.joblib")):
+        return None
+    try:
+        meta = joblib.load(os.path.join(ruta, "meta.joblib"))
+        columnas = {}
+        for i, info in enumerate(meta.pop("columnas")):
+            valores = np.load(os.path.join(ruta, f"col_{i}.npy"), allow_pickle=False)
+            if info["categorias"] is not None:
+                valores = pd.Series(np.asarray(info["categorias"], dtype=object)[valores], dtype=info["dtype"])
+            columnas[info["nombre"]] = valores
+        meta["df"] = pd.DataFrame(columnas)
+        os.utime(ruta)
+        return meta
+    except Exception as e:
+        print(f"Caché de features inválida en {ruta}: {e}")
+        return None
+
+
+def _podar_cache(directorio: str) -> None:
+    """Elimina las entradas más antiguas si la caché supera MAX_ENTRADAS_CACHE."""
+    entradas = [os.path.join(directorio, d) for d in os.listdir(directorio) if ".tmp" not in d]
+    entradas = [d for d in entradas if os.path.isdir(d)]
+    entradas.sort(key=os.path.getmtime, reverse=True)
+    for ruta in entradas[MAX_ENTRADAS_CACHE:]:
+        shutil.rmtree(ruta, ignore_errors=True)
+
+
+def _calcular_features_entrenamiento(path_csv) -> dict:
+    """Lee el CSV, aplica el feature engineering y calcula las estadísticas por zona y hora."""
     df_raw = pd.read_csv(path_csv, sep=";")
     target = "intensidad"
 
@@ -57,6 +238,13 @@ def entrenar_modelo(path_csv, algoritmo="Random Forest Mejorado"):
     df = _agregar_features_temporales(df_raw)
 
     # Agregados por zona y hora (se calculan con la intensidad conocida)
+    zona_stats, hora_stats = _estadisticas_zona_hora(df)
+
+    return _adjuntar_estadisticas(df, zona_stats, hora_stats)
+
+
+def _estadisticas_zona_hora(df: pd.DataFrame, target="intensidad"):
+    """Tablas zona_stats y hora_stats (media, desviación y extremos de la intensidad)."""
     zona_stats = df.groupby("id")[target].agg(['mean', 'std', 'min', 'max']).reset_index()
     zona_stats.columns = ['id', 'zona_intensidad_media', 'zona_intensidad_std', 'zona_intensidad_min', 'zona_intensidad_max']
     zona_stats['zona_intensidad_std'] = zona_stats['zona_intensidad_std'].fillna(0)
@@ -64,8 +252,11 @@ def entrenar_modelo(path_csv, algoritmo="Random Forest Mejorado"):
     hora_stats = df.groupby("hora")[target].agg(['mean', 'std']).reset_index()
     hora_stats.columns = ['hora', 'hora_intensidad_media', 'hora_intensidad_std']
     hora_stats['hora_intensidad_std'] = hora_stats['hora_intensidad_std'].fillna(0)
+    return zona_stats, hora_stats
+
 
-    # Valores por defecto para ids/horas no vistas
+def _valores_defecto(zona_stats: pd.DataFrame, hora_stats: pd.DataFrame):
+    """Valores por defecto para ids/horas no vistas (mediana de cada estadístico)."""
     zona_defaults = {
         'zona_intensidad_media': zona_stats['zona_intensidad_media'].median(),
         'zona_intensidad_std': zona_stats['zona_intensidad_std'].median(),
@@ -76,36 +267,791 @@ def entrenar_modelo(path_csv, algoritmo="Random Forest Mejorado"):
         'hora_intensidad_media': hora_stats['hora_intensidad_media'].median(),
         'hora_intensidad_std': hora_stats['hora_intensidad_std'].median(),
     }
+    return zona_defaults, hora_defaults
+
+
+class TablaLookup:
+    """
+    Estadísticas por clave (zona o hora) en un array denso para adjuntarlas con un gather.
+
+    Las claves enteras no negativas se resuelven con un mapa directo
+    clave -> posición; el resto, con búsqueda binaria sobre las claves
+    ordenadas. La última posición del array contiene los valores por defecto
+    y es la que se devuelve para las claves no vistas en entrenamiento. Los
+    valores se guardan por columnas (una fila por estadístico) para que cada
+    columna adjuntada quede contigua en memoria.
+    """
+
+    MAX_CLAVE_MAPA = 10_000_000
+
+    def __init__(self, stats: pd.DataFrame, clave: str, defaults: dict = None):
+        defaults = defaults or {}
+        stats = stats.sort_values(clave, kind="stable")
+        self.clave = clave
+        self.columnas = [c for c in stats.columns if c != clave]
+        self.claves = stats[clave].to_numpy()
 
-    # Merge de estadísticas al conjunto de entrenamiento
-    df = df.merge(zona_stats, on='id', how='left')
-    df = df.merge(hora_stats, on='hora', how='left')
+        fila_defecto = np.array([defaults.get(c, np.nan) for c in self.columnas], dtype=np.float64)
+        valores = stats[self.columnas].to_numpy(dtype=np.float64)
+        # Los huecos de la tabla toman el valor por defecto, igual que el fillna tras un merge
+        valores = np.where(np.isnan(valores), fila_defecto, valores)
+        self.valores = np.ascontiguousarray(np.vstack([valores, fila_defecto]).T)
+
+        self.mapa = None
+        if (len(self.claves) and np.issubdtype(self.claves.dtype, np.integer)
+                and 0 <= self.claves[0] and self.claves[-1] < self.MAX_CLAVE_MAPA):
+            self.mapa = np.full(int(self.claves[-1]) + 1, len(self.claves), dtype=np.int32)
+            self.mapa[self.claves] = np.arange(len(self.claves), dtype=np.int32)
+
+    @classmethod
+    def desde_arrays(cls, clave, columnas, claves, valores, mapa=None):
+        """Reconstruye una lookup a partir de sus arrays (p. ej. leídos de un .npz)."""
+        lookup = cls.__new__(cls)
+        lookup.clave = clave
+        lookup.columnas = list(columnas)
+        lookup.claves = claves
+        lookup.valores = valores
+        lookup.mapa = mapa
+        return lookup
+
+    def posiciones(self, claves) -> np.ndarray:
+        """Posición en self.valores de cada clave (la de los valores por defecto si no se vio en entrenamiento)."""
+        claves = np.asarray(claves)
+        if not np.issubdtype(claves.dtype, np.number):
+            claves = pd.to_numeric(pd.Series(claves), errors="coerce").to_numpy(dtype=np.float64)
+        n = len(self.claves)
+        if n == 0:
+            return np.zeros(len(claves), dtype=np.intp)
+
+        if self.mapa is not None:
+            validas = (claves >= 0) & (claves < len(self.mapa))
+            if not np.issubdtype(claves.dtype, np.integer):
+                validas &= claves == np.floor(claves)
+            pos = np.full(len(claves), n, dtype=np.intp)
+            pos[validas] = self.mapa[claves[validas].astype(np.intp)]
+            return pos
+
+        pos = np.searchsorted(self.claves, claves).clip(max=n - 1)
+        return np.where(self.claves[pos] == claves, pos, n)
+
+    def columnas_de(self, claves) -> dict:
+        """Diccionario columna -> array con las estadísticas de cada clave."""
+        valores = np.take(self.valores, self.posiciones(claves), axis=1)
+        return dict(zip(self.columnas, valores))
+
+
+def obtener_lookups(resultados: dict):
+    """
+    Lookups de zona y hora de un paquete de modelo.
+
+    Los paquetes guardados antes de existir las lookups solo tienen las tablas
+    zona_stats/hora_stats; en ese caso se construyen a partir de ellas.
+    """
+    lookups = []
+    for prefijo, clave in (("zona", "id"), ("hora", "hora")):
+        lookup = resultados.get(f"{prefijo}_lookup")
+        stats = resultados.get(f"{prefijo}_stats")
+        if lookup is None and isinstance(stats, pd.DataFrame):
+            lookup = TablaLookup(stats, clave, resultados.get(f"{prefijo}_defaults"))
+        lookups.append(lookup)
+    return tuple(lookups)
+
+
+def _adjuntar_estadisticas(df: pd.DataFrame, zona_stats: pd.DataFrame, hora_stats: pd.DataFrame) -> dict:
+    """Une las estadísticas por zona y hora al DataFrame y selecciona las columnas del modelo."""
+    target = "intensidad"
+    zona_defaults, hora_defaults = _valores_defecto(zona_stats, hora_stats)
+
+    # Estadísticas por zona y hora adjuntadas con un gather sobre arrays densos
+    estadisticas = {
+        **TablaLookup(zona_stats, "id", zona_defaults).columnas_de(df["id"].to_numpy()),
+        **TablaLookup(hora_stats, "hora", hora_defaults).columnas_de(df["hora"].to_numpy()),
+    }
 
     # ==================== SELECCIONAR FEATURES ====================
-    features_numericas = [
-        "hora_sin", "hora_cos", "mes_sin", "mes_cos", "dia_sin", "dia_cos",
-        "hora", "mes", "es_fin_semana", "es_noche", "es_manana", "es_tarde", "es_trafico_punta",
-        "id", "zona_intensidad_media", "zona_intensidad_std", "zona_intensidad_min", "zona_intensidad_max",
-        "hora_intensidad_media", "hora_intensidad_std",
-        "temp", "feelslike", "dew", "humidity", "precip", "precipprob",
-        "windgust", "windspeed", "winddir", "cloudcover", "visibility"
-    ]
+    disponibles = set(df.columns) | set(estadisticas)
+    features_numericas = [f for f in FEATURES_NUMERICAS if f in disponibles]
+    features_categoricas = [f for f in FEATURES_CATEGORICAS if f in disponibles]
 
-    features_categoricas = [
-        "conditionsDay"
-    ]
+    # Solo se conservan las columnas que usa el modelo, la fecha y el objetivo
+    columnas = features_numericas + features_categoricas + ["fecha", target]
+    dtypes = dtypes_compactos(features_numericas)
+    df = compactar_features(df[[c for c in columnas if c not in estadisticas]].reset_index(drop=True), dtypes)
+    for posicion, col in enumerate(columnas):
+        if col in estadisticas:
+            df.insert(posicion, col, estadisticas[col].astype(dtypes[col]))
+
+    return {
+        "df": df,
+        "features_numericas": features_numericas,
+        "features_categoricas": features_categoricas,
+        "zona_stats": zona_stats,
+        "hora_stats": hora_stats,
+        "zona_defaults": zona_defaults,
+        "hora_defaults": hora_defaults,
+    }
+
+
+# ==================== LECTURA POR BLOQUES ====================
 
-    features_numericas = [f for f in features_numericas if f in df.columns]
-    features_categoricas = [f for f in features_categoricas if f in df.columns]
+TAM_BLOQUE_DEFECTO = 200_000
 
-    X = df[features_numericas + features_categoricas].copy()
-    y = df[target].copy()
+
+class AcumuladorEstadisticas:
+    """
+    Acumula recuento, media, varianza, mínimo y máximo por clave de forma incremental.
+
+    Cada bloque se resume con un groupby y se combina con lo acumulado usando
+    la fórmula de Chan et al. para medias y varianzas, por lo que dos
+    acumuladores también pueden combinarse entre sí.
+    """
+
+    def __init__(self):
+        self.claves = np.empty(0)
+        self.n = np.empty(0)
+        self.media = np.empty(0)
+        self.m2 = np.empty(0)
+        self.minimo = np.empty(0)
+        self.maximo = np.empty(0)
+
+    def actualizar(self, claves, valores) -> None:
+        """Incorpora un bloque de pares (clave, valor)."""
+        resumen = pd.Series(np.asarray(valores, dtype=float)).groupby(np.asarray(claves)).agg(
+            ["count", "mean", "var", "min", "max"]
+        )
+        n = resumen["count"].to_numpy(dtype=float)
+        otro = AcumuladorEstadisticas()
+        otro.claves = resumen.index.to_numpy()
+        otro.n = n
+        otro.media = resumen["mean"].to_numpy(dtype=float)
+        # var de pandas usa ddof=1; se convierte a suma de cuadrados centrada
+        otro.m2 = np.nan_to_num(resumen["var"].to_numpy(dtype=float)) * np.maximum(n - 1, 0)
+        otro.minimo = resumen["min"].to_numpy(dtype=float)
+        otro.maximo = resumen["max"].to_numpy(dtype=float)
+        self.combinar(otro)
+
+    def combinar(self, otro: "AcumuladorEstadisticas") -> None:
+        """Combina otro acumulador con este."""
+        claves = np.union1d(self.claves, otro.claves)
+        a = self._alinear(claves)
+        b = otro._alinear(claves)
+
+        n = a["n"] + b["n"]
+        n_seguro = np.where(n > 0, n, 1)
+        delta = np.nan_to_num(b["media"] - a["media"])
+        media_a = np.nan_to_num(a["media"])
+        media_b = np.nan_to_num(b["media"])
+
+        self.claves = claves
+        self.media = np.where(
+            n > 0,
+            np.where(a["n"] > 0, media_a + delta * b["n"] / n_seguro, media_b),
+            np.nan
+        )
+        self.m2 = a["m2"] + b["m2"] + delta ** 2 * a["n"] * b["n"] / n_seguro
+        self.n = n
+        self.minimo = np.fmin(a["minimo"], b["minimo"])
+        self.maximo = np.fmax(a["maximo"], b["maximo"])
+
+    def _alinear(self, claves) -> dict:
+        """Reindexa los acumulados sobre un conjunto de claves mayor."""
+        if len(self.claves) == 0:
+            vacio = np.full(len(claves), np.nan)
+            return {"n": np.zeros(len(claves)), "media": vacio, "m2": np.zeros(len(claves)),
+                    "minimo": vacio, "maximo": vacio}
+
+        pos = np.clip(np.searchsorted(self.claves, claves), 0, len(self.claves) - 1)
+        presente = self.claves[pos] == claves
+        return {
+            "n": np.where(presente, self.n[pos], 0.0),
+            "media": np.where(presente, self.media[pos], np.nan),
+            "m2": np.where(presente, self.m2[pos], 0.0),
+            "minimo": np.where(presente, self.minimo[pos], np.nan),
+            "maximo": np.where(presente, self.maximo[pos], np.nan),
+        }
+
+    def resultado(self) -> pd.DataFrame:
+        """Devuelve media, desviación típica (ddof=1), mínimo y máximo por clave."""
+        std = np.where(self.n > 1, np.sqrt(self.m2 / np.maximum(self.n - 1, 1)), np.nan)
+        return pd.DataFrame({
+            "clave": self.claves,
+            "mean": self.media,
+            "std": std,
+            "min": self.minimo,
+            "max": self.maximo,
+        })
+
+
+def _tablas_estadisticas(acum_zona, acum_hora, dtype_id, dtype_hora):
+    """Convierte los acumuladores por zona y hora en las tablas zona_stats y hora_stats."""
+    zona = acum_zona.resultado()
+    zona_stats = pd.DataFrame({
+        "id": zona["clave"].astype(dtype_id),
+        "zona_intensidad_media": zona["mean"],
+        "zona_intensidad_std": zona["std"].fillna(0),
+        "zona_intensidad_min": zona["min"],
+        "zona_intensidad_max": zona["max"],
+    })
+    hora = acum_hora.resultado()
+    hora_stats = pd.DataFrame({
+        "hora": hora["clave"].astype(dtype_hora),
+        "hora_intensidad_media": hora["mean"],
+        "hora_intensidad_std": hora["std"].fillna(0),
+    })
+    return zona_stats, hora_stats
+
+
+def _contar_filas_csv(path_csv) -> int:
+    """Cota superior de las filas de datos de un CSV: sus líneas menos la cabecera."""
+    lineas = 0
+    ultimo = b"\n"
+    with open(path_csv, "rb") as f:
+        while bloque := f.read(1 << 20):
+            lineas += bloque.count(b"\n")
+            ultimo = bloque[-1:]
+    if ultimo != b"\n":
+        lineas += 1
+    return max(lineas - 1, 0)
+
+
+def _escribir_en_reserva(destino, valores: np.ndarray, inicio: int) -> np.ndarray:
+    """
+    Copia valores en destino[inicio:]. Si no caben o su dtype no encaja
+    (una columna entera que pasa a float32 por tener huecos) se amplía o se
+    promueve el array reservado, igual que haría pd.concat con los bloques.
+    """
+    fin = inicio + len(valores)
+    dtype = np.result_type(destino.dtype, valores.dtype)
+    if dtype != destino.dtype or fin > len(destino):
+        ampliado = np.empty(max(fin, len(destino)), dtype=dtype)
+        ampliado[:inicio] = destino[:inicio]
+        destino = ampliado
+    destino[inicio:fin] = valores
+    return destino
+
+
+def _calcular_features_por_bloques(path_csv, tam_bloque=TAM_BLOQUE_DEFECTO, fraccion_muestra=1.0, semilla=42,
+                                   medir_memoria=False) -> dict:
+    """
+    Variante de _calcular_features_entrenamiento que lee el CSV por bloques.
+
+    Solo se leen las columnas que usa el modelo; las estadísticas por zona y
+    hora se acumulan incrementalmente sobre todas las filas y únicamente se
+    materializan las features de las filas que se usarán en el ajuste
+    (todas, o una muestra aleatoria si fraccion_muestra < 1). Las filas del
+    CSV se cuentan antes de leerlo y las columnas numéricas compactadas de
+    cada bloque se copian en arrays (float32/int16) reservados de antemano,
+    sin concatenar bloques al final, así que la memoria pico queda acotada
+    por el tamaño de bloque más el tamaño de la matriz final. Con
+    medir_memoria se mide con tracemalloc (memoria_pico_mb); es opcional
+    porque hace la lectura ~40% más lenta.
+    """
+    target = "intensidad"
+    columnas_base = {"id", "fecha", target} | set(FEATURES_NUMERICAS) | set(FEATURES_CATEGORICAS)
+    rng = np.random.default_rng(semilla)
+
+    # Un único sorteo para todo el fichero: las mismas filas que sorteando bloque a bloque
+    capacidad = _contar_filas_csv(path_csv)
+    seleccion = rng.random(capacidad) < fraccion_muestra if fraccion_muestra < 1.0 else None
+    reservadas = capacidad if seleccion is None else int(seleccion.sum())
+
+    acum_zona = AcumuladorEstadisticas()
+    acum_hora = AcumuladorEstadisticas()
+    reservas = {}  # columna numérica -> array reservado
+    trozos = {}    # columna de texto -> bloques, que se concatenan al final
+    n_filas = escritas = 0
+    pico = None
+
+    if medir_memoria:
+        tracemalloc.start()
+    try:
+        try:
+            lector = pd.read_csv(path_csv, sep=";", chunksize=tam_bloque, usecols=lambda c: c in columnas_base)
+            for bloque in lector:
+                inicio = n_filas
+                n_filas += len(bloque)
+                bloque = _agregar_features_temporales(bloque)
+                acum_zona.actualizar(bloque["id"].to_numpy(), bloque[target].to_numpy())
+                acum_hora.actualizar(bloque["hora"].to_numpy(), bloque[target].to_numpy())
+                dtypes_clave = (bloque["id"].dtype, bloque["hora"].dtype)
+
+                if seleccion is not None:
+                    if n_filas > len(seleccion):
+                        # Más filas que saltos de línea contados (finales de línea "\r")
+                        seleccion = np.concatenate([seleccion, rng.random(n_filas - len(seleccion)) < fraccion_muestra])
+                    bloque = bloque[seleccion[inicio:n_filas]]
+                columnas = [c for c in bloque.columns if c in columnas_base or c in FEATURES_NUMERICAS]
+                parte = compactar_features(bloque[columnas], dtypes_compactos(FEATURES_NUMERICAS))
+
+                for col in parte.columns:
+                    if col in trozos or (col not in reservas and not isinstance(parte[col].dtype, np.dtype)):
+                        trozos.setdefault(col, []).append(parte[col])
+                    else:
+                        valores = parte[col].to_numpy()
+                        if col not in reservas:
+                            reservas[col] = np.empty(reservadas, dtype=valores.dtype)
+                        reservas[col] = _escribir_en_reserva(reservas[col], valores, escritas)
+                escritas += len(parte)
+        except pd.errors.EmptyDataError:
+            pass
+        if n_filas == 0:
+            raise ValueError(f"El CSV no tiene filas: {path_csv}")
+
+        for col, destino in reservas.items():
+            if len(destino) != escritas:
+                destino.resize(escritas, refcheck=False)
+        columnas_df = {
+            col: reservas[col] if col in reservas else pd.concat(trozos[col], ignore_index=True)
+            for col in columnas
+        }
+        df = pd.DataFrame(columnas_df, copy=False)
+        del reservas, trozos, columnas_df
+
+        zona_stats, hora_stats = _tablas_estadisticas(acum_zona, acum_hora, *dtypes_clave)
+        datos = _adjuntar_estadisticas(df, zona_stats, hora_stats)
+        if medir_memoria:
+            _, pico = tracemalloc.get_traced_memory()
+    finally:
+        if medir_memoria:
+            tracemalloc.stop()
+
+    datos["memoria_pico_mb"] = pico / (1024 * 1024) if pico is not None else None
+    datos["filas_leidas"] = n_filas
+    datos["tam_bloque"] = tam_bloque
+    return datos
+
+
+def cargar_features_entrenamiento(path_csv, usar_cache=True, directorio_cache=None,
+                                   tam_bloque=None, fraccion_muestra=1.0, medir_memoria=False) -> dict:
+    """
+    Devuelve el DataFrame de features y las estadísticas aprendidas para un CSV.
+
+    La entrada de caché se identifica por el hash del contenido del CSV y
+    VERSION_FEATURES, de modo que un segundo entrenamiento sobre el mismo
+    dataset empieza directamente en el ajuste del modelo. Con tam_bloque se
+    usa la lectura por bloques (_calcular_features_por_bloques), que con
+    medir_memoria también devuelve su memoria pico.
+    """
+    huella = huella_fichero(path_csv)
+    nombre = f"{huella[:32]}_v{VERSION_FEATURES}"
+    if fraccion_muestra < 1.0:
+        nombre += f"_m{fraccion_muestra:g}"
+    ruta = os.path.join(directorio_cache or DIRECTORIO_CACHE, nombre)
+
+    if usar_cache:
+        datos = _cargar_cache_features(ruta)
+        if datos is not None and datos.get("huella_dataset") == huella:
+            datos["desde_cache"] = True
+            return datos
+
+    if tam_bloque or fraccion_muestra < 1.0:
+        datos = _calcular_features_por_bloques(
+            path_csv, tam_bloque or TAM_BLOQUE_DEFECTO, fraccion_muestra, medir_memoria=medir_memoria
+        )
+    else:
+        datos = _calcular_features_entrenamiento(path_csv)
+    datos["huella_dataset"] = huella
+    datos["version_features"] = VERSION_FEATURES
+
+    if usar_cache:
+        try:
+            os.makedirs(os.path.dirname(ruta), exist_ok=True)
+            _guardar_cache_features(ruta, datos)
+        except OSError as e:
+            print(f"No se pudo escribir la caché de features: {e}")
+
+    datos["desde_cache"] = False
+    return datos
+
+
+ALGORITMO_INCREMENTAL = "Deep Learning incremental (por bloques)"
+ALGORITMO_LINEA_BASE = "Línea base (zona × día × cuarto de hora)"
+
+ALGORITMOS = [
+    "Random Forest Mejorado",
+    "Gradient Boosting",
+    "Gradient Boosting (histogramas)",
+    "Deep Learning Mejorado",
+    "Árbol de decisión optimizado",
+    ALGORITMO_INCREMENTAL,
+    ALGORITMO_LINEA_BASE,
+]
+
+
+# Codificación de las categóricas y escalado que aplica cada algoritmo (se
+# guarda en el paquete del modelo junto con los dtypes de la matriz)
+PREPROCESADO_ALGORITMOS = {
+    "Random Forest Mejorado": {"categoricas": "ordinal", "escalado": False},
+    "Gradient Boosting": {"categoricas": "ordinal", "escalado": False},
+    "Gradient Boosting (histogramas)": {"categoricas": "nativa", "escalado": False},
+    "Deep Learning Mejorado": {"categoricas": "one-hot", "escalado": True},
+    "Árbol de decisión optimizado": {"categoricas": "ordinal", "escalado": False},
+    ALGORITMO_INCREMENTAL: {"categoricas": "one-hot", "escalado": True},
+    ALGORITMO_LINEA_BASE: {"categoricas": None, "escalado": False},
+}
+
+
+def _descripcion_preprocesado(algoritmo, features_numericas) -> dict:
+    """Preprocesado que necesita preparar_datos_prediccion para reproducir la matriz de entrenamiento."""
+    return {"dtypes": dtypes_compactos(features_numericas), **PREPROCESADO_ALGORITMOS[algoritmo]}
+
+
+def _metricas(y_test, y_pred) -> dict:
+    """RMSE, MAE, R² y MAPE (solo sobre valores reales no nulos). Sin filas de test, todas NaN."""
+    y_test = np.asarray(y_test)
+    y_pred = np.asarray(y_pred)
+    if len(y_test) == 0:
+        return {"rmse": np.nan, "mae": np.nan, "r2": np.nan, "mape": np.nan}
+    no_nulos = y_test > 0
+    mape = mean_absolute_percentage_error(y_test[no_nulos], y_pred[no_nulos]) if no_nulos.any() else np.nan
+    return {
+        "rmse": np.sqrt(mean_squared_error(y_test, y_pred)),
+        "mae": mean_absolute_error(y_test, y_pred),
+        "r2": r2_score(y_test, y_pred),
+        "mape": mape,
+    }
+
+
+# ==================== LÍNEA BASE ====================
+
+# Columnas de entrada de LineaBase (precip es opcional)
+COLUMNAS_LINEA_BASE = ["id", "dia_semana", "cuarto_hora", "precip"]
+UMBRAL_LLUVIA_MM = 0.1
+CUARTOS_DIA = 96
+
+
+def cuarto_hora(fechas: pd.Series) -> pd.Series:
+    """Índice del cuarto de hora del día (0-95) de cada fecha."""
+    return fechas.dt.hour * 4 + fechas.dt.minute // 15
+
+
+def _matriz_linea_base(df: pd.DataFrame) -> pd.DataFrame:
+    """Columnas de LineaBase a partir de un DataFrame con id, fecha (datetime) y, si hay, precip."""
+    fechas = pd.Series(pd.to_datetime(df["fecha"]).to_numpy())
+    return pd.DataFrame({
+        "id": df["id"].to_numpy(),
+        "dia_semana": fechas.dt.dayofweek.to_numpy(),
+        "cuarto_hora": cuarto_hora(fechas).to_numpy(),
+        "precip": df["precip"].to_numpy(dtype=float) if "precip" in df.columns else np.nan,
+    })
+
+
+class LineaBase(BaseEstimator, RegressorMixin):
+    """
+    Intensidad media por zona, día de la semana y cuarto de hora.
+
+    fit agrega el objetivo en una tabla densa (zonas + 1) × 7 × 96. Las
+    celdas sin datos toman la media de la zona en ese cuarto de hora
+    (cualquier día) y, si tampoco hay, la media de la zona; la última fila es
+    el perfil de todas las zonas y se usa para las no vistas. Con
+    ajuste_lluvia, las filas con precip > umbral_lluvia se multiplican por el
+    cociente entre la intensidad observada con lluvia y la de la tabla en esa
+    hora. predict solo indexa la tabla, sin preprocesado.
+    """
+
+    def __init__(self, ajuste_lluvia=True, umbral_lluvia=UMBRAL_LLUVIA_MM):
+        self.ajuste_lluvia = ajuste_lluvia
+        self.umbral_lluvia = umbral_lluvia
+
+    @staticmethod
+    def _columnas(X):
+        """id, día de la semana, cuarto de hora y precipitación como arrays."""
+        if isinstance(X, pd.DataFrame):
+            precip = X["precip"].to_numpy(dtype=float) if "precip" in X.columns else np.full(len(X), np.nan)
+            return (X["id"].to_numpy(dtype=float), X["dia_semana"].to_numpy(dtype=np.intp),
+                    X["cuarto_hora"].to_numpy(dtype=np.intp), precip)
+        X = np.asarray(X, dtype=float)
+        precip = X[:, 3] if X.shape[1] > 3 else np.full(len(X), np.nan)
+        return X[:, 0], X[:, 1].astype(np.intp), X[:, 2].astype(np.intp), precip
+
+    def _posiciones(self, ids) -> np.ndarray:
+        """Fila de la tabla de cada zona (la del perfil común si no se vio en entrenamiento)."""
+        ids = np.asarray(ids, dtype=float)
+        n = len(self.ids_)
+        pos = np.searchsorted(self.ids_, ids).clip(max=n - 1)
+        return np.where(self.ids_[pos] == ids, pos, n)
+
+    def fit(self, X, y):
+        ids, dia, cuarto, precip = self._columnas(X)
+        y = np.asarray(y, dtype=float)
+        self.ids_ = np.unique(ids)
+        zona = np.searchsorted(self.ids_, ids)
+
+        forma = (len(self.ids_), 7, CUARTOS_DIA)
+        celda = np.ravel_multi_index((zona, dia, cuarto), forma)
+        suma = np.bincount(celda, weights=y, minlength=np.prod(forma)).reshape(forma)
+        cuenta = np.bincount(celda, minlength=np.prod(forma)).reshape(forma)
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            tabla = suma / cuenta
+            tabla = np.where(cuenta > 0, tabla, (suma.sum(axis=1) / cuenta.sum(axis=1))[:, None, :])
+            tabla = np.where(np.isnan(tabla), (suma.sum(axis=(1, 2)) / cuenta.sum(axis=(1, 2)))[:, None, None], tabla)
+            perfil = suma.sum(axis=0) / cuenta.sum(axis=0)
+            perfil = np.where(np.isnan(perfil), suma.sum(axis=(0, 1)) / cuenta.sum(axis=(0, 1)), perfil)
+        perfil = np.where(np.isnan(perfil), y.mean() if len(y) else 0.0, perfil)
+        self.tabla_ = np.concatenate([tabla, perfil[None]]).astype(np.float32)
+
+        self.factor_lluvia_ = np.ones(24)
+        if self.ajuste_lluvia:
+            lluvia = precip > self.umbral_lluvia
+            hora = cuarto[lluvia] // 4
+            observada = np.bincount(hora, weights=y[lluvia], minlength=24)
+            esperada = np.bincount(hora, weights=self.tabla_[zona[lluvia], dia[lluvia], cuarto[lluvia]], minlength=24)
+            self.factor_lluvia_ = np.where(esperada > 0, observada / np.where(esperada > 0, esperada, 1), 1.0)
+        return self
+
+    def _predecir(self, posiciones, dia, cuarto, precip) -> np.ndarray:
+        pred = self.tabla_[posiciones, dia, cuarto].astype(np.float64)
+        if self.ajuste_lluvia:
+            pred *= np.where(precip > self.umbral_lluvia, self.factor_lluvia_[cuarto // 4], 1.0)
+        return pred
+
+    def predict(self, X) -> np.ndarray:
+        ids, dia, cuarto, precip = self._columnas(X)
+        return self._predecir(self._posiciones(ids), dia % 7, cuarto.clip(0, CUARTOS_DIA - 1), precip)
+
+    def predecir_zonas(self, ids, fecha, precip=None) -> np.ndarray:
+        """Predicción directa para varias zonas en una fecha ("DD/MM/YYYY HH:MM" o datetime), sin pandas."""
+        if isinstance(fecha, str):
+            fecha = datetime.strptime(fecha, FORMATO_FECHA)
+        posiciones = self._posiciones(ids)
+        dia = np.full(len(posiciones), fecha.weekday())
+        cuarto = np.full(len(posiciones), fecha.hour * 4 + fecha.minute // 15)
+        precip = np.nan if precip is None else float(precip)
+        return self._predecir(posiciones, dia, cuarto, np.full(len(posiciones), precip))
+
+    def compacta(self) -> "LineaBase":
+        """
+        Copia con la tabla en float16, la mitad de tamaño, para el respaldo que
+        acompaña a cada .mdl (~6,5 MB en lugar de 13 MB con 5.000 zonas). El
+        error relativo de cada celda es menor de 0,05 %; si algún valor no cabe
+        en float16 se conserva en float32.
+        """
+        copia = copy.copy(self)
+        if np.abs(self.tabla_).max(initial=0.0) < np.finfo(np.float16).max:
+            copia.tabla_ = self.tabla_.astype(np.float16)
+        return copia
+
+
+def ajustar_linea_base(df: pd.DataFrame, target="intensidad") -> LineaBase:
+    """LineaBase ajustada sobre todas las filas de un DataFrame de entrenamiento."""
+    return LineaBase().fit(_matriz_linea_base(df), df[target].to_numpy())
+
+
+# ==================== BÚSQUEDA POR HALVING ====================
+
+PARAM_GRID_ARBOL = {
+    "model__max_depth": [10, 15, 20, 25],
+    "model__min_samples_leaf": [2, 3, 5],
+    "model__min_samples_split": [5, 10]
+}
+
+MODOS_BUSQUEDA = ["grid", "halving"]
+
+
+class BusquedaSucesiva(BaseEstimator, RegressorMixin):
+    """
+    Búsqueda de hiperparámetros por successive halving sobre un Pipeline ("pre", "model").
+
+    El preprocesado se ajusta una sola vez por fold y su salida se reutiliza
+    para todos los candidatos. En cada ronda se evalúan los candidatos con una
+    fracción creciente de las filas de entrenamiento de cada fold y solo pasa
+    a la siguiente el mejor 1/factor. Con presupuesto_s la búsqueda se corta
+    al agotar ese tiempo y se queda el ganador de la última ronda completa: una
+    ronda a medias solo decide si es la primera.
+    """
+
+    def __init__(self, pipeline, param_grid, cv=5, factor=3, presupuesto_s=None, random_state=42):
+        self.pipeline = pipeline
+        self.param_grid = param_grid
+        self.cv = cv
+        self.factor = factor
+        self.presupuesto_s = presupuesto_s
+        self.random_state = random_state
+
+    def _folds_preprocesados(self, X, y):
+        """Ajusta el preprocesado una vez por fold y devuelve las matrices transformadas."""
+        rng = np.random.default_rng(self.random_state)
+        folds = []
+        for idx_train, idx_val in KFold(n_splits=self.cv).split(X):
+            pre = clone(self.pipeline.named_steps["pre"])
+            X_train = pre.fit_transform(X.iloc[idx_train], y[idx_train])
+            X_val = pre.transform(X.iloc[idx_val])
+            # Orden aleatorio fijo: las submuestras de cada ronda quedan anidadas
+            orden = rng.permutation(len(idx_train))
+            folds.append((X_train[orden], y[idx_train][orden], X_val, y[idx_val]))
+        return folds
+
+    def fit(self, X, y):
+        inicio = time.perf_counter()
+        limite = inicio + self.presupuesto_s if self.presupuesto_s else None
+        y = np.asarray(y, dtype=np.float64)
+
+        candidatos = list(ParameterGrid(self.param_grid))
+        folds = self._folds_preprocesados(X, y)
+        n_train = min(len(fold[1]) for fold in folds)
+        n_rondas = 1 + int(np.floor(np.log(len(candidatos)) / np.log(self.factor)))
+
+        self.best_params_ = candidatos[0]
+        self.best_score_ = None
+        self.rondas_ = []
+        self.n_ajustes_ = 0
+        self.presupuesto_agotado_ = False
+
+        for ronda in range(n_rondas):
+            n_filas = max(1, n_train // self.factor ** (n_rondas - 1 - ronda))
+            puntuaciones = []
+            for params in candidatos:
+                modelo = clone(self.pipeline.named_steps["model"]).set_params(
+                    **{clave.split("__", 1)[1]: valor for clave, valor in params.items()}
+                )
+                errores = []
+                for X_tr, y_tr, X_val, y_val in folds:
+                    if limite is not None and time.perf_counter() > limite:
+                        self.presupuesto_agotado_ = True
+                        break
+                    modelo.fit(X_tr[:n_filas], y_tr[:n_filas])
+                    errores.append(mean_squared_error(y_val, modelo.predict(X_val)))
+                    self.n_ajustes_ += 1
+                if self.presupuesto_agotado_:
+                    break
+                puntuaciones.append((-float(np.mean(errores)), params))
+
+            if puntuaciones:
+                puntuaciones.sort(key=lambda p: p[0], reverse=True)
+                completa = not self.presupuesto_agotado_
+                # Las puntuaciones de rondas distintas usan distinto número de filas:
+                # los candidatos de una ronda cortada no compiten con el ganador anterior
+                if completa or self.best_score_ is None:
+                    self.best_score_, self.best_params_ = puntuaciones[0]
+                self.rondas_.append({
+                    "n_candidatos": len(puntuaciones), "n_filas": n_filas,
+                    "completa": completa, "mejor_puntuacion": puntuaciones[0][0],
+                })
+
+            if self.presupuesto_agotado_:
+                break
+            candidatos = [params for _, params in puntuaciones[:int(np.ceil(len(puntuaciones) / self.factor))]]
+            if len(candidatos) == 1:
+                break
+
+        # El reajuste final con todas las filas no está sujeto al presupuesto
+        self.best_estimator_ = clone(self.pipeline).set_params(**self.best_params_)
+        self.best_estimator_.fit(X, y)
+        self.n_ajustes_ += 1
+        self.tiempo_busqueda_s_ = time.perf_counter() - inicio
+        return self
+
+    def predict(self, X):
+        return self.best_estimator_.predict(X)
+
+
+def _resumen_busqueda(modelo, tiempo_s):
+    """Número de ajustes, tiempo y mejores parámetros de una búsqueda de hiperparámetros (o None)."""
+    if isinstance(modelo, BusquedaSucesiva):
+        return {
+            "modo": "halving",
+            "n_ajustes": modelo.n_ajustes_,
+            "tiempo_s": modelo.tiempo_busqueda_s_,
+            "mejores_parametros": modelo.best_params_,
+            "rondas": modelo.rondas_,
+            "presupuesto_agotado": modelo.presupuesto_agotado_,
+        }
+    if isinstance(modelo, GridSearchCV):
+        return {
+            "modo": "grid",
+            "n_ajustes": len(modelo.cv_results_["params"]) * modelo.n_splits_ + int(bool(modelo.refit)),
+            "tiempo_s": tiempo_s,
+            "mejores_parametros": modelo.best_params_,
+        }
+    return None
+
+
+def _imputar_medianas(X: pd.DataFrame, median_values: dict):
+    """Rellena en X los nulos de cada columna numérica con su mediana."""
+    for col, mediana in median_values.items():
+        X[col] = X[col].fillna(mediana)
+
+
+def _matriz_entrenamiento(datos: dict, imputar=True):
+    """
+    Matriz X, objetivo y medianas a partir de las features cargadas.
+
+    Con imputar=False X conserva los nulos, para quien calcule las medianas
+    solo sobre una parte de las filas (el backtest, sobre cada pliegue).
+    """
+    df = datos["df"]
+    features_numericas = datos["features_numericas"]
+    X = df[features_numericas + datos["features_categoricas"]].copy()
+    y = df["intensidad"].copy()
 
     median_values = {col: X[col].median() for col in features_numericas}
-    for col in features_numericas:
-        X[col] = X[col].fillna(median_values[col])
+    if imputar:
+        _imputar_medianas(X, median_values)
+    return X, y, median_values
 
-    preprocesamiento = ColumnTransformer(
+
+def _metadatos_dataset(datos: dict, median_values: dict) -> dict:
+    """
+    Metadatos que dependen solo del dataset: estadísticas, tablas de lookup y
+    línea base. entrenar_modelos los calcula una vez y los comparte entre
+    todos los algoritmos.
+    """
+    return {
+        "features_numericas": datos["features_numericas"],
+        "features_categoricas": datos["features_categoricas"],
+        "median_values": median_values,
+        "zona_stats": datos["zona_stats"],
+        "hora_stats": datos["hora_stats"],
+        "zona_defaults": datos["zona_defaults"],
+        "hora_defaults": datos["hora_defaults"],
+        "zona_lookup": TablaLookup(datos["zona_stats"], "id", datos["zona_defaults"]),
+        "hora_lookup": TablaLookup(datos["hora_stats"], "hora", datos["hora_defaults"]),
+        "huella_dataset": datos["huella_dataset"],
+        "linea_base": ajustar_linea_base(datos["df"]).compacta(),
+        "features_desde_cache": datos["desde_cache"],
+        "memoria_pico_mb": datos.get("memoria_pico_mb"),
+    }
+
+
+def _metadatos_modelo(datos: dict, median_values: dict, algoritmo, comunes=None) -> dict:
+    """
+    Metadatos que acompañan al modelo para poder replicar el preprocesado al predecir.
+
+    comunes es el resultado de _metadatos_dataset si ya se calculó para estos datos.
+    """
+    return {
+        "algoritmo": algoritmo,
+        "preprocesado": _descripcion_preprocesado(algoritmo, datos["features_numericas"]),
+        **(comunes if comunes is not None else _metadatos_dataset(datos, median_values)),
+    }
+
+
+def _construir_modelos(features_numericas, features_categoricas, busqueda="grid", presupuesto_busqueda=None) -> dict:
+    """
+    Estimadores (sin entrenar) disponibles en entrenar_modelo.
+
+    busqueda elige cómo se ajustan los hiperparámetros del árbol de decisión:
+    "grid" (GridSearchCV exhaustivo) o "halving" (BusquedaSucesiva, opcionalmente
+    limitada a presupuesto_busqueda segundos).
+    """
+    if busqueda not in MODOS_BUSQUEDA:
+        raise ValueError(f"Modo de búsqueda desconocido: {busqueda}. Disponibles: {MODOS_BUSQUEDA}")
+
+    # Los árboles no necesitan escalado: las numéricas pasan tal cual y
+    # conditionsDay se codifica como un entero (las categorías nuevas, -1)
+    preprocesamiento_arboles = ColumnTransformer(
+        transformers=[
+            ("num", "passthrough", features_numericas),
+            ("cat", OrdinalEncoder(
+                handle_unknown="use_encoded_value", unknown_value=-1,
+                encoded_missing_value=-1, dtype=np.float32
+            ), features_categoricas)
+        ]
+    )
+
+    # La red neuronal sí necesita features escaladas y one-hot
+    preprocesamiento_escalado = ColumnTransformer(
         transformers=[
             ("num", StandardScaler(), features_numericas),
             ("cat", OneHotEncoder(handle_unknown="ignore", sparse_output=False, drop="if_binary"), features_categoricas)
@@ -115,7 +1061,7 @@ def entrenar_modelo(path_csv, algoritmo="Random Forest Mejorado"):
 
     modelos = {
         "Random Forest Mejorado": Pipeline([
-            ("pre", preprocesamiento),
+            ("pre", preprocesamiento_arboles),
             ("model", RandomForestRegressor(
                 n_estimators=250,
                 max_depth=20,
@@ -129,7 +1075,7 @@ def entrenar_modelo(path_csv, algoritmo="Random Forest Mejorado"):
         ]),
 
         "Gradient Boosting": Pipeline([
-            ("pre", preprocesamiento),
+            ("pre", preprocesamiento_arboles),
             ("model", GradientBoostingRegressor(
                 n_estimators=200,
                 learning_rate=0.05,
@@ -141,8 +1087,32 @@ def entrenar_modelo(path_csv, algoritmo="Random Forest Mejorado"):
             ))
         ]),
 
+        # Boosting por histogramas: multihilo, sin escalado y con conditionsDay
+        # como categórica nativa (el id tiene demasiados valores para serlo y
+        # queda representado por las estadísticas de zona)
+        "Gradient Boosting (histogramas)": Pipeline([
+            ("pre", ColumnTransformer(
+                transformers=[
+                    ("num", "passthrough", features_numericas),
+                    ("cat", OrdinalEncoder(
+                        handle_unknown="use_encoded_value", unknown_value=np.nan,
+                        encoded_missing_value=np.nan, dtype=np.float32
+                    ), features_categoricas)
+                ]
+            )),
+            ("model", HistGradientBoostingRegressor(
+                max_iter=300,
+                learning_rate=0.1,
+                max_leaf_nodes=63,
+                min_samples_leaf=20,
+                categorical_features=[False] * len(features_numericas) + [True] * len(features_categoricas),
+                early_stopping="auto",
+                random_state=42
+            ))
+        ]),
+
         "Deep Learning Mejorado": Pipeline([
-            ("pre", preprocesamiento),
+            ("pre", preprocesamiento_escalado),
             ("model", MLPRegressor(
                 hidden_layer_sizes=(128, 64, 32),
                 activation="relu",
@@ -156,22 +1126,70 @@ def entrenar_modelo(path_csv, algoritmo="Random Forest Mejorado"):
             ))
         ]),
 
+        ALGORITMO_LINEA_BASE: LineaBase(),
+
         "Árbol de decisión optimizado": GridSearchCV(
             Pipeline([
-                ("pre", preprocesamiento),
+                ("pre", preprocesamiento_arboles),
                 ("model", DecisionTreeRegressor(random_state=42))
             ]),
-            param_grid={
-                "model__max_depth": [10, 15, 20, 25],
-                "model__min_samples_leaf": [2, 3, 5],
-                "model__min_samples_split": [5, 10]
-            },
+            param_grid=PARAM_GRID_ARBOL,
             cv=5,
             scoring="neg_mean_squared_error",
             n_jobs=-1
         )
     }
 
+    if busqueda == "halving":
+        modelos["Árbol de decisión optimizado"] = BusquedaSucesiva(
+            Pipeline([
+                ("pre", preprocesamiento_arboles),
+                ("model", DecisionTreeRegressor(random_state=42))
+            ]),
+            param_grid=PARAM_GRID_ARBOL,
+            cv=5,
+            presupuesto_s=presupuesto_busqueda
+        )
+
+    return modelos
+
+
+def entrenar_modelo(path_csv, algoritmo="Random Forest Mejorado", usar_cache=True,
+                    tam_bloque=None, fraccion_muestra=1.0, busqueda="grid", presupuesto_busqueda=None,
+                    medir_memoria=False):
+    """
+    Entrena un modelo para predecir intensidad de tráfico usando solo features disponibles a priori.
+
+    Se guardan las estadísticas calculadas en entrenamiento (medianas, agregados
+    por zona y hora) para poder reutilizarlas al predecir y así permitir que el
+    CSV de predicción solo contenga las columnas base (sin las derivadas).
+    Las features se reutilizan desde la caché en disco si el CSV no ha cambiado.
+    Con tam_bloque el CSV se lee por bloques de ese número de filas y
+    fraccion_muestra permite ajustar solo con una muestra de las filas;
+    medir_memoria añade la memoria pico de esa lectura (memoria_pico_mb).
+    busqueda y presupuesto_busqueda controlan la búsqueda de hiperparámetros
+    del árbol de decisión (ver _construir_modelos).
+    """
+    if algoritmo == ALGORITMO_INCREMENTAL:
+        return entrenar_modelo_incremental(path_csv, tam_bloque=tam_bloque or TAM_BLOQUE_DEFECTO)
+
+    datos = cargar_features_entrenamiento(
+        path_csv, usar_cache=usar_cache, tam_bloque=tam_bloque, fraccion_muestra=fraccion_muestra,
+        medir_memoria=medir_memoria
+    )
+    if algoritmo == ALGORITMO_LINEA_BASE:
+        # La línea base solo usa zona, día de la semana, cuarto de hora y precipitación
+        df_base = _matriz_linea_base(datos["df"])
+        columnas = [c for c in COLUMNAS_LINEA_BASE if df_base[c].notna().any()]
+        datos = {
+            **datos, "df": df_base[columnas].assign(intensidad=datos["df"]["intensidad"].to_numpy(), fecha=datos["df"]["fecha"].to_numpy()),
+            "features_numericas": columnas, "features_categoricas": [],
+        }
+    X, y, median_values = _matriz_entrenamiento(datos)
+
+    modelos = _construir_modelos(
+        datos["features_numericas"], datos["features_categoricas"], busqueda, presupuesto_busqueda
+    )
     if algoritmo not in modelos:
         raise ValueError(f"Algoritmo desconocido: {algoritmo}. Disponibles: {list(modelos.keys())}")
 
@@ -180,36 +1198,711 @@ def entrenar_modelo(path_csv, algoritmo="Random Forest Mejorado"):
     )
 
     modelo = modelos[algoritmo]
+    inicio_ajuste = time.perf_counter()
     modelo.fit(X_train, y_train)
+    tiempo_ajuste = time.perf_counter() - inicio_ajuste
 
     y_pred = modelo.predict(X_test)
 
-    y_test_nonzero = y_test[y_test > 0]
-    y_pred_nonzero = y_pred[y_test > 0]
+    resultados = {
+        **_metricas(y_test, y_pred),
+        "modelo": modelo,
+        **_metadatos_modelo(datos, median_values, algoritmo),
+        "tiempo_ajuste_s": tiempo_ajuste,
+        "busqueda": _resumen_busqueda(modelo, tiempo_ajuste),
+        "X_train": X_train,
+        "X_test": X_test,
+        "y_train": y_train,
+        "y_test": y_test,
+        "y_pred": y_pred
+    }
+
+    return resultados, datos["df"]
 
-    mape = mean_absolute_percentage_error(y_test_nonzero, y_pred_nonzero) if len(y_test_nonzero) > 0 else np.nan
 
-    resultados = {
-        "rmse": np.sqrt(mean_squared_error(y_test, y_pred)),
-        "mae": mean_absolute_error(y_test, y_pred),
-        "r2": r2_score(y_test, y_pred),
-        "mape": mape,
+# ==================== ENTRENAMIENTO EN PARALELO ====================
+
+# Algoritmos que se entrenan sobre la matriz de features en memoria (el
+# incremental lee el CSV por su cuenta y no se compara con el resto)
+ALGORITMOS_COMPARABLES = [alg for alg in ALGORITMOS if alg not in (ALGORITMO_INCREMENTAL, ALGORITMO_LINEA_BASE)]
+
+
+def _escribir_matriz_compartida(directorio, X, y, particiones, features_numericas, features_categoricas):
+    """
+    Vuelca particiones de la matriz (nombre -> índices de fila) a ficheros .npy
+    para que los procesos hijos las abran con mmap en lugar de recibir una
+    copia serializada.
+
+    La parte numérica se escribe en float32 (el dtype de la matriz compacta)
+    y en orden Fortran (columna a columna), de modo que el DataFrame
+    construido sobre el mmap no necesita copiar los datos.
+    """
+    categorias, codigos_cat = {}, {}
+    for col in features_categoricas:
+        codigos, cats = pd.factorize(X[col])
+        categorias[col] = np.asarray(cats, dtype=object)
+        codigos_cat[col] = codigos.astype(np.int32)
+
+    for parte, idx in particiones.items():
+        numerica = np.lib.format.open_memmap(
+            os.path.join(directorio, f"X_num_{parte}.npy"), mode="w+",
+            dtype=np.float32, shape=(len(idx), len(features_numericas)), fortran_order=True
+        )
+        for j, col in enumerate(features_numericas):
+            numerica[:, j] = X[col].to_numpy(dtype=np.float32)[idx]
+        numerica.flush()
+        del numerica
+
+        for col in features_categoricas:
+            np.save(os.path.join(directorio, f"X_cat_{col}_{parte}.npy"), codigos_cat[col][idx])
+
+        np.save(os.path.join(directorio, f"y_{parte}.npy"), y.to_numpy(dtype=np.float64)[idx])
+
+    joblib.dump({
+        "features_numericas": features_numericas,
+        "features_categoricas": features_categoricas,
+        "categorias": categorias,
+    }, os.path.join(directorio, "meta.joblib"))
+
+
+def _cargar_matriz_compartida(directorio, parte, meta):
+    """Abre con mmap una partición escrita por _escribir_matriz_compartida."""
+    numerica = np.load(os.path.join(directorio, f"X_num_{parte}.npy"), mmap_mode="r")
+    X = pd.DataFrame(numerica, columns=meta["features_numericas"], copy=False)
+    for col in meta["features_categoricas"]:
+        codigos = np.load(os.path.join(directorio, f"X_cat_{col}_{parte}.npy"))
+        X[col] = meta["categorias"][col][codigos]
+    y = np.load(os.path.join(directorio, f"y_{parte}.npy"), mmap_mode="r")
+    return X, y
+
+
+def _repartir_nucleos(n_tareas, n_procesos=None):
+    """Número de procesos y de hilos por proceso para no sobresuscribir la CPU."""
+    n_cpus = os.cpu_count() or 1
+    n_procesos = max(1, min(n_procesos or n_cpus, n_tareas))
+    return n_procesos, max(1, n_cpus // n_procesos)
+
+
+def _entrenar_en_proceso(directorio, algoritmo, hilos, busqueda="grid", presupuesto_busqueda=None):
+    """Ajusta y evalúa un algoritmo dentro de un proceso hijo."""
+    from threadpoolctl import threadpool_limits
+
+    meta = joblib.load(os.path.join(directorio, "meta.joblib"))
+    X_train, y_train = _cargar_matriz_compartida(directorio, "train", meta)
+    X_test, y_test = _cargar_matriz_compartida(directorio, "test", meta)
+
+    modelo = _construir_modelos(
+        meta["features_numericas"], meta["features_categoricas"], busqueda, presupuesto_busqueda
+    )[algoritmo]
+    # Cada proceso usa su parte de los núcleos para no sobresuscribir la CPU
+    modelo.set_params(**{k: hilos for k in modelo.get_params() if k.endswith("n_jobs")})
+
+    with threadpool_limits(limits=hilos):
+        inicio_ajuste = time.perf_counter()
+        modelo.fit(X_train, y_train)
+        tiempo_ajuste = time.perf_counter() - inicio_ajuste
+        y_pred = modelo.predict(X_test)
+
+    return {
+        **_metricas(np.asarray(y_test), y_pred),
         "modelo": modelo,
+        "tiempo_ajuste_s": tiempo_ajuste,
+        "busqueda": _resumen_busqueda(modelo, tiempo_ajuste),
+        "y_pred": y_pred,
+    }
+
+
+def entrenar_modelos(path_csv, algoritmos=None, n_procesos=None, usar_cache=True,
+                     busqueda="grid", presupuesto_busqueda=None):
+    """
+    Entrena varios algoritmos en paralelo sobre la misma matriz de features.
+
+    Las features se calculan una sola vez y la partición train/test se comparte
+    con los procesos hijos mediante ficheros mapeados en memoria, así que todos
+    los modelos se evalúan exactamente sobre las mismas filas.
+
+    Devuelve un diccionario algoritmo -> resultados (con las mismas claves que
+    entrenar_modelo) y una tabla comparativa ordenada por RMSE. Si un algoritmo
+    falla, su entrada es None y el error aparece en la tabla.
+    """
+    algoritmos = list(algoritmos or ALGORITMOS_COMPARABLES)
+    desconocidos = [alg for alg in algoritmos if alg not in ALGORITMOS_COMPARABLES]
+    if desconocidos:
+        raise ValueError(f"Algoritmos no comparables: {desconocidos}. Disponibles: {ALGORITMOS_COMPARABLES}")
+
+    datos = cargar_features_entrenamiento(path_csv, usar_cache=usar_cache)
+    X, y, median_values = _matriz_entrenamiento(datos)
+    idx_train, idx_test = train_test_split(np.arange(len(X)), test_size=0.2, random_state=42)
+
+    n_procesos, hilos = _repartir_nucleos(len(algoritmos), n_procesos)
+
+    salidas, errores = {}, {}
+    with tempfile.TemporaryDirectory(prefix="safedrive_") as directorio:
+        _escribir_matriz_compartida(
+            directorio, X, y, {"train": idx_train, "test": idx_test},
+            datos["features_numericas"], datos["features_categoricas"]
+        )
+        contexto = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=n_procesos, mp_context=contexto) as pool:
+            futuros = {
+                pool.submit(_entrenar_en_proceso, directorio, alg, hilos, busqueda, presupuesto_busqueda): alg
+                for alg in algoritmos
+            }
+            for futuro in as_completed(futuros):
+                alg = futuros[futuro]
+                try:
+                    salidas[alg] = futuro.result()
+                except Exception as e:
+                    errores[alg] = str(e)
+
+    X_train, X_test = X.iloc[idx_train], X.iloc[idx_test]
+    y_train, y_test = y.iloc[idx_train], y.iloc[idx_test]
+
+    # Línea base y lookups son iguales para todos los algoritmos: se calculan una vez
+    comunes = _metadatos_dataset(datos, median_values)
+    resultados, filas = {}, []
+    for alg in algoritmos:
+        if alg in errores:
+            resultados[alg] = None
+            filas.append({"Modelo": alg, "Error": errores[alg]})
+            continue
+        salida = salidas[alg]
+        resultados[alg] = {
+            **salida,
+            **_metadatos_modelo(datos, median_values, alg, comunes),
+            "X_train": X_train,
+            "X_test": X_test,
+            "y_train": y_train,
+            "y_test": y_test,
+        }
+        filas.append({
+            "Modelo": alg,
+            "RMSE": salida["rmse"],
+            "MAE": salida["mae"],
+            "R2": salida["r2"],
+            "MAPE": salida["mape"],
+            "Tiempo (s)": salida["tiempo_ajuste_s"],
+            "Error": None,
+        })
+
+    tabla = pd.DataFrame(filas, columns=["Modelo", "RMSE", "MAE", "R2", "MAPE", "Tiempo (s)", "Error"])
+    tabla = tabla.sort_values("RMSE", na_position="last").reset_index(drop=True)
+    return resultados, tabla
+
+
+# ==================== BACKTEST TEMPORAL ====================
+
+def _backtest_en_proceso(directorio, algoritmo, semana_test, hilos):
+    """
+    Ajusta y evalúa un pliegue del backtest: entrena con las semanas
+    anteriores a semana_test y evalúa sobre semana_test.
+
+    Las medianas de imputación y las estadísticas por zona y hora se
+    recalculan solo con las filas de entrenamiento del pliegue para que no
+    se filtren datos futuros.
+    """
+    from threadpoolctl import threadpool_limits
+
+    meta = joblib.load(os.path.join(directorio, "meta.joblib"))
+    X, y = _cargar_matriz_compartida(directorio, "todo", meta)
+    semanas = np.load(os.path.join(directorio, "semanas.npy"), mmap_mode="r")
+    en_train = (semanas >= 0) & (semanas < semana_test)
+    en_test = semanas == semana_test
+
+    X_train, y_train = X[en_train].reset_index(drop=True), np.asarray(y[en_train])
+    X_test, y_test = X[en_test].reset_index(drop=True), np.asarray(y[en_test])
+
+    medianas = {col: X_train[col].median() for col in meta["features_numericas"]}
+    for X_parte in (X_train, X_test):
+        _imputar_medianas(X_parte, medianas)
+
+    zona_stats, hora_stats = _estadisticas_zona_hora(
+        pd.DataFrame({"id": X_train["id"], "hora": X_train["hora"], "intensidad": y_train})
+    )
+    zona_defaults, hora_defaults = _valores_defecto(zona_stats, hora_stats)
+    lookups = [
+        (TablaLookup(zona_stats, "id", zona_defaults), "id"),
+        (TablaLookup(hora_stats, "hora", hora_defaults), "hora"),
+    ]
+    for X_parte in (X_train, X_test):
+        for lookup, clave in lookups:
+            for col, valores in lookup.columnas_de(X_parte[clave].to_numpy()).items():
+                if col in X_parte.columns:
+                    X_parte[col] = valores.astype(np.float32)
+
+    modelo = _construir_modelos(meta["features_numericas"], meta["features_categoricas"])[algoritmo]
+    modelo.set_params(**{k: hilos for k in modelo.get_params() if k.endswith("n_jobs")})
+
+    with threadpool_limits(limits=hilos):
+        inicio_ajuste = time.perf_counter()
+        modelo.fit(X_train, y_train)
+        tiempo_ajuste = time.perf_counter() - inicio_ajuste
+        y_pred = modelo.predict(X_test)
+
+    return {
+        **_metricas(y_test, y_pred),
+        "n_train": len(y_train),
+        "n_test": len(y_test),
+        "tiempo_ajuste_s": tiempo_ajuste,
+    }
+
+
+def backtest_modelo(path_csv, algoritmo="Random Forest Mejorado", n_pliegues=4, n_procesos=None, usar_cache=True):
+    """
+    Backtest con origen móvil por semanas.
+
+    El pliegue k entrena con las semanas 1..k del dataset y evalúa sobre la
+    semana k+1, de modo que ninguna lectura futura de una zona entra en el
+    entrenamiento (a diferencia de la partición aleatoria de entrenar_modelo).
+    Se evalúan las n_pliegues últimas semanas; los pliegues se ajustan en
+    paralelo sobre la matriz de features cacheada, compartida con mmap.
+
+    Devuelve una tabla con una fila por pliegue: semana de test, filas de
+    train y test, métricas y tiempo de ajuste. Una semana sin filas (un hueco
+    en el dataset) o sin semanas anteriores con datos no se ajusta: su fila
+    aparece con las filas que tiene y métricas y tiempo NaN.
+    """
+    if algoritmo not in ALGORITMOS_COMPARABLES:
+        raise ValueError(f"Algoritmo no disponible para backtest: {algoritmo}. Disponibles: {ALGORITMOS_COMPARABLES}")
+
+    datos = cargar_features_entrenamiento(path_csv, usar_cache=usar_cache)
+    X, y, _ = _matriz_entrenamiento(datos, imputar=False)
+
+    fechas = pd.to_datetime(datos["df"]["fecha"])
+    inicio = fechas.min().normalize()
+    semanas = ((fechas - inicio).dt.days // 7).fillna(-1).to_numpy(dtype=np.int32)
+    n_semanas = int(semanas.max()) + 1
+    if n_semanas < 2:
+        raise ValueError("El backtest necesita al menos dos semanas de datos")
+    semanas_test = list(range(max(1, n_semanas - n_pliegues), n_semanas))
+    filas_por_semana = np.bincount(semanas[semanas >= 0], minlength=n_semanas)
+    salidas = {
+        semana: {
+            **_metricas([], []),
+            "n_train": int(filas_por_semana[:semana].sum()),
+            "n_test": int(filas_por_semana[semana]),
+            "tiempo_ajuste_s": np.nan,
+        }
+        for semana in semanas_test
+    }
+    con_datos = [s for s in semanas_test if salidas[s]["n_train"] and salidas[s]["n_test"]]
+    if not con_datos:
+        raise ValueError("Ninguna semana de test del backtest tiene filas de entrenamiento y de test")
+
+    n_procesos, hilos = _repartir_nucleos(len(con_datos), n_procesos)
+    with tempfile.TemporaryDirectory(prefix="safedrive_") as directorio:
+        _escribir_matriz_compartida(
+            directorio, X, y, {"todo": np.arange(len(X))},
+            datos["features_numericas"], datos["features_categoricas"]
+        )
+        np.save(os.path.join(directorio, "semanas.npy"), semanas)
+
+        contexto = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=n_procesos, mp_context=contexto) as pool:
+            futuros = {
+                pool.submit(_backtest_en_proceso, directorio, algoritmo, semana, hilos): semana
+                for semana in con_datos
+            }
+            for futuro in as_completed(futuros):
+                salidas[futuros[futuro]] = futuro.result()
+
+    filas = []
+    for pliegue, semana in enumerate(semanas_test, 1):
+        salida = salidas[semana]
+        filas.append({
+            "Pliegue": pliegue,
+            "Semana test": (inicio + pd.Timedelta(weeks=semana)).strftime("%d/%m/%Y"),
+            "Filas train": salida["n_train"],
+            "Filas test": salida["n_test"],
+            "RMSE": salida["rmse"],
+            "MAE": salida["mae"],
+            "R2": salida["r2"],
+            "MAPE": salida["mape"],
+            "Tiempo (s)": salida["tiempo_ajuste_s"],
+        })
+    return pd.DataFrame(filas)
+
+
+# ==================== ENTRENAMIENTO INCREMENTAL ====================
+
+MAX_FILAS_MUESTRA = 100_000
+MAX_FILAS_TEST = 200_000
+
+
+def _muestra_uniforme(actual, bloque: pd.DataFrame, max_filas: int, rng) -> pd.DataFrame:
+    """Mantiene una muestra uniforme de tamaño acotado (las max_filas de menor prioridad aleatoria)."""
+    bloque = bloque.assign(_prioridad=rng.random(len(bloque)))
+    muestra = bloque if actual is None else pd.concat([actual, bloque], ignore_index=True)
+    if len(muestra) > max_filas:
+        muestra = muestra.nsmallest(max_filas, "_prioridad").reset_index(drop=True)
+    return muestra
+
+
+def _es_fila_test(indices) -> np.ndarray:
+    """Asignación determinista de ~20% de las filas al conjunto de test, estable entre pasadas."""
+    return (np.asarray(indices, dtype=np.uint64) * np.uint64(2654435761)) % np.uint64(100) < np.uint64(20)
+
+
+def entrenar_modelo_incremental(path_csv, tam_bloque=TAM_BLOQUE_DEFECTO, epocas=3, semilla=42):
+    """
+    Entrena una red neuronal con partial_fit recorriendo el CSV por bloques.
+
+    Pensado para datasets que no caben en memoria:
+      1. Primera pasada: estadísticas por zona y hora (AcumuladorEstadisticas),
+         categorías de conditionsDay y una muestra uniforme acotada de filas.
+      2. Con la muestra se calculan las medianas de imputación y se ajusta el
+         ColumnTransformer (StandardScaler + OneHotEncoder con todas las categorías).
+      3. En cada época se transforma cada bloque con preparar_datos_prediccion
+         y el preprocesado ya ajustado y se llama a partial_fit.
+
+    El resultado tiene las mismas claves que entrenar_modelo, así que el
+    paquete .mdl se guarda y se carga igual. Devuelve (resultados, None):
+    no se materializa el DataFrame completo.
+    """
+    target = "intensidad"
+    rng = np.random.default_rng(semilla)
+    columnas_base = {"id", "fecha", target} | set(FEATURES_NUMERICAS) | set(FEATURES_CATEGORICAS)
+
+    def leer_bloques():
+        return pd.read_csv(path_csv, sep=";", chunksize=tam_bloque, usecols=lambda c: c in columnas_base)
+
+    # 1. Estadísticas, categorías y muestra
+    acum_zona = AcumuladorEstadisticas()
+    acum_hora = AcumuladorEstadisticas()
+    categorias = set()
+    muestra = None
+    n_filas = 0
+    for bloque in leer_bloques():
+        n_filas += len(bloque)
+        feat = _agregar_features_temporales(bloque)
+        acum_zona.actualizar(feat["id"].to_numpy(), feat[target].to_numpy())
+        acum_hora.actualizar(feat["hora"].to_numpy(), feat[target].to_numpy())
+        for col in FEATURES_CATEGORICAS:
+            if col in feat.columns:
+                categorias.update(feat[col].astype(str).unique())
+        muestra = _muestra_uniforme(muestra, bloque, MAX_FILAS_MUESTRA, rng)
+    if n_filas == 0:
+        raise ValueError(f"El CSV no tiene filas: {path_csv}")
+
+    muestra = muestra.drop(columns="_prioridad")
+    muestra_feat = _agregar_features_temporales(muestra)
+    zona_stats, hora_stats = _tablas_estadisticas(acum_zona, acum_hora, muestra_feat["id"].dtype, muestra_feat["hora"].dtype)
+    datos = _adjuntar_estadisticas(muestra_feat, zona_stats, hora_stats)
+    features_numericas = datos["features_numericas"]
+    features_categoricas = datos["features_categoricas"]
+
+    paquete = {
+        "algoritmo": ALGORITMO_INCREMENTAL,
+        "preprocesado": _descripcion_preprocesado(ALGORITMO_INCREMENTAL, features_numericas),
         "features_numericas": features_numericas,
         "features_categoricas": features_categoricas,
-        "median_values": median_values,
+        "median_values": {col: datos["df"][col].median() for col in features_numericas},
         "zona_stats": zona_stats,
         "hora_stats": hora_stats,
-        "zona_defaults": zona_defaults,
-        "hora_defaults": hora_defaults,
-        "X_train": X_train,
+        "zona_defaults": datos["zona_defaults"],
+        "hora_defaults": datos["hora_defaults"],
+        "zona_lookup": TablaLookup(zona_stats, "id", datos["zona_defaults"]),
+        "hora_lookup": TablaLookup(hora_stats, "hora", datos["hora_defaults"]),
+    }
+
+    # 2. Preprocesado ajustado sobre la muestra, con todas las categorías vistas
+    preprocesamiento = ColumnTransformer(
+        transformers=[
+            ("num", StandardScaler(), features_numericas),
+            ("cat", OneHotEncoder(
+                categories=[sorted(categorias | {"unknown"})] * len(features_categoricas),
+                handle_unknown="ignore", sparse_output=False, drop="if_binary"
+            ), features_categoricas)
+        ],
+        remainder='passthrough'
+    )
+    preprocesamiento.fit(preparar_datos_prediccion(muestra, paquete))
+    del muestra, muestra_feat, datos
+
+    # 3. Épocas de partial_fit sobre los bloques
+    red = MLPRegressor(
+        hidden_layer_sizes=(128, 64, 32),
+        activation="relu",
+        solver="adam",
+        alpha=0.001,
+        random_state=semilla
+    )
+    X_test = y_test = None
+    for epoca in range(epocas):
+        inicio = 0
+        for bloque in leer_bloques():
+            indices = np.arange(inicio, inicio + len(bloque))
+            inicio += len(bloque)
+            es_test = _es_fila_test(indices)
+
+            X_bloque = preparar_datos_prediccion(bloque, paquete)
+            y_bloque = bloque[target].to_numpy(dtype=float)
+
+            if epoca == 0 and es_test.any():
+                test = X_bloque[es_test].assign(**{target: y_bloque[es_test]})
+                X_test = _muestra_uniforme(X_test, test, MAX_FILAS_TEST, rng)
+
+            orden = rng.permutation(np.flatnonzero(~es_test))
+            if len(orden):
+                red.partial_fit(preprocesamiento.transform(X_bloque.iloc[orden]), y_bloque[orden])
+
+    if not hasattr(red, "coefs_"):
+        raise ValueError("No hay filas de entrenamiento: el CSV es demasiado pequeño o epocas < 1")
+
+    modelo = Pipeline([("pre", preprocesamiento), ("model", red)])
+    if X_test is None:
+        # Sin filas de test las métricas quedan en NaN en lugar de fallar
+        X_test = preparar_datos_prediccion(bloque.head(0), paquete)
+        y_test = pd.Series(dtype=float, name=target)
+        y_pred = np.empty(0)
+    else:
+        y_test = X_test[target].reset_index(drop=True)
+        X_test = X_test.drop(columns=[target, "_prioridad"])
+        y_pred = modelo.predict(X_test)
+
+    resultados = {
+        **_metricas(y_test, y_pred),
+        "modelo": modelo,
+        **paquete,
+        "huella_dataset": huella_fichero(path_csv),
+        "features_desde_cache": False,
+        "memoria_pico_mb": None,
+        "n_filas": n_filas,
+        "epocas": epocas,
+        "X_train": None,
         "X_test": X_test,
-        "y_train": y_train,
+        "y_train": None,
         "y_test": y_test,
         "y_pred": y_pred
     }
+    return resultados, None
+
+
+CLAVES_PAQUETE = [
+    "features_numericas", "features_categoricas", "median_values",
+    "zona_stats", "hora_stats", "zona_defaults", "hora_defaults",
+    "zona_lookup", "hora_lookup", "preprocesado", "algoritmo", "huella_dataset", "compactacion", "linea_base",
+]
+
+
+def crear_paquete_modelo(resultados: dict) -> dict:
+    """Modelo y metadatos necesarios para predecir, listos para guardar en un .mdl."""
+    paquete = {"modelo": resultados["modelo"]}
+    paquete.update({clave: resultados.get(clave) for clave in CLAVES_PAQUETE})
+    paquete["metricas"] = {clave: resultados.get(clave) for clave in ("rmse", "mae", "r2", "mape", "tiempo_ajuste_s")}
+    zona_lookup, hora_lookup = obtener_lookups(paquete)
+    paquete["zona_lookup"], paquete["hora_lookup"] = zona_lookup, hora_lookup
+    return paquete
+
+
+# ==================== COMPACTACIÓN DE RANDOM FOREST ====================
+
+ARBOLES_COMPACTACION = (10, 25, 50, 100)
+PROFUNDIDADES_DESTILADO = (8, 12, 16)
+MAX_FILAS_SELECCION = 20_000
+MAX_FILAS_DESTILADO = 500_000
+FILAS_MEDIDA_LATENCIA = 1_000
+
+
+def _orden_arboles(bosque, Z: np.ndarray, objetivo: np.ndarray, n_max: int) -> list:
+    """
+    Selección hacia delante de árboles (ordered aggregation).
+
+    En cada paso se añade el árbol con el que la media de los ya elegidos
+    más se acerca a objetivo; devuelve los índices de los n_max primeros.
+    """
+    P = np.vstack([arbol.predict(Z) for arbol in bosque.estimators_])
+    suma = np.zeros(P.shape[1])
+    elegidos, libres = [], np.ones(len(P), dtype=bool)
+    for k in range(1, min(n_max, len(P)) + 1):
+        errores = (((suma + P) / k - objetivo) ** 2).mean(axis=1)
+        errores[~libres] = np.inf
+        mejor = int(np.argmin(errores))
+        elegidos.append(mejor)
+        libres[mejor] = False
+        suma += P[mejor]
+    return elegidos
+
+
+def _medir_variante(modelo, X_test, y_test, X_latencia) -> dict:
+    """Métricas sobre el conjunto de test, latencia de predicción y tamaño serializado."""
+    y_pred = modelo.predict(X_test)
+    inicio = time.perf_counter()
+    modelo.predict(X_latencia)
+    latencia = time.perf_counter() - inicio
+    buffer = io.BytesIO()
+    joblib.dump(modelo, buffer)
+    estimador = modelo.named_steps["model"]
+    arboles = getattr(estimador, "estimators_", [estimador])
+    return {
+        **_metricas(y_test, y_pred),
+        "arboles": len(arboles),
+        "nodos": int(sum(arbol.tree_.node_count for arbol in arboles)),
+        "latencia_ms": latencia * 1000,
+        "tamano_mb": buffer.getbuffer().nbytes / 1e6,
+    }
+
+
+def compactar_random_forest(resultados: dict, n_arboles=ARBOLES_COMPACTACION,
+                            profundidades=PROFUNDIDADES_DESTILADO, semilla=42):
+    """
+    Variantes más pequeñas de un Random Forest ya entrenado.
+
+    - "Subconjunto de k árboles": los k árboles elegidos por selección hacia
+      delante para reproducir la predicción del bosque completo sobre una
+      muestra de entrenamiento (el conjunto de test no interviene).
+    - "Destilado (profundidad d)": un único árbol de profundidad d ajustado a
+      las predicciones del bosque sobre el entrenamiento.
+
+    Todas reutilizan el preprocesado ajustado. Devuelve (variantes, tabla):
+    un dict nombre -> Pipeline y un DataFrame con las métricas sobre el
+    conjunto de test, árboles, nodos, latencia (ms por FILAS_MEDIDA_LATENCIA
+    filas) y tamaño (MB) de cada variante, empezando por el original.
+    """
+    modelo = resultados["modelo"]
+    if not isinstance(modelo, Pipeline) or not isinstance(modelo.named_steps.get("model"), RandomForestRegressor):
+        raise ValueError("La compactación solo está disponible para modelos Random Forest")
+    pre, bosque = modelo.named_steps["pre"], modelo.named_steps["model"]
+
+    rng = np.random.default_rng(semilla)
+    X_train, y_train = resultados["X_train"], np.asarray(resultados["y_train"])
+    X_test, y_test = resultados["X_test"], np.asarray(resultados["y_test"])
+    X_latencia = X_test.iloc[rng.choice(len(X_test), min(FILAS_MEDIDA_LATENCIA, len(X_test)), replace=False)]
+
+    variantes = {"Original": modelo}
+    muestra = rng.choice(len(X_train), min(MAX_FILAS_SELECCION, len(X_train)), replace=False)
+    Z = pre.transform(X_train.iloc[muestra])
+    orden = _orden_arboles(bosque, Z, bosque.predict(Z), max(n_arboles))
+    for k in sorted(n_arboles):
+        if k >= len(bosque.estimators_):
+            continue
+        pequeno = copy.copy(bosque)
+        pequeno.estimators_ = [bosque.estimators_[i] for i in orden[:k]]
+        pequeno.n_estimators = k
+        variantes[f"Subconjunto de {k} árboles"] = Pipeline([("pre", pre), ("model", pequeno)])
+
+    muestra = rng.choice(len(X_train), min(MAX_FILAS_DESTILADO, len(X_train)), replace=False)
+    Z = pre.transform(X_train.iloc[muestra])
+    objetivo = bosque.predict(Z)
+    for profundidad in sorted(profundidades):
+        arbol = DecisionTreeRegressor(max_depth=profundidad, min_samples_leaf=bosque.min_samples_leaf, random_state=semilla)
+        arbol.fit(Z, objetivo)
+        variantes[f"Destilado (profundidad {profundidad})"] = Pipeline([("pre", pre), ("model", arbol)])
 
-    return resultados, df
+    filas = []
+    for nombre, variante in variantes.items():
+        medida = _medir_variante(variante, X_test, y_test, X_latencia)
+        filas.append({
+            "Variante": nombre,
+            "Árboles": medida["arboles"],
+            "Nodos": medida["nodos"],
+            "RMSE": medida["rmse"],
+            "MAE": medida["mae"],
+            "R2": medida["r2"],
+            "MAPE": medida["mape"],
+            "Latencia (ms)": medida["latencia_ms"],
+            "Tamaño (MB)": medida["tamano_mb"],
+        })
+    return variantes, pd.DataFrame(filas)
+
+
+def resultados_compactados(resultados: dict, variantes: dict, tabla: pd.DataFrame, variante: str) -> dict:
+    """
+    Resultados de entrenamiento con el modelo sustituido por una variante de
+    compactar_random_forest, listos para crear_paquete_modelo.
+    """
+    fila = tabla.set_index("Variante").loc[variante]
+    modelo = variantes[variante]
+    return {
+        **resultados,
+        "modelo": modelo,
+        "rmse": fila["RMSE"], "mae": fila["MAE"], "r2": fila["R2"], "mape": fila["MAPE"],
+        "y_pred": modelo.predict(resultados["X_test"]),
+        "compactacion": {
+            "variante": variante,
+            "arboles": int(fila["Árboles"]),
+            "nodos": int(fila["Nodos"]),
+            "tamano_mb": float(fila["Tamaño (MB)"]),
+        },
+    }
+
+
+# ==================== CACHÉ DE MODELOS ====================
+
+MAX_MODELOS_CACHE = 3
+
+_modelos_cargados = OrderedDict()
+_cerrojo_modelos = threading.Lock()
+_estadisticas_modelos = {"aciertos": 0, "fallos": 0}
+
+
+def cargar_paquete_modelo(path: str, mmap: bool = True):
+    """
+    Carga un .mdl una sola vez por proceso.
+
+    La entrada se identifica por ruta, tamaño y fecha de modificación, así que
+    sobrescribir el fichero provoca una recarga. Los .mdl v2 se abren leyendo
+    solo la cabecera y cada sección se carga al usarla por primera vez. Con
+    mmap, en v1 y v2 los arrays grandes se mapean en memoria de solo lectura
+    en lugar de copiarse (joblib lo ignora en ficheros comprimidos). Ambas
+    pestañas reciben el mismo objeto: no debe modificarse.
+
+    Devuelve (paquete, info) con info = {"desde_cache", "tiempo_s", "aciertos", "fallos"}.
+    """
+    inicio = time.perf_counter()
+    st = os.stat(path)
+    ruta = os.path.abspath(path)
+    clave = (ruta, st.st_size, st.st_mtime_ns)
+
+    # El cerrojo evita que dos hilos carguen a la vez el mismo modelo
+    with _cerrojo_modelos:
+        desde_cache = clave in _modelos_cargados
+        if desde_cache:
+            _modelos_cargados.move_to_end(clave)
+            _estadisticas_modelos["aciertos"] += 1
+        else:
+            for anterior in [c for c in _modelos_cargados if c[0] == ruta]:
+                del _modelos_cargados[anterior]
+            paquete = abrir_paquete_modelo(path, mmap=mmap)
+            if isinstance(paquete, dict) and paquete.get("zona_lookup") is None:
+                # Modelos antiguos: las lookups se construyen una vez y quedan en la caché
+                paquete = dict(paquete)
+                paquete["zona_lookup"], paquete["hora_lookup"] = obtener_lookups(paquete)
+            _modelos_cargados[clave] = paquete
+            _estadisticas_modelos["fallos"] += 1
+            while len(_modelos_cargados) > MAX_MODELOS_CACHE:
+                _modelos_cargados.popitem(last=False)
+        paquete = _modelos_cargados[clave]
+        info = {"desde_cache": desde_cache, "tiempo_s": time.perf_counter() - inicio, **_estadisticas_modelos}
+    return paquete, info
+
+
+def vaciar_cache_modelos():
+    """Olvida los modelos cargados (y reinicia los contadores)."""
+    with _cerrojo_modelos:
+        _modelos_cargados.clear()
+        _estadisticas_modelos.update(aciertos=0, fallos=0)
+
+
+def describir_carga_modelo(info: dict) -> str:
+    """Texto corto para las etiquetas de estado de la interfaz."""
+    origen = "caché" if info["desde_cache"] else "disco"
+    return f"{origen}, {info['tiempo_s']:.2f} s · aciertos de caché: {info['aciertos']}/{info['aciertos'] + info['fallos']}"
+
+
+def redondear_fechas_a_15(fechas: pd.Series) -> pd.Series:
+    """
+    Redondea cada fecha "DD/MM/YYYY HH:MM" hacia arriba al siguiente :15.
+
+    Versión vectorizada de app._redondear_hora_a_15: "08:27" -> "08:30",
+    "23:50" -> "00:00" del día siguiente; lo que no se puede interpretar
+    se deja tal cual. La usan la predicción por lotes y la clave de la caché
+    de predicciones del Modo Usuario.
+    """
+    fechas = fechas.astype(str)
+    dt = pd.to_datetime(fechas, format=FORMATO_FECHA, errors="coerce")
+    redondeadas = dt.dt.ceil("15min").dt.strftime(FORMATO_FECHA)
+    return redondeadas.where(dt.notna(), fechas)
 
 
 def preparar_datos_prediccion(df_pred: pd.DataFrame, resultados_entrenamiento: dict) -> pd.DataFrame:
@@ -217,25 +1910,19 @@ def preparar_datos_prediccion(df_pred: pd.DataFrame, resultados_entrenamiento: d
     features_numericas = resultados_entrenamiento.get("features_numericas", [])
     features_categoricas = resultados_entrenamiento.get("features_categoricas", [])
     median_values = resultados_entrenamiento.get("median_values", {})
-    zona_stats = resultados_entrenamiento.get("zona_stats")
-    hora_stats = resultados_entrenamiento.get("hora_stats")
-    zona_defaults = resultados_entrenamiento.get("zona_defaults", {})
-    hora_defaults = resultados_entrenamiento.get("hora_defaults", {})
+    zona_lookup, hora_lookup = obtener_lookups(resultados_entrenamiento)
 
     df_feat = _agregar_features_temporales(df_pred)
+    if "cuarto_hora" in features_numericas:
+        df_feat["cuarto_hora"] = cuarto_hora(df_feat["fecha"])
 
     # Adjuntar estadísticos aprendidos (no podemos recalcularlos sin la intensidad real)
-    if zona_stats is not None:
-        df_feat = df_feat.merge(zona_stats, on='id', how='left')
-        for col, default_val in zona_defaults.items():
-            if col in df_feat.columns:
-                df_feat[col] = df_feat[col].fillna(default_val)
-
-    if hora_stats is not None:
-        df_feat = df_feat.merge(hora_stats, on='hora', how='left')
-        for col, default_val in hora_defaults.items():
-            if col in df_feat.columns:
-                df_feat[col] = df_feat[col].fillna(default_val)
+    estadisticas = {}
+    if zona_lookup is not None:
+        estadisticas.update(zona_lookup.columnas_de(df_feat["id"].to_numpy()))
+    if hora_lookup is not None:
+        estadisticas.update(hora_lookup.columnas_de(df_feat["hora"].to_numpy()))
+    df_feat = df_feat.assign(**estadisticas)
 
     # Asegurar columnas esperadas
     for col in features_numericas:
@@ -252,4 +1939,128 @@ def preparar_datos_prediccion(df_pred: pd.DataFrame, resultados_entrenamiento: d
     for col in features_categoricas:
         X_pred[col] = X_pred[col].fillna("unknown")
 
-    return X_pred
\ No newline at end of file
+    # Mismos dtypes compactos que la matriz de entrenamiento (los paquetes
+    # anteriores no lo registran y se predicen en float64 como antes)
+    preprocesado = resultados_entrenamiento.get("preprocesado")
+    if preprocesado:
+        X_pred = compactar_features(X_pred, preprocesado["dtypes"])
+
+    return X_pred
+
+# ==================== NIVELES DE TRÁFICO ====================
+
+NIVELES_TRAFICO = ("Bajo", "Medio", "Alto")
+UMBRAL_Z_NIVEL = 0.5
+
+
+def clasificar_puntuaciones_z(z) -> np.ndarray:
+    """Bajo (z <= -0.5), Alto (z >= 0.5) o Medio para cada puntuación z."""
+    z = np.asarray(z, dtype=float)
+    return np.where(z <= -UMBRAL_Z_NIVEL, "Bajo", np.where(z >= UMBRAL_Z_NIVEL, "Alto", "Medio"))
+
+
+def niveles_trafico(pred, paquete, ids=None) -> dict:
+    """
+    Nivel de tráfico de cada predicción a partir de las estadísticas por zona del modelo.
+
+    La media y la desviación de cada zona se toman de zona_lookup con un
+    gather (las zonas no vistas reciben los valores por defecto); sin ids o
+    sin estadísticas se usan zona_defaults o, en su defecto, la mediana y la
+    desviación de las propias predicciones. Devuelve los niveles, las
+    puntuaciones z y el número de predicciones de cada nivel.
+    """
+    pred = np.asarray(pred, dtype=float)
+    zona_defaults = paquete.get("zona_defaults") or {}
+    media = zona_defaults.get("zona_intensidad_media", float(np.median(pred)) if len(pred) else 0.0)
+    std_defecto = zona_defaults.get("zona_intensidad_std", float(pd.Series(pred).std()))
+    # Con una sola predicción (o todas iguales) la desviación es NaN o 0: escala 1
+    std_defecto = std_defecto if np.isfinite(std_defecto) and std_defecto > 0 else 1.0
+    std = std_defecto
+
+    zona_lookup, _ = obtener_lookups(paquete)
+    if ids is not None and zona_lookup is not None:
+        estad = zona_lookup.columnas_de(np.asarray(ids))
+        media = estad.get("zona_intensidad_media", media)
+        std = estad.get("zona_intensidad_std", std)
+
+    std = np.asarray(std, dtype=float)
+    z = (pred - np.asarray(media, dtype=float)) / np.where(std > 0, std, std_defecto)
+    niveles = clasificar_puntuaciones_z(z)
+    return {
+        "niveles": niveles,
+        "z": z,
+        "conteos": {nivel: int(np.count_nonzero(niveles == nivel)) for nivel in NIVELES_TRAFICO},
+    }
+
+
+# ==================== CUBO DE PREVISIÓN ====================
+
+FILAS_POR_LOTE_CUBO = 200_000
+
+
+def cubo_prediccion(paquete, ids, inicio, horas: int = 24, meteo=None, paso_minutos: int = 15,
+                    filas_por_lote: int = FILAS_POR_LOTE_CUBO) -> dict:
+    """
+    Previsión de intensidad para todas las zonas × instantes de un horizonte.
+
+    Las features que solo dependen de la zona (id y estadísticas por zona) se
+    calculan una vez por zona y las que solo dependen del instante
+    (calendario, estadísticas por hora y meteorología) una vez por instante;
+    la matriz zona × instante se forma repitiendo ambas partes, por lotes de
+    ~filas_por_lote filas, y se predice lote a lote. El resultado es el mismo
+    que llamar a preparar_datos_prediccion con todas las combinaciones.
+
+    meteo puede ser un dict (misma meteorología en todo el horizonte), una
+    lista con un dict por instante o None (medianas de entrenamiento).
+
+    Devuelve {"ids", "fechas", "intensidad"} con intensidad float32 de forma
+    (n_zonas, n_instantes).
+    """
+    ids = np.asarray(ids)
+    fechas = pd.date_range(pd.Timestamp(inicio), periods=horas * 60 // paso_minutos, freq=f"{paso_minutos}min")
+    if meteo is None or isinstance(meteo, dict):
+        meteo = [meteo or {}] * len(fechas)
+    if len(meteo) != len(fechas):
+        raise ValueError(f"Se esperaban {len(fechas)} registros meteorológicos y hay {len(meteo)}")
+
+    features_numericas = list(paquete.get("features_numericas", []))
+    features_categoricas = list(paquete.get("features_categoricas", []))
+    median_values = paquete.get("median_values", {})
+    zona_lookup, _ = obtener_lookups(paquete)
+    columnas_zona = ["id"] + (zona_lookup.columnas if zona_lookup is not None else [])
+    columnas_zona = [c for c in features_numericas if c in columnas_zona]
+
+    # Parte por instante: preparar_datos_prediccion con una zona cualquiera
+    df_instantes = pd.DataFrame(list(meteo), index=range(len(fechas))).assign(
+        id=ids[0] if len(ids) else 0, fecha=fechas.strftime(FORMATO_FECHA)
+    )
+    if "conditionsDay" not in df_instantes.columns:
+        df_instantes["conditionsDay"] = None
+    parte_instante = preparar_datos_prediccion(df_instantes, paquete)
+
+    # Parte por zona: id y estadísticas de zona con la misma imputación y dtypes
+    parte_zona = pd.DataFrame({"id": ids})
+    if zona_lookup is not None:
+        parte_zona = parte_zona.assign(**zona_lookup.columnas_de(ids))
+    parte_zona = parte_zona[columnas_zona].fillna({c: median_values.get(c, 0) for c in columnas_zona})
+    preprocesado = paquete.get("preprocesado")
+    if preprocesado:
+        parte_zona = compactar_features(parte_zona, preprocesado["dtypes"])
+
+    modelo = paquete["modelo"]
+    intensidad = np.empty((len(ids), len(fechas)), dtype=np.float32)
+    instantes_por_lote = max(1, filas_por_lote // max(len(ids), 1))
+    for desde in range(0, len(fechas), instantes_por_lote):
+        hasta = min(desde + instantes_por_lote, len(fechas))
+        n_instantes = hasta - desde
+        # Filas ordenadas por instante y, dentro de cada instante, por zona
+        columnas = {}
+        for col in features_numericas + features_categoricas:
+            if col in columnas_zona:
+                columnas[col] = np.tile(parte_zona[col].to_numpy(), n_instantes)
+            else:
+                columnas[col] = np.repeat(parte_instante[col].to_numpy()[desde:hasta], len(ids))
+        pred = modelo.predict(pd.DataFrame(columnas))
+        intensidad[:, desde:hasta] = pred.reshape(n_instantes, len(ids)).T
+
+    return {"ids": ids, "fechas": fechas, "intensidad": intensidad}
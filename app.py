@@ -2,12 +2,18 @@ import os
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 import sv_ttk
-from algorithms import entrenar_modelo, preparar_datos_prediccion
+from algorithms import (
+    entrenar_modelo, entrenar_modelos, backtest_modelo, preparar_datos_prediccion, crear_paquete_modelo,
+    compactar_random_forest, resultados_compactados, niveles_trafico, NIVELES_TRAFICO,
+    cargar_paquete_modelo, describir_carga_modelo, ALGORITMOS, ALGORITMOS_COMPARABLES, TAM_BLOQUE_DEFECTO
+)
+from formato_modelo import guardar_paquete_modelo
+from inferencia import exportar_modelo_compilado
 from user_mode import UserModeTab
 import time
+from collections.abc import Mapping
 from datetime import datetime
 import pandas as pd
-import joblib
 import threading
 from threading import Thread
 try:
@@ -315,24 +321,48 @@ class SafeDriveApp(tk.Tk):
 
         self.combo_algoritmo = ttk.Combobox(
             tab, state="readonly",
-            values=[
-                "Random Forest Mejorado",
-                "Gradient Boosting",
-                "Deep Learning Mejorado",
-                "Árbol de decisión optimizado"
-            ]
+            values=ALGORITMOS
         )
         self.combo_algoritmo.current(0)
         self.combo_algoritmo.grid(row=1, column=1, sticky="w", pady=(15, 5))
 
         self.combo_algoritmo.bind("<<ComboboxSelected>>", self._on_combo_select)
 
-        # Botón Ejecutar
+        # Lectura del CSV por bloques para datasets que no caben en memoria
+        self.var_por_bloques = tk.BooleanVar(value=False)
+        chk_bloques = ttk.Checkbutton(
+            tab, text="Lectura por bloques",
+            variable=self.var_por_bloques
+        )
+        chk_bloques.grid(row=1, column=1, sticky="e", padx=(10, 0), pady=(15, 5))
+
+        # Botones Comparar todos / Ejecutar
+        frame_botones = ttk.Frame(tab)
+        frame_botones.grid(row=1, column=2, padx=(10, 15), pady=(15, 5), sticky="e")
+
+        btn_comparar = ttk.Button(
+            frame_botones, text="Comparar todos",
+            command=self._ejecutar_comparativa
+        )
+        btn_comparar.pack(side="left", padx=(0, 5))
+
+        btn_backtest = ttk.Button(
+            frame_botones, text="Backtest semanal",
+            command=self._ejecutar_backtest
+        )
+        btn_backtest.pack(side="left", padx=(0, 5))
+
+        btn_compactar = ttk.Button(
+            frame_botones, text="Compactar RF",
+            command=self._ejecutar_compactacion
+        )
+        btn_compactar.pack(side="left", padx=(0, 5))
+
         btn_ejecutar = ttk.Button(
-            tab, text="Ejecutar", style="Accent.TButton",
+            frame_botones, text="Ejecutar", style="Accent.TButton",
             command=self._ejecutar_train
         )
-        btn_ejecutar.grid(row=1, column=2, padx=(10, 15), pady=(15, 5), sticky="e")
+        btn_ejecutar.pack(side="left")
 
         # Vista previa de resultados
         preview_card = ttk.Labelframe(
@@ -433,6 +463,10 @@ class SafeDriveApp(tk.Tk):
         )
         btn_predecir.grid(row=2, column=2, padx=(10, 15), pady=(10, 5), sticky="e")
 
+        # Estado del modelo aplicado (caché de modelos y tiempo de carga)
+        self.lbl_modelo_pred_estado = ttk.Label(tab, text="")
+        self.lbl_modelo_pred_estado.grid(row=2, column=1, sticky="w", pady=(10, 5))
+
         # Tabla y resumen
         center_frame = ttk.Frame(tab)
         center_frame.grid(row=3, column=0, columnspan=3,
@@ -557,6 +591,7 @@ class SafeDriveApp(tk.Tk):
     def _ejecutar_train(self):
         file_a = getattr(self, "selected_file_train", None)
         algoritmo = self.combo_algoritmo.get()
+        tam_bloque = TAM_BLOQUE_DEFECTO if self.var_por_bloques.get() else None
 
         if not file_a:
             messagebox.showwarning("Atención", "Selecciona un archivo antes de ejecutar.")
@@ -566,15 +601,18 @@ class SafeDriveApp(tk.Tk):
         loading_dialog = LoadingDialog(self, title="Entrenamiento", message="Entrenando modelo...\nEsto puede tardar varios minutos")
         
         # Iniciar entrenamiento en un hilo separado
-        thread = Thread(target=self._train_worker, args=(file_a, algoritmo, loading_dialog), daemon=True)
+        thread = Thread(target=self._train_worker, args=(file_a, algoritmo, loading_dialog, tam_bloque), daemon=True)
         thread.start()
 
-    def _train_worker(self, file_a, algoritmo, loading_dialog):
+    def _train_worker(self, file_a, algoritmo, loading_dialog, tam_bloque=None):
         """Función que se ejecuta en un hilo separado para entrenar el modelo."""
         try:
             # Medir tiempo de ejecución
             start_time = time.time()
-            resultados, df = entrenar_modelo(file_a, algoritmo)
+            # Con lectura por bloques se mide también la memoria pico de la lectura
+            resultados, df = entrenar_modelo(
+                file_a, algoritmo, tam_bloque=tam_bloque, medir_memoria=tam_bloque is not None
+            )
             end_time = time.time()
             tiempo_segundos = end_time - start_time
 
@@ -604,7 +642,13 @@ class SafeDriveApp(tk.Tk):
         # Actualizar labels
         self.lbl_fecha.config(text=f"Fecha: {fecha_actual}")
         self.lbl_ejemplares.config(text=f"Ejemplares: {num_ejemplares}")
-        self.lbl_tiempo.config(text=f"Tiempo de entrenamiento: {tiempo_segundos:.2f} s")
+        texto_tiempo = f"Tiempo de entrenamiento: {tiempo_segundos:.2f} s"
+        if resultados.get("memoria_pico_mb") is not None:
+            texto_tiempo += f" (memoria pico lectura: {resultados['memoria_pico_mb']:.0f} MB)"
+        if resultados.get("busqueda"):
+            busqueda = resultados["busqueda"]
+            texto_tiempo += f" (búsqueda {busqueda['modo']}: {busqueda['n_ajustes']} ajustes en {busqueda['tiempo_s']:.1f} s)"
+        self.lbl_tiempo.config(text=texto_tiempo)
         self.lbl_alg_seleccionado.config(text=f"Algoritmo seleccionado: {algoritmo}")
 
         # Actualizar resultados
@@ -620,6 +664,214 @@ class SafeDriveApp(tk.Tk):
 
         messagebox.showinfo("Entrenamiento", "Modelo entrenado correctamente")
 
+    def _ejecutar_comparativa(self):
+        file_a = getattr(self, "selected_file_train", None)
+
+        if not file_a:
+            messagebox.showwarning("Atención", "Selecciona un archivo antes de ejecutar.")
+            return
+
+        loading_dialog = LoadingDialog(
+            self, title="Comparativa",
+            message="Entrenando todos los algoritmos en paralelo...\nEsto puede tardar varios minutos"
+        )
+        thread = Thread(target=self._comparativa_worker, args=(file_a, loading_dialog), daemon=True)
+        thread.start()
+
+    def _comparativa_worker(self, file_a, loading_dialog):
+        """Entrena todos los algoritmos comparables en paralelo y se queda con el de menor RMSE."""
+        try:
+            start_time = time.time()
+            resultados_por_alg, tabla = entrenar_modelos(file_a)
+            tiempo_segundos = time.time() - start_time
+
+            validos = tabla.dropna(subset=["RMSE"])
+            if validos.empty:
+                raise RuntimeError("Ningún algoritmo se ha entrenado correctamente:\n" + "\n".join(
+                    f"{fila.Modelo}: {fila.Error}" for fila in tabla.itertuples()
+                ))
+            mejor = validos.iloc[0]["Modelo"]
+            resultados = resultados_por_alg[mejor]
+
+            self.trained_model = resultados.get("modelo")
+            self.trained_results = resultados
+            self.trained_df = None
+            self.last_predictions = None
+
+            num_ejemplares = len(resultados["X_train"]) + len(resultados["X_test"])
+            self.after(0, lambda: self._update_comparativa(tiempo_segundos, resultados, tabla, mejor, num_ejemplares))
+
+        except Exception as e:
+            self.after(0, lambda: messagebox.showerror("Error", str(e)))
+        finally:
+            self.after(100, lambda: loading_dialog.close())
+
+    def _update_comparativa(self, tiempo_segundos, resultados, tabla, mejor, num_ejemplares):
+        """Muestra el mejor modelo en la vista previa y la tabla comparativa en una ventana aparte."""
+        self.lbl_fecha.config(text=f"Fecha: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}")
+        self.lbl_ejemplares.config(text=f"Ejemplares: {num_ejemplares}")
+        self.lbl_tiempo.config(text=f"Tiempo de entrenamiento: {tiempo_segundos:.2f} s (todos los algoritmos)")
+        self.lbl_alg_seleccionado.config(text=f"Algoritmo seleccionado: {mejor} (mejor RMSE)")
+        self.lbl_resultado.config(
+            text=(
+                f"RMSE: {resultados['rmse']:.2f}\n"
+                f"R²: {resultados['r2']:.2f}\n"
+                f"MAE: {resultados['mae']:.2f}\n"
+                f"MAPE: {resultados['mape']*100:.2f}%\n"
+                f"Modelo entrenado correctamente."
+            )
+        )
+
+        filas = []
+        for fila in tabla.itertuples(index=False):
+            if pd.isna(fila.RMSE):
+                filas.append((fila.Modelo, "error", "", "", "", ""))
+                continue
+            filas.append((
+                fila.Modelo, f"{fila.RMSE:.2f}", f"{fila.MAE:.2f}", f"{fila.R2:.3f}",
+                f"{fila.MAPE * 100:.2f}%", f"{fila[5]:.2f}"
+            ))
+        self._mostrar_tabla("Comparativa de modelos", ["Modelo", "RMSE", "MAE", "R2", "MAPE", "Tiempo (s)"], filas)
+
+    def _mostrar_tabla(self, titulo, columnas, filas, texto_pie=None):
+        """Muestra una tabla de resultados en una ventana aparte."""
+        ventana = tk.Toplevel(self)
+        ventana.title(titulo)
+        ventana.transient(self)
+
+        tree = ttk.Treeview(ventana, columns=columnas, show="headings", height=len(filas))
+        for col in columnas:
+            ancho = 260 if col == "Modelo" else 90
+            tree.heading(col, text=col)
+            tree.column(col, width=ancho, anchor="w" if col == columnas[0] else "e")
+        for fila in filas:
+            tree.insert("", "end", values=fila)
+        tree.pack(fill="both", expand=True, padx=15, pady=15)
+
+        if texto_pie:
+            ttk.Label(ventana, text=texto_pie, justify="left").pack(padx=15, pady=(0, 10), anchor="w")
+        ttk.Button(ventana, text="Cerrar", command=ventana.destroy).pack(pady=(0, 15))
+
+    def _ejecutar_backtest(self):
+        file_a = getattr(self, "selected_file_train", None)
+        algoritmo = self.combo_algoritmo.get()
+
+        if not file_a:
+            messagebox.showwarning("Atención", "Selecciona un archivo antes de ejecutar.")
+            return
+        if algoritmo not in ALGORITMOS_COMPARABLES:
+            messagebox.showwarning("Atención", f"El backtest no está disponible para {algoritmo}.")
+            return
+
+        loading_dialog = LoadingDialog(
+            self, title="Backtest",
+            message="Evaluando por semanas (origen móvil)...\nEsto puede tardar varios minutos"
+        )
+        thread = Thread(target=self._backtest_worker, args=(file_a, algoritmo, loading_dialog), daemon=True)
+        thread.start()
+
+    def _backtest_worker(self, file_a, algoritmo, loading_dialog):
+        """Ejecuta el backtest semanal en un hilo separado."""
+        try:
+            start_time = time.time()
+            tabla = backtest_modelo(file_a, algoritmo)
+            tiempo_segundos = time.time() - start_time
+            self.after(0, lambda: self._update_backtest(tabla, algoritmo, tiempo_segundos))
+        except Exception as e:
+            self.after(0, lambda: messagebox.showerror("Error", str(e)))
+        finally:
+            self.after(100, lambda: loading_dialog.close())
+
+    def _update_backtest(self, tabla, algoritmo, tiempo_segundos):
+        """Muestra las métricas por pliegue del backtest."""
+        filas = [
+            (fila.Pliegue, fila[1], fila[2], fila[3], f"{fila.RMSE:.2f}", f"{fila.MAE:.2f}",
+             f"{fila.R2:.3f}", f"{fila.MAPE * 100:.2f}%", f"{fila[8]:.2f}")
+            if fila[3] and fila[2] else
+            (fila.Pliegue, fila[1], fila[2], fila[3], "sin datos", "-", "-", "-", "-")
+            for fila in tabla.itertuples(index=False)
+        ]
+        pie = (
+            f"{algoritmo}\n"
+            f"RMSE medio: {tabla['RMSE'].mean():.2f}   MAE medio: {tabla['MAE'].mean():.2f}\n"
+            f"Tiempo total: {tiempo_segundos:.2f} s"
+        )
+        self._mostrar_tabla("Backtest semanal", list(tabla.columns), filas, pie)
+
+    def _ejecutar_compactacion(self):
+        resultados = getattr(self, "trained_results", None)
+        if resultados is None or resultados.get("X_test") is None:
+            messagebox.showwarning("Atención", "Primero entrena un modelo Random Forest.")
+            return
+        if resultados.get("algoritmo") != "Random Forest Mejorado" or resultados.get("compactacion"):
+            messagebox.showwarning("Atención", "La compactación solo está disponible para un Random Forest sin compactar.")
+            return
+
+        loading_dialog = LoadingDialog(
+            self, title="Compactación",
+            message="Seleccionando árboles y destilando el bosque...\nEsto puede tardar unos minutos"
+        )
+        thread = Thread(target=self._compactacion_worker, args=(resultados, loading_dialog), daemon=True)
+        thread.start()
+
+    def _compactacion_worker(self, resultados, loading_dialog):
+        """Calcula las variantes compactas del Random Forest en un hilo separado."""
+        try:
+            variantes, tabla = compactar_random_forest(resultados)
+            self.after(0, lambda: self._mostrar_compactacion(resultados, variantes, tabla))
+        except Exception as e:
+            self.after(0, lambda: messagebox.showerror("Error", str(e)))
+        finally:
+            self.after(100, lambda: loading_dialog.close())
+
+    def _mostrar_compactacion(self, resultados, variantes, tabla):
+        """Tabla precisión/latencia/tamaño de cada variante; la elegida pasa a ser el modelo a guardar."""
+        ventana = tk.Toplevel(self)
+        ventana.title("Compactación de Random Forest")
+        ventana.transient(self)
+
+        columnas = list(tabla.columns)
+        tree = ttk.Treeview(ventana, columns=columnas, show="headings", height=len(tabla), selectmode="browse")
+        for col in columnas:
+            tree.heading(col, text=col)
+            tree.column(col, width=220 if col == "Variante" else 90, anchor="w" if col == "Variante" else "e")
+        for fila in tabla.itertuples(index=False):
+            tree.insert("", "end", iid=fila.Variante, values=(
+                fila.Variante, fila[1], f"{fila.Nodos:,}", f"{fila.RMSE:.2f}", f"{fila.MAE:.2f}",
+                f"{fila.R2:.3f}", f"{fila.MAPE * 100:.2f}%", f"{fila[7]:.1f}", f"{fila[8]:.1f}"
+            ))
+        tree.selection_set("Original")
+        tree.pack(fill="both", expand=True, padx=15, pady=15)
+        ttk.Label(
+            ventana, justify="left",
+            text="Métricas sobre el conjunto de test. Latencia: predicción de 1.000 filas."
+        ).pack(padx=15, pady=(0, 10), anchor="w")
+
+        def usar_variante():
+            seleccion = tree.selection()
+            if not seleccion:
+                return
+            variante = seleccion[0]
+            if variante != "Original":
+                self.trained_results = resultados_compactados(resultados, variantes, tabla, variante)
+                self.trained_model = self.trained_results["modelo"]
+                r = self.trained_results
+                self.lbl_resultado.config(
+                    text=(
+                        f"RMSE: {r['rmse']:.2f}\n"
+                        f"R²: {r['r2']:.2f}\n"
+                        f"MAE: {r['mae']:.2f}\n"
+                        f"MAPE: {r['mape']*100:.2f}%\n"
+                        f"Modelo compactado: {variante}"
+                    )
+                )
+            ventana.destroy()
+
+        frame = ttk.Frame(ventana)
+        frame.pack(pady=(0, 15))
+        ttk.Button(frame, text="Usar variante", style="Accent.TButton", command=usar_variante).pack(side="left", padx=5)
+        ttk.Button(frame, text="Cerrar", command=ventana.destroy).pack(side="left", padx=5)
+
     def _redondear_hora_a_15(self, fecha_str):
         """
         Redondea una hora al :15 más cercano.
@@ -684,8 +936,10 @@ class SafeDriveApp(tk.Tk):
             # Intentar cargar modelo si se proporciona ruta
             if file_model and file_model.strip():
                 try:
-                    model_package = joblib.load(file_model)
-                    if isinstance(model_package, dict) and "modelo" in model_package:
+                    model_package, info_carga = cargar_paquete_modelo(file_model)
+                    estado = f"Modelo: {os.path.basename(file_model)} ({describir_carga_modelo(info_carga)})"
+                    self.after(0, lambda: self.lbl_modelo_pred_estado.config(text=estado))
+                    if isinstance(model_package, Mapping) and "modelo" in model_package:
                         modelo_cargado = model_package["modelo"]
                         resultados_entrenamiento = model_package
                     else:
@@ -744,32 +998,12 @@ class SafeDriveApp(tk.Tk):
         df_out = df_pred.copy()
         df_out["prediccion_intensidad"] = pred
 
-        # Interpretación del nivel de tráfico por id usando estadísticas
-        bajos = medios = altos = 0
-        niveles = []
-        zona_defaults = resultados_entrenamiento.get("zona_defaults", {})
-        default_mean = zona_defaults.get("zona_intensidad_media", float(pd.Series(pred).median()))
-        default_std = zona_defaults.get("zona_intensidad_std", float(pd.Series(pred).std()) or 1.0)
-
-        for i, p in enumerate(pred):
-            try:
-                mean_i = df_pred_ready.iloc[i]["zona_intensidad_media"] if "zona_intensidad_media" in df_pred_ready.columns else default_mean
-                std_i = df_pred_ready.iloc[i]["zona_intensidad_std"] if "zona_intensidad_std" in df_pred_ready.columns else default_std
-                std_i = std_i if std_i and std_i > 0 else default_std
-            except Exception:
-                mean_i, std_i = default_mean, default_std
-
-            z = (p - mean_i) / std_i
-            if z <= -0.5:
-                nivel = "Bajo"
-                bajos += 1
-            elif z >= 0.5:
-                nivel = "Alto"
-                altos += 1
-            else:
-                nivel = "Medio"
-                medios += 1
-            niveles.append(nivel)
+        # Interpretación del nivel de tráfico por id usando las estadísticas por zona del modelo
+        clasificacion = niveles_trafico(
+            pred, resultados_entrenamiento, df_pred["id"] if "id" in df_pred.columns else None
+        )
+        niveles = clasificacion["niveles"]
+        bajos, medios, altos = (clasificacion["conteos"][nivel] for nivel in NIVELES_TRAFICO)
 
         df_out["nivel_trafico"] = niveles
         
@@ -856,10 +1090,9 @@ class SafeDriveApp(tk.Tk):
             self.tree.delete(item)
 
         # Mostrar id como ejemplar si existe, si no usar índice
-        use_id = "id" in df_pred.columns
-        for idx, valor in enumerate(pred):
-            ejemplar = df_pred.iloc[idx]["id"] if use_id else f"Muestra {idx+1}"
-            self.tree.insert("", "end", values=(str(ejemplar), f"{valor:.1f}", niveles[idx]))
+        ejemplares = df_pred["id"].tolist() if "id" in df_pred.columns else [f"Muestra {i + 1}" for i in range(len(pred))]
+        for ejemplar, valor, nivel in zip(ejemplares, pred, niveles):
+            self.tree.insert("", "end", values=(str(ejemplar), f"{valor:.1f}", nivel))
 
         total = len(pred)
         media = float(pd.Series(pred).mean()) if total > 0 else 0
@@ -943,17 +1176,10 @@ class SafeDriveApp(tk.Tk):
         if filename:
             try:
                 # Guardar modelo + metadatos juntos
-                model_package = {
-                    "modelo": self.trained_model,
-                    "features_numericas": self.trained_results.get("features_numericas", []),
-                    "features_categoricas": self.trained_results.get("features_categoricas", []),
-                    "median_values": self.trained_results.get("median_values", {}),
-                    "zona_stats": self.trained_results.get("zona_stats"),
-                    "hora_stats": self.trained_results.get("hora_stats"),
-                    "zona_defaults": self.trained_results.get("zona_defaults", {}),
-                    "hora_defaults": self.trained_results.get("hora_defaults", {}),
-                }
-                joblib.dump(model_package, filename)
+                model_package = crear_paquete_modelo({**self.trained_results, "modelo": self.trained_model})
+                guardar_paquete_modelo(model_package, filename)
+                # Modelo compilado para predicciones interactivas (si el estimador lo admite)
+                exportar_modelo_compilado(model_package, filename)
             except Exception as e:
                 messagebox.showerror("Error", f"No se pudo guardar el modelo: {e}")
                 return
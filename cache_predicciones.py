@@ -0,0 +1,151 @@
+"""
+Caché de resultados de predicción.
+
+Guarda la intensidad predicha por (modelo, zona, instante, meteorología) para
+que repetir una predicción (mismas zonas y hora) solo pase por el modelo las
+zonas que faltan. Tiene un nivel en memoria (LRU acotado) y, opcionalmente,
+un nivel en disco (SQLite, también acotado) que sobrevive entre sesiones.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+
+MAX_ENTRADAS_MEMORIA = 200_000
+MAX_ENTRADAS_DISCO = 2_000_000
+
+
+def firma_meteo(meteo: dict) -> str:
+    """Hash corto y estable del diccionario meteorológico mapeado."""
+    texto = json.dumps(meteo or {}, sort_keys=True, default=str)
+    return hashlib.sha1(texto.encode("utf-8")).hexdigest()[:16]
+
+
+class CachePredicciones:
+    """
+    LRU de predicciones en memoria con un segundo nivel opcional en disco.
+
+    Las claves son (huella del modelo, id de zona, fecha redondeada, firma de
+    la meteorología). Al llenarse, se expulsan las entradas usadas hace más
+    tiempo; estadisticas() lleva la cuenta de aciertos, fallos y expulsiones.
+    """
+
+    def __init__(self, max_entradas: int = MAX_ENTRADAS_MEMORIA, path_disco: str = None,
+                 max_entradas_disco: int = MAX_ENTRADAS_DISCO):
+        self.max_entradas = max_entradas
+        self.max_entradas_disco = max_entradas_disco
+        self._memoria = OrderedDict()
+        self._cerrojo = threading.Lock()
+        self._contadores = {
+            "aciertos_memoria": 0, "aciertos_disco": 0, "fallos": 0,
+            "expulsiones_memoria": 0, "expulsiones_disco": 0,
+        }
+        self._disco = None
+        if path_disco:
+            os.makedirs(os.path.dirname(os.path.abspath(path_disco)), exist_ok=True)
+            self._disco = sqlite3.connect(path_disco, check_same_thread=False)
+            self._disco.execute(
+                "CREATE TABLE IF NOT EXISTS predicciones (clave TEXT PRIMARY KEY, valor REAL, usado REAL)"
+            )
+            self._disco.execute("CREATE INDEX IF NOT EXISTS idx_usado ON predicciones (usado)")
+            self._disco.commit()
+
+    @staticmethod
+    def _clave(huella_modelo, zona, fecha, firma) -> str:
+        return f"{huella_modelo}|{int(zona)}|{fecha}|{firma}"
+
+    def _guardar_memoria(self, clave, valor):
+        self._memoria[clave] = valor
+        self._memoria.move_to_end(clave)
+        while len(self._memoria) > self.max_entradas:
+            self._memoria.popitem(last=False)
+            self._contadores["expulsiones_memoria"] += 1
+
+    def buscar(self, huella_modelo, ids, fecha: str, meteo: dict):
+        """
+        Predicciones ya calculadas para las zonas ids.
+
+        Devuelve (encontradas, faltan): un dict id -> intensidad y la lista de
+        ids que hay que predecir, en el orden recibido.
+        """
+        firma = firma_meteo(meteo)
+        claves = {zona: self._clave(huella_modelo, zona, fecha, firma) for zona in ids}
+        encontradas, pendientes = {}, []
+        with self._cerrojo:
+            for zona, clave in claves.items():
+                if clave in self._memoria:
+                    self._memoria.move_to_end(clave)
+                    encontradas[zona] = self._memoria[clave]
+                    self._contadores["aciertos_memoria"] += 1
+                else:
+                    pendientes.append(zona)
+
+            if self._disco is not None and pendientes:
+                en_disco = {}
+                for inicio in range(0, len(pendientes), 500):
+                    trozo = [claves[z] for z in pendientes[inicio:inicio + 500]]
+                    filas = self._disco.execute(
+                        f"SELECT clave, valor FROM predicciones WHERE clave IN ({','.join('?' * len(trozo))})", trozo
+                    ).fetchall()
+                    en_disco.update(filas)
+                if en_disco:
+                    self._disco.executemany(
+                        "UPDATE predicciones SET usado = ? WHERE clave = ?",
+                        [(time.time(), clave) for clave in en_disco]
+                    )
+                    self._disco.commit()
+                for zona in pendientes:
+                    if claves[zona] in en_disco:
+                        encontradas[zona] = en_disco[claves[zona]]
+                        self._guardar_memoria(claves[zona], en_disco[claves[zona]])
+                        self._contadores["aciertos_disco"] += 1
+
+            faltan = [zona for zona in ids if zona not in encontradas]
+            self._contadores["fallos"] += len(faltan)
+        return encontradas, faltan
+
+    def guardar(self, huella_modelo, ids, fecha: str, meteo: dict, predicciones):
+        """Añade las predicciones de las zonas ids a ambos niveles."""
+        firma = firma_meteo(meteo)
+        filas = [(self._clave(huella_modelo, zona, fecha, firma), float(valor)) for zona, valor in zip(ids, predicciones)]
+        with self._cerrojo:
+            for clave, valor in filas:
+                self._guardar_memoria(clave, valor)
+            if self._disco is not None:
+                ahora = time.time()
+                self._disco.executemany(
+                    "INSERT OR REPLACE INTO predicciones (clave, valor, usado) VALUES (?, ?, ?)",
+                    [(clave, valor, ahora) for clave, valor in filas]
+                )
+                n_disco, = self._disco.execute("SELECT COUNT(*) FROM predicciones").fetchone()
+                sobrantes = n_disco - self.max_entradas_disco
+                if sobrantes > 0:
+                    self._disco.execute(
+                        "DELETE FROM predicciones WHERE clave IN "
+                        "(SELECT clave FROM predicciones ORDER BY usado LIMIT ?)", (sobrantes,)
+                    )
+                    self._contadores["expulsiones_disco"] += sobrantes
+                self._disco.commit()
+
+    def estadisticas(self) -> dict:
+        with self._cerrojo:
+            c = dict(self._contadores)
+            c["entradas_memoria"] = len(self._memoria)
+        consultas = c["aciertos_memoria"] + c["aciertos_disco"] + c["fallos"]
+        c["ratio_aciertos"] = (c["aciertos_memoria"] + c["aciertos_disco"]) / consultas if consultas else 0.0
+        return c
+
+    def describir(self) -> str:
+        """Texto corto para las etiquetas de la interfaz."""
+        e = self.estadisticas()
+        expulsiones = e["expulsiones_memoria"] + e["expulsiones_disco"]
+        return f"Caché: {e['ratio_aciertos']:.0%} aciertos, {expulsiones} expulsiones"
+
+    def cerrar(self):
+        if self._disco is not None:
+            self._disco.close()
+            self._disco = None
@@ -0,0 +1,201 @@
+"""
+Formato de fichero .mdl.
+
+v1: el paquete completo (dict con estimador, estadísticas y metadatos) en un
+único pickle de joblib. Leer cualquier metadato obliga a deserializar todo el
+estimador.
+
+v2: una cabecera pequeña en JSON seguida de secciones que se cargan por
+separado y solo cuando se piden:
+
+    SAFEDRIVE-MDL\\n | longitud de la cabecera (8 bytes, little endian) | cabecera JSON | secciones
+
+La cabecera recoge la versión del formato, las listas de features, el
+algoritmo, las métricas de entrenamiento, la huella del dataset, los
+metadatos de preprocesado y la tabla de secciones (offset y longitud de cada
+una). Cada sección es un pickle de joblib sin comprimir, alineado a
+ALINEACION bytes, así que sus arrays de NumPy se pueden mapear en memoria
+directamente desde el .mdl:
+
+    estadisticas: zona_stats, hora_stats, zona_lookup, hora_lookup, linea_base
+    modelo:       el estimador (Pipeline)
+"""
+
+import os
+import io
+import json
+import struct
+import threading
+from collections.abc import Mapping
+
+import numpy as np
+import joblib
+from joblib.numpy_pickle import NumpyUnpickler
+
+VERSION_FORMATO = 2
+MAGIA = b"SAFEDRIVE-MDL\n"
+ALINEACION = 64
+
+# Claves del paquete guardadas en cada sección
+SECCIONES = {
+    "estadisticas": ["zona_stats", "hora_stats", "zona_lookup", "hora_lookup", "linea_base"],
+    "modelo": ["modelo"],
+}
+
+
+def _a_json(valor):
+    """Convierte escalares y arrays de NumPy a tipos serializables en JSON."""
+    if isinstance(valor, np.generic):
+        return valor.item()
+    if isinstance(valor, np.ndarray):
+        return valor.tolist()
+    raise TypeError(f"No serializable en la cabecera: {type(valor).__name__}")
+
+
+def _alinear(f):
+    """Rellena con ceros hasta el siguiente múltiplo de ALINEACION."""
+    relleno = -f.tell() % ALINEACION
+    f.write(b"\0" * relleno)
+
+
+def guardar_paquete_modelo(paquete: dict, path: str):
+    """
+    Guarda un paquete de modelo en formato v2.
+
+    Las claves de SECCIONES van a su sección; el resto (metadatos pequeños)
+    a la cabecera. Se escribe en un temporal y se renombra para no dejar un
+    .mdl a medias.
+    """
+    en_secciones = {clave for claves in SECCIONES.values() for clave in claves}
+    cabecera = {clave: valor for clave, valor in paquete.items() if clave not in en_secciones}
+    cabecera["version_formato"] = VERSION_FORMATO
+
+    # Secciones serializadas en memoria para conocer sus longitudes
+    cuerpos = {}
+    for nombre, claves in SECCIONES.items():
+        buffer = io.BytesIO()
+        joblib.dump({clave: paquete.get(clave) for clave in claves}, buffer)
+        cuerpos[nombre] = buffer.getvalue()
+
+    # El offset de las secciones depende de la longitud de la cabecera, que
+    # a su vez incluye los offsets: se itera hasta que la longitud no cambia
+    inicio = 0
+    while True:
+        offset = inicio
+        tabla = {}
+        for nombre, cuerpo in cuerpos.items():
+            offset += -offset % ALINEACION
+            tabla[nombre] = {"offset": offset, "longitud": len(cuerpo)}
+            offset += len(cuerpo)
+        texto = json.dumps({**cabecera, "secciones": tabla}, default=_a_json, ensure_ascii=False).encode("utf-8")
+        fin_cabecera = len(MAGIA) + 8 + len(texto)
+        if fin_cabecera <= inicio:
+            break
+        inicio = fin_cabecera + -fin_cabecera % ALINEACION
+
+    temporal = path + ".tmp"
+    with open(temporal, "wb") as f:
+        f.write(MAGIA)
+        f.write(struct.pack("<Q", len(texto)))
+        f.write(texto)
+        for nombre, cuerpo in cuerpos.items():
+            _alinear(f)
+            assert f.tell() == tabla[nombre]["offset"]
+            f.write(cuerpo)
+    os.replace(temporal, path)
+
+
+def version_formato(path: str) -> int:
+    """1 para los .mdl antiguos (pickle de joblib), VERSION_FORMATO para los nuevos."""
+    with open(path, "rb") as f:
+        return VERSION_FORMATO if f.read(len(MAGIA)) == MAGIA else 1
+
+
+def leer_cabecera(path: str):
+    """Metadatos de un .mdl v2 sin cargar ninguna sección (None si es v1)."""
+    with open(path, "rb") as f:
+        if f.read(len(MAGIA)) != MAGIA:
+            return None
+        longitud, = struct.unpack("<Q", f.read(8))
+        return json.loads(f.read(longitud).decode("utf-8"))
+
+
+def _cargar_seccion(path: str, offset: int, mmap: bool):
+    """
+    Deserializa la sección que empieza en offset.
+
+    Con mmap, los arrays se mapean en memoria de solo lectura en lugar de
+    copiarse: el unpickler de joblib calcula el offset de cada array con la
+    posición del descriptor, que aquí es absoluta dentro del .mdl, y la
+    alineación de joblib se conserva porque la sección empieza en un
+    múltiplo de ALINEACION. joblib.load solo admite mmap_mode con un fichero
+    que empieza por el pickle, por eso se usa su unpickler; si su interfaz
+    cambia, la sección se carga sin mmap.
+    """
+    with open(path, "rb") as f:
+        f.seek(offset)
+        if mmap:
+            try:
+                return NumpyUnpickler(path, f, ensure_native_byte_order=False, mmap_mode="r").load()
+            except TypeError:
+                f.seek(offset)
+        return joblib.load(f)
+
+
+class PaqueteModelo(Mapping):
+    """
+    Paquete de un .mdl v2 que se comporta como el dict de v1.
+
+    Los metadatos de la cabecera están disponibles al abrir; las claves de
+    cada sección se cargan del fichero la primera vez que se accede a alguna
+    de ellas (con mmap, sus arrays mapeados en memoria de solo lectura).
+    """
+
+    def __init__(self, path: str, mmap: bool = True):
+        self.path = path
+        self.mmap = mmap
+        self.cabecera = leer_cabecera(path)
+        if self.cabecera is None:
+            raise ValueError(f"{path} no es un modelo en formato v{VERSION_FORMATO}")
+        self._seccion_de = {clave: nombre for nombre, claves in SECCIONES.items() for clave in claves}
+        self._cargadas = {}
+        self._cerrojo = threading.Lock()
+
+    def cargar_seccion(self, nombre: str) -> dict:
+        """Claves de una sección, leídas del fichero solo la primera vez."""
+        with self._cerrojo:
+            if nombre not in self._cargadas:
+                offset = self.cabecera["secciones"][nombre]["offset"]
+                self._cargadas[nombre] = _cargar_seccion(self.path, offset, self.mmap)
+        return self._cargadas[nombre]
+
+    @property
+    def secciones_cargadas(self) -> list:
+        return list(self._cargadas)
+
+    def __getitem__(self, clave):
+        if clave in self._seccion_de:
+            return self.cargar_seccion(self._seccion_de[clave])[clave]
+        if clave == "secciones" or clave not in self.cabecera:
+            raise KeyError(clave)
+        return self.cabecera[clave]
+
+    def __iter__(self):
+        yield from (clave for clave in self.cabecera if clave != "secciones")
+        yield from self._seccion_de
+
+    def __len__(self):
+        return len(self.cabecera) - 1 + len(self._seccion_de)
+
+
+def abrir_paquete_modelo(path: str, mmap: bool = True):
+    """
+    Abre un .mdl de cualquier versión.
+
+    v2 devuelve un PaqueteModelo perezoso; v1 el objeto guardado con joblib.
+    En ambos, con mmap los arrays grandes se mapean en memoria de solo
+    lectura en lugar de copiarse.
+    """
+    if version_formato(path) == VERSION_FORMATO:
+        return PaqueteModelo(path, mmap=mmap)
+    return joblib.load(path, mmap_mode="r" if mmap else None)
@@ -0,0 +1,578 @@
+"""
+Modelo compilado para predicciones interactivas de baja latencia.
+
+Exporta junto al .mdl un fichero .infer.npz con el preprocesado (tablas de
+calendario, estadísticas por zona y hora, escalado y categorías) y el
+estimador en forma de arrays planos de NumPy. Predecir unas pocas zonas no
+necesita pandas ni el Pipeline de sklearn: se construye directamente la
+matriz numérica y se recorren los árboles (o la red) con operaciones
+vectorizadas.
+"""
+
+import os
+import json
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from sklearn.compose import ColumnTransformer
+from sklearn.ensemble import RandomForestRegressor, GradientBoostingRegressor, HistGradientBoostingRegressor
+from sklearn.neural_network import MLPRegressor
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import StandardScaler, OneHotEncoder, OrdinalEncoder, FunctionTransformer
+from sklearn.tree import DecisionTreeRegressor
+
+from algorithms import tabla_calendario, obtener_lookups, TablaLookup, FORMATO_FECHA
+
+VERSION_BUNDLE = 1
+EXTENSION_BUNDLE = ".infer.npz"
+
+# Decidir la rama de un nodo cuesta como mucho esto frente a bajar un nivel de
+# todos los árboles (una veintena de llamadas a NumPy): por debajo de
+# NODOS_POR_NIVEL * profundidad pares (fila, nodo) se deciden todos los nodos
+# de una vez (ver ModeloCompilado._recorrer_arboles)
+NODOS_POR_NIVEL = 5_000
+
+# Columnas de calendario: se tabulan una vez por (mes, día de la semana, hora)
+COLUMNAS_CALENDARIO = [
+    "hora", "mes", "dia_semana", "es_fin_semana", "trimestre",
+    "hora_sin", "hora_cos", "mes_sin", "mes_cos", "dia_sin", "dia_cos",
+    "es_noche", "es_manana", "es_tarde", "es_trafico_punta",
+]
+
+# Origen de cada feature numérica al construir la matriz
+ORIGEN_CALENDARIO, ORIGEN_ID, ORIGEN_ZONA, ORIGEN_HORA, ORIGEN_METEO = range(5)
+
+_ACTIVACIONES = {
+    "identity": lambda z: z,
+    "relu": lambda z: np.maximum(z, 0),
+    "tanh": np.tanh,
+    "logistic": lambda z: 1 / (1 + np.exp(-z)),
+}
+
+
+def ruta_bundle(ruta_modelo: str) -> str:
+    """Ruta del modelo compilado que acompaña a un .mdl."""
+    return os.path.splitext(ruta_modelo)[0] + EXTENSION_BUNDLE
+
+
+def _tabla_calendario_completa() -> np.ndarray:
+    """
+    Features de calendario para cada combinación (mes, día de la semana, hora).
+
+    Se calculan con tabla_calendario sobre todas las horas de un año bisiesto
+    para que los valores sean exactamente los del entrenamiento.
+    """
+    fechas = pd.Series(pd.date_range("2024-01-01", "2024-12-31 23:00", freq="h"))
+    tabla = tabla_calendario(fechas)
+    indice = (tabla["mes"] - 1) * 168 + tabla["dia_semana"] * 24 + tabla["hora"]
+    calendario = np.zeros((12 * 7 * 24, len(COLUMNAS_CALENDARIO)))
+    calendario[indice.to_numpy()] = tabla[COLUMNAS_CALENDARIO].to_numpy(dtype=np.float64)
+    return calendario
+
+
+# ==================== COMPILACIÓN ====================
+
+def _compilar_preprocesado(pre, columnas, categorias):
+    """
+    Describe un ColumnTransformer ajustado como una lista de pasos planos.
+
+    Cada paso es (tipo, índices de columna, parámetros) y los arrays de
+    parámetros se añaden a arrays con un prefijo por paso.
+    """
+    if not isinstance(pre, ColumnTransformer):
+        raise ValueError(f"Preprocesado no soportado: {type(pre).__name__}")
+
+    pasos, arrays = [], {}
+    for i, (_, transformador, cols) in enumerate(pre.transformers_):
+        if transformador == "drop" or len(cols) == 0:
+            continue
+        indices = np.array([columnas.index(c) if isinstance(c, str) else int(c) for c in cols], dtype=np.intp)
+        prefijo = f"pre{i}_"
+        arrays[prefijo + "cols"] = indices
+
+        # Al ajustar, ColumnTransformer guarda "passthrough" como un FunctionTransformer identidad
+        if transformador == "passthrough" or (
+                isinstance(transformador, FunctionTransformer) and transformador.func is None):
+            pasos.append(("passthrough", prefijo))
+        elif isinstance(transformador, StandardScaler):
+            arrays[prefijo + "media"] = np.zeros(len(indices)) if transformador.mean_ is None else transformador.mean_
+            arrays[prefijo + "escala"] = np.ones(len(indices)) if transformador.scale_ is None else transformador.scale_
+            pasos.append(("escalado", prefijo))
+        elif isinstance(transformador, (OneHotEncoder, OrdinalEncoder)):
+            for k, col in enumerate(indices):
+                cats = [str(c) for c in transformador.categories_[k]]
+                if columnas[col] in categorias and categorias[columnas[col]] != cats:
+                    raise ValueError(f"Categorías incompatibles para {columnas[col]}")
+                categorias[columnas[col]] = cats
+            if isinstance(transformador, OneHotEncoder):
+                arrays[prefijo + "n_categorias"] = np.array([len(c) for c in transformador.categories_])
+                drop = transformador.drop_idx_
+                arrays[prefijo + "descartada"] = np.array(
+                    [-1 if drop is None or drop[k] is None else int(drop[k]) for k in range(len(indices))]
+                )
+                arrays[prefijo + "dtype"] = np.array(np.dtype(transformador.dtype).str)
+                pasos.append(("onehot", prefijo))
+            else:
+                desconocida = transformador.unknown_value if transformador.handle_unknown == "use_encoded_value" else np.nan
+                arrays[prefijo + "desconocida"] = np.array(desconocida, dtype=np.float64)
+                arrays[prefijo + "dtype"] = np.array(np.dtype(transformador.dtype).str)
+                pasos.append(("ordinal", prefijo))
+        else:
+            raise ValueError(f"Transformador no soportado: {type(transformador).__name__}")
+    return pasos, arrays
+
+
+def _aplanar_arboles(arboles):
+    """Concatena los nodos de varios árboles de sklearn en arrays planos (hojas apuntando a sí mismas)."""
+    izquierdo, derecho, variable, umbral, valor, falta_izq, raices = [], [], [], [], [], [], []
+    desplazamiento, profundidad = 0, 0
+    for arbol in arboles:
+        t = arbol.tree_
+        n = t.node_count
+        es_hoja = t.children_left == -1
+        propio = np.arange(n)
+        izquierdo.append(np.where(es_hoja, propio, t.children_left) + desplazamiento)
+        derecho.append(np.where(es_hoja, propio, t.children_right) + desplazamiento)
+        variable.append(np.where(es_hoja, 0, t.feature))
+        umbral.append(np.where(es_hoja, np.inf, t.threshold))
+        valor.append(t.value[:, 0, 0])
+        falta_izq.append(np.asarray(getattr(t, "missing_go_to_left", np.zeros(n)), dtype=bool))
+        raices.append(desplazamiento)
+        desplazamiento += n
+        profundidad = max(profundidad, t.max_depth)
+    return {
+        "izquierdo": np.concatenate(izquierdo).astype(np.intp),
+        "derecho": np.concatenate(derecho).astype(np.intp),
+        "variable": np.concatenate(variable).astype(np.intp),
+        "umbral": np.concatenate(umbral).astype(np.float64),
+        "valor": np.concatenate(valor).astype(np.float64),
+        "falta_izquierda": np.concatenate(falta_izq),
+        "raices": np.array(raices, dtype=np.intp),
+        "profundidad": np.array(profundidad),
+    }
+
+
+def _preprocesado_interno_hgb(modelo, n_columnas):
+    """
+    Reordenación y recodificación que aplica HistGradientBoosting internamente.
+
+    Con categorical_features, el estimador vuelve a codificar las columnas
+    categóricas con su propio OrdinalEncoder y las coloca delante de las
+    numéricas. Devuelve el orden de columnas resultante y, para cada columna
+    recodificada, las categorías (valores de entrada) en orden de código.
+    """
+    pre = getattr(modelo, "_preprocessor", None)
+    if pre is None:
+        return {"orden": np.arange(n_columnas, dtype=np.intp)}
+    orden, arrays, k = [], {}, 0
+    for _, transformador, mascara in pre.transformers_:
+        cols = np.flatnonzero(np.asarray(mascara, dtype=bool)) if len(mascara) else np.array([], dtype=np.intp)
+        if transformador == "drop" or len(cols) == 0:
+            continue
+        if isinstance(transformador, OrdinalEncoder):
+            for cats in transformador.categories_:
+                cats = np.asarray(cats, dtype=np.float64)
+                arrays[f"recodificar{k}"] = cats[~np.isnan(cats)]
+                k += 1
+        elif not isinstance(transformador, FunctionTransformer):
+            raise ValueError(f"Preprocesado interno no soportado: {type(transformador).__name__}")
+        orden.extend(cols)
+    return {"orden": np.array(orden, dtype=np.intp), "n_recodificadas": np.array(k), **arrays}
+
+
+def _aplanar_hgb(modelo):
+    """Concatena los predictores de un HistGradientBoostingRegressor en arrays planos."""
+    conocidas, mapa_variables = modelo._bin_mapper.make_known_categories_bitsets()
+
+    izquierdo, derecho, variable, umbral, valor, falta_izq = [], [], [], [], [], []
+    categorica, bitset, raices, bitsets = [], [], [], []
+    desplazamiento, n_bitsets, profundidad = 0, 0, 0
+    for predictores in modelo._predictors:
+        predictor = predictores[0]
+        nodos = predictor.nodes
+        n = len(nodos)
+        es_hoja = nodos["is_leaf"].astype(bool)
+        propio = np.arange(n)
+        izquierdo.append(np.where(es_hoja, propio, nodos["left"].astype(np.intp)) + desplazamiento)
+        derecho.append(np.where(es_hoja, propio, nodos["right"].astype(np.intp)) + desplazamiento)
+        variable.append(np.where(es_hoja, 0, nodos["feature_idx"]))
+        umbral.append(np.where(es_hoja, np.inf, nodos["num_threshold"]))
+        valor.append(nodos["value"])
+        falta_izq.append(nodos["missing_go_to_left"].astype(bool))
+        es_categorica = nodos["is_categorical"].astype(bool) & ~es_hoja
+        categorica.append(es_categorica)
+        # Los nodos no categóricos apuntan al primer bitset para que el índice siempre sea válido
+        bitset.append(np.where(es_categorica, nodos["bitset_idx"].astype(np.intp) + n_bitsets, 0))
+        bitsets.append(predictor.raw_left_cat_bitsets)
+        raices.append(desplazamiento)
+        desplazamiento += n
+        n_bitsets += len(predictor.raw_left_cat_bitsets)
+        profundidad = max(profundidad, int(nodos["depth"].max()))
+
+    bitsets = [b for b in bitsets if len(b)] or [np.zeros((1, 8), dtype=np.uint32)]
+    return {
+        "izquierdo": np.concatenate(izquierdo).astype(np.intp),
+        "derecho": np.concatenate(derecho).astype(np.intp),
+        "variable": np.concatenate(variable).astype(np.intp),
+        "umbral": np.concatenate(umbral).astype(np.float64),
+        "valor": np.concatenate(valor).astype(np.float64),
+        "falta_izquierda": np.concatenate(falta_izq),
+        "categorica": np.concatenate(categorica),
+        "bitset": np.concatenate(bitset),
+        "bitsets_izquierda": np.concatenate(bitsets).astype(np.uint32),
+        "bitsets_conocidas": (conocidas if len(conocidas) else np.zeros((1, 8))).astype(np.uint32),
+        "mapa_variables": mapa_variables.astype(np.intp),
+        "raices": np.array(raices, dtype=np.intp),
+        "profundidad": np.array(profundidad),
+        "base": np.array(float(np.ravel(modelo._baseline_prediction)[0])),
+        **_preprocesado_interno_hgb(modelo, modelo.n_features_in_),
+    }
+
+
+def _compilar_estimador(modelo):
+    """Tipo de estimador y sus parámetros como arrays planos."""
+    if isinstance(modelo, DecisionTreeRegressor):
+        return "arboles", {**_aplanar_arboles([modelo]), "escala": np.array(1.0), "base": np.array(0.0)}
+    if isinstance(modelo, RandomForestRegressor):
+        return "arboles", {
+            **_aplanar_arboles(modelo.estimators_),
+            "escala": np.array(1.0 / len(modelo.estimators_)), "base": np.array(0.0)
+        }
+    if isinstance(modelo, GradientBoostingRegressor):
+        base = modelo.init_.predict(np.zeros((1, modelo.n_features_in_)))
+        return "arboles", {
+            **_aplanar_arboles(modelo.estimators_[:, 0]),
+            "escala": np.array(modelo.learning_rate), "base": np.array(float(np.ravel(base)[0]))
+        }
+    if isinstance(modelo, HistGradientBoostingRegressor):
+        return "hgb", _aplanar_hgb(modelo)
+    if isinstance(modelo, MLPRegressor):
+        if modelo.out_activation_ != "identity" or modelo.activation not in _ACTIVACIONES:
+            raise ValueError(f"Activación no soportada: {modelo.activation}")
+        arrays = {"n_capas": np.array(len(modelo.coefs_))}
+        for i, (pesos, sesgo) in enumerate(zip(modelo.coefs_, modelo.intercepts_)):
+            arrays[f"pesos{i}"] = pesos
+            arrays[f"sesgo{i}"] = sesgo
+        return "mlp", arrays
+    raise ValueError(f"Estimador no soportado: {type(modelo).__name__}")
+
+
+def compilar_modelo(paquete: dict) -> "ModeloCompilado":
+    """Compila un paquete de modelo (el dict que se guarda en el .mdl)."""
+    modelo = paquete["modelo"]
+    modelo = getattr(modelo, "best_estimator_", modelo)
+    if not isinstance(modelo, Pipeline) or set(modelo.named_steps) != {"pre", "model"}:
+        raise ValueError("Solo se pueden compilar Pipelines con pasos 'pre' y 'model'")
+
+    features_numericas = list(paquete["features_numericas"])
+    features_categoricas = list(paquete["features_categoricas"])
+    columnas = features_numericas + features_categoricas
+
+    categorias = {}
+    pasos, arrays = _compilar_preprocesado(modelo.named_steps["pre"], columnas, categorias)
+    tipo, arrays_modelo = _compilar_estimador(modelo.named_steps["model"])
+    arrays.update({"modelo_" + k: v for k, v in arrays_modelo.items()})
+
+    # Plan para construir la matriz: de dónde sale cada feature numérica
+    zona_lookup, hora_lookup = obtener_lookups(paquete)
+    plan = []
+    for col in features_numericas:
+        if col in COLUMNAS_CALENDARIO:
+            plan.append((ORIGEN_CALENDARIO, COLUMNAS_CALENDARIO.index(col)))
+        elif col == "id":
+            plan.append((ORIGEN_ID, 0))
+        elif zona_lookup is not None and col in zona_lookup.columnas:
+            plan.append((ORIGEN_ZONA, zona_lookup.columnas.index(col)))
+        elif hora_lookup is not None and col in hora_lookup.columnas:
+            plan.append((ORIGEN_HORA, hora_lookup.columnas.index(col)))
+        else:
+            plan.append((ORIGEN_METEO, 0))
+    arrays["origen"] = np.array([origen for origen, _ in plan], dtype=np.intp)
+    arrays["indice"] = np.array([indice for _, indice in plan], dtype=np.intp)
+    arrays["calendario"] = _tabla_calendario_completa()
+
+    median_values = paquete.get("median_values") or {}
+    arrays["medianas"] = np.array([median_values.get(c, 0) for c in features_numericas], dtype=np.float64)
+
+    for prefijo, lookup in (("zona_", zona_lookup), ("hora_", hora_lookup)):
+        if lookup is None:
+            continue
+        arrays[prefijo + "claves"] = lookup.claves
+        arrays[prefijo + "valores"] = lookup.valores
+        if lookup.mapa is not None:
+            arrays[prefijo + "mapa"] = lookup.mapa
+    for col, cats in categorias.items():
+        arrays["categorias_" + col] = np.array(cats, dtype=str)
+
+    preprocesado = paquete.get("preprocesado") or {}
+    meta = {
+        "version": VERSION_BUNDLE,
+        "tipo": tipo,
+        "pasos": pasos,
+        "features_numericas": features_numericas,
+        "features_categoricas": features_categoricas,
+        "columnas_zona": zona_lookup.columnas if zona_lookup is not None else [],
+        "columnas_hora": hora_lookup.columnas if hora_lookup is not None else [],
+        "dtypes": preprocesado.get("dtypes"),
+        "activacion": getattr(modelo.named_steps["model"], "activation", None),
+    }
+    arrays["meta"] = np.array(json.dumps(meta))
+    return ModeloCompilado(arrays)
+
+
+def exportar_modelo_compilado(paquete: dict, ruta_modelo: str):
+    """
+    Compila el paquete y lo guarda junto al .mdl.
+
+    Devuelve la ruta del fichero generado, o None si el modelo no se puede
+    compilar (el .mdl sigue siendo válido y se predice con el Pipeline).
+    """
+    try:
+        compilado = compilar_modelo(paquete)
+    except ValueError:
+        return None
+    ruta = ruta_bundle(ruta_modelo)
+    compilado.guardar(ruta)
+    return ruta
+
+
+def cargar_modelo_compilado(ruta_modelo: str):
+    """Carga el modelo compilado que acompaña a un .mdl, o None si no existe o está desfasado."""
+    ruta = ruta_bundle(ruta_modelo)
+    if not os.path.exists(ruta) or os.path.getmtime(ruta) < os.path.getmtime(ruta_modelo):
+        return None
+    compilado = ModeloCompilado.cargar(ruta)
+    return compilado if compilado.meta["version"] == VERSION_BUNDLE else None
+
+
+# ==================== PREDICCIÓN ====================
+
+class ModeloCompilado:
+    """
+    Preprocesado y estimador en arrays planos de NumPy.
+
+    La matriz de entrada de predecir tiene las features numéricas en el orden
+    de entrenamiento seguidas de las categóricas codificadas como índice en
+    self.categorias (-1 para categorías no vistas); matriz() la construye a
+    partir de ids de zona, una fecha y un diccionario meteorológico.
+    """
+
+    def __init__(self, arrays: dict):
+        self.arrays = arrays
+        self.meta = json.loads(str(arrays["meta"]))
+        self.features_numericas = self.meta["features_numericas"]
+        self.features_categoricas = self.meta["features_categoricas"]
+        self.categorias = {
+            col: list(arrays["categorias_" + col]) for col in self.features_categoricas
+            if "categorias_" + col in arrays
+        }
+        self._indice_categoria = {col: {c: i for i, c in enumerate(cats)} for col, cats in self.categorias.items()}
+        self.modelo = {k[len("modelo_"):]: v for k, v in arrays.items() if k.startswith("modelo_")}
+        if "izquierdo" in self.modelo:
+            # Derivados de los árboles que usa _recorrer_arboles en cada predicción
+            self._salto_derecha = self.modelo["derecho"] - self.modelo["izquierdo"]
+            self._nodos_categoricos = np.flatnonzero(self.modelo.get("categorica", np.zeros(0, dtype=bool)))
+
+        self.zona_lookup = self.hora_lookup = None
+        if "zona_claves" in arrays:
+            self.zona_lookup = TablaLookup.desde_arrays(
+                "id", self.meta["columnas_zona"], arrays["zona_claves"], arrays["zona_valores"], arrays.get("zona_mapa")
+            )
+        if "hora_claves" in arrays:
+            self.hora_lookup = TablaLookup.desde_arrays(
+                "hora", self.meta["columnas_hora"], arrays["hora_claves"], arrays["hora_valores"], arrays.get("hora_mapa")
+            )
+
+        # dtype con el que la matriz llega al preprocesado (float32 si el
+        # paquete registra la representación compacta, float64 si no)
+        self._dtype_entrada = np.float32 if self.meta["dtypes"] else np.float64
+
+    def guardar(self, ruta: str):
+        with open(ruta, "wb") as f:
+            np.savez(f, **self.arrays)
+
+    @classmethod
+    def cargar(cls, ruta: str) -> "ModeloCompilado":
+        with np.load(ruta, allow_pickle=False) as datos:
+            return cls({k: datos[k] for k in datos.files})
+
+    def codificar(self, col, valor) -> int:
+        """Índice de una categoría (-1 si no se vio en entrenamiento)."""
+        return self._indice_categoria.get(col, {}).get(str(valor), -1)
+
+    def matriz(self, ids, fecha, meteo: dict) -> np.ndarray:
+        """
+        Matriz de entrada para varias zonas en una misma fecha y con la misma meteorología.
+
+        Replica preparar_datos_prediccion: calendario, estadísticas aprendidas
+        por zona y hora (valores por defecto para zonas no vistas) e
+        imputación por mediana de lo que falte.
+        """
+        if isinstance(fecha, str):
+            fecha = datetime.strptime(fecha, FORMATO_FECHA)
+        ids = np.asarray(ids, dtype=np.float64)
+        n = len(ids)
+        a = self.arrays
+
+        calendario = a["calendario"][(fecha.month - 1) * 168 + fecha.weekday() * 24 + fecha.hour]
+        estad_zona = self.zona_lookup.valores[:, self.zona_lookup.posiciones(ids)] if self.zona_lookup else None
+        estad_hora = self.hora_lookup.valores[:, self.hora_lookup.posiciones([fecha.hour])[0]] if self.hora_lookup else None
+
+        X = np.empty((n, len(self.features_numericas) + len(self.features_categoricas)))
+        for j, (col, origen, indice) in enumerate(zip(self.features_numericas, a["origen"], a["indice"])):
+            if origen == ORIGEN_CALENDARIO:
+                X[:, j] = calendario[indice]
+            elif origen == ORIGEN_ID:
+                X[:, j] = ids
+            elif origen == ORIGEN_ZONA:
+                X[:, j] = estad_zona[indice]
+            elif origen == ORIGEN_HORA:
+                X[:, j] = estad_hora[indice]
+            else:
+                valor = meteo.get(col)
+                X[:, j] = a["medianas"][j] if valor is None or valor != valor else valor
+        for k, col in enumerate(self.features_categoricas):
+            valor = meteo.get(col)
+            X[:, len(self.features_numericas) + k] = self.codificar(col, "unknown" if valor is None else valor)
+
+        # Huecos (p. ej. estadísticas sin valor por defecto) -> mediana
+        huecos = np.isnan(X[:, :len(self.features_numericas)])
+        if huecos.any():
+            X[:, :len(self.features_numericas)] = np.where(huecos, a["medianas"], X[:, :len(self.features_numericas)])
+        return X
+
+    def _preprocesar(self, X: np.ndarray) -> np.ndarray:
+        """Réplica del ColumnTransformer ajustado."""
+        a = self.arrays
+        n_num = len(self.features_numericas)
+        entrada = X[:, :n_num].astype(self._dtype_entrada)
+        partes = []
+        for tipo, prefijo in self.meta["pasos"]:
+            cols = a[prefijo + "cols"]
+            if tipo == "passthrough":
+                partes.append(entrada[:, cols])
+            elif tipo == "escalado":
+                # Mismo redondeo que StandardScaler con una matriz float32
+                z = (entrada[:, cols] - a[prefijo + "media"]).astype(entrada.dtype)
+                partes.append((z / a[prefijo + "escala"]).astype(entrada.dtype))
+            elif tipo == "onehot":
+                codigos = X[:, cols].astype(np.intp)
+                bloques = []
+                for k in range(len(cols)):
+                    bloque = np.zeros((len(X), int(a[prefijo + "n_categorias"][k])), dtype=str(a[prefijo + "dtype"]))
+                    conocida = codigos[:, k] >= 0
+                    bloque[np.flatnonzero(conocida), codigos[conocida, k]] = 1
+                    descartada = int(a[prefijo + "descartada"][k])
+                    if descartada >= 0:
+                        bloque = np.delete(bloque, descartada, axis=1)
+                    bloques.append(bloque)
+                partes.append(np.hstack(bloques))
+            elif tipo == "ordinal":
+                codigos = X[:, cols]
+                partes.append(
+                    np.where(codigos >= 0, codigos, a[prefijo + "desconocida"]).astype(str(a[prefijo + "dtype"]))
+                )
+        return np.hstack(partes)
+
+    def _a_la_izquierda(self, x, nodos, categorias, hay_huecos) -> np.ndarray:
+        """Si el valor x de cada fila baja por la rama izquierda de su nodo (x y nodos se difunden)."""
+        m = self.modelo
+        izquierda = x <= m["umbral"][nodos]
+        if categorias:
+            es_cat = m["categorica"][nodos]
+            if es_cat.any():
+                # NaN >= 0 es falso: los huecos quedan con código 0 y se resuelven abajo
+                codigo = np.where(es_cat & (x >= 0), x, 0).astype(np.uint8)
+                en_izquierda = (m["bitsets_izquierda"][m["bitset"][nodos], codigo // 32] >> (codigo % 32)) & 1
+                fila_conocidas = m["mapa_variables"][m["variable"][nodos]]
+                conocida = (m["bitsets_conocidas"][fila_conocidas, codigo // 32] >> (codigo % 32)) & 1
+                # Categorías negativas o desconocidas se tratan como huecos
+                cat_izquierda = np.where(
+                    (x >= 0) & (conocida == 1), en_izquierda == 1, m["falta_izquierda"][nodos]
+                )
+                izquierda = np.where(es_cat, cat_izquierda, izquierda)
+        if hay_huecos:
+            izquierda = np.where(np.isnan(x), m["falta_izquierda"][nodos], izquierda)
+        return izquierda
+
+    def _recorrer_arboles(self, Z: np.ndarray, categorias=False) -> np.ndarray:
+        """
+        Valor de la hoja alcanzada en cada árbol para cada fila (n_filas, n_arboles).
+
+        Con pocas filas y pocos nodos (una zona con el boosting por
+        histogramas) se decide de una vez la rama de todos los nodos y luego
+        solo se salta de nodo en nodo; si no, se baja nivel a nivel y los
+        pares (fila, árbol) que llegan a una hoja (que apunta a sí misma)
+        dejan de recorrerse.
+        """
+        m = self.modelo
+        n_arboles = len(m["raices"])
+        profundidad = int(m["profundidad"])
+        hay_huecos = np.isnan(Z).any()
+
+        n_nodos = len(m["variable"])
+        if len(Z) * n_nodos <= NODOS_POR_NIVEL * profundidad:
+            x = np.take(Z, m["variable"], axis=1)
+            izquierda = x <= m["umbral"]
+            if hay_huecos:
+                izquierda = np.where(np.isnan(x), m["falta_izquierda"], izquierda)
+            if categorias and len(self._nodos_categoricos):
+                # Solo los nodos categóricos pasan por los bitsets
+                nodos_cat = self._nodos_categoricos
+                izquierda[:, nodos_cat] = self._a_la_izquierda(x[:, nodos_cat], nodos_cat, True, hay_huecos)
+            # Aritmética en lugar de np.where (lento con máscaras aleatorias) y nodos de
+            # todas las filas en un solo array plano, desplazados n_nodos por fila
+            desplazamiento = (np.arange(len(Z)) * n_nodos)[:, None]
+            siguiente = m["izquierdo"] + ~izquierda * self._salto_derecha
+            if len(Z) > 1:
+                siguiente += desplazamiento
+            siguiente = siguiente.ravel()
+            nodos = (m["raices"] + desplazamiento).ravel()
+            for _ in range(profundidad):
+                nodos = siguiente[nodos]
+            return m["valor"][nodos.reshape(len(Z), n_arboles) - desplazamiento]
+
+        nodos = np.tile(m["raices"], len(Z))
+        filas = np.repeat(np.arange(len(Z)), n_arboles)
+        activos = np.arange(len(nodos))
+        for _ in range(profundidad):
+            actuales = nodos[activos]
+            x = Z[filas[activos], m["variable"][actuales]]
+            izquierda = self._a_la_izquierda(x, actuales, categorias, hay_huecos)
+            siguientes = np.where(izquierda, m["izquierdo"][actuales], m["derecho"][actuales])
+            nodos[activos] = siguientes
+            activos = activos[siguientes != actuales]
+            if len(activos) == 0:
+                break
+        return m["valor"][nodos].reshape(len(Z), n_arboles)
+
+    def predecir(self, X: np.ndarray) -> np.ndarray:
+        """Predicción de intensidad para la matriz de entrada (ver matriz())."""
+        X = np.atleast_2d(np.asarray(X, dtype=np.float64))
+        Z = self._preprocesar(X)
+        m = self.modelo
+        tipo = self.meta["tipo"]
+
+        if tipo == "arboles":
+            # Los árboles de sklearn comparan la entrada en float32
+            hojas = self._recorrer_arboles(Z.astype(np.float32))
+            return float(m["base"]) + float(m["escala"]) * hojas.sum(axis=1)
+        if tipo == "hgb":
+            Z = Z.astype(np.float64)[:, m["orden"]]
+            for k in range(int(m.get("n_recodificadas", 0))):
+                # Categorías no vistas por el codificador interno -> hueco
+                cats = m[f"recodificar{k}"]
+                pos = np.minimum(np.searchsorted(cats, Z[:, k]), len(cats) - 1)
+                Z[:, k] = np.where(cats[pos] == Z[:, k], pos, np.nan)
+            hojas = self._recorrer_arboles(Z, categorias=True)
+            return float(m["base"]) + hojas.sum(axis=1)
+
+        activacion = _ACTIVACIONES[self.meta["activacion"]]
+        h = Z
+        n_capas = int(m["n_capas"])
+        for i in range(n_capas):
+            h = h @ m[f"pesos{i}"] + m[f"sesgo{i}"]
+            if i < n_capas - 1:
+                h = activacion(h)
+        return h.ravel()
@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+"""
+Meteorología por zona a partir de varias predicciones municipales de AEMET.
+
+En lugar de aplicar la predicción de Madrid a todas las zonas, descarga en
+paralelo (asyncio) las tablas horarias de una lista de municipios y asigna a
+cada zona la del municipio más cercano con una sola operación vectorizada
+sobre las coordenadas del catálogo de zonas. Las descargas comparten una
+sesión con un pool de conexiones acotado, respetan un intervalo mínimo entre
+peticiones al mismo servidor y pasan por la caché de aemet_scraper: las
+páginas vigentes no generan peticiones.
+
+RefrescoEstaciones mantiene esas tablas al día en segundo plano para el Modo
+Usuario, que agrupa las zonas por estación para la predicción puntual, la
+caché de predicciones y el cubo de previsión.
+
+Uso:
+    python meteo_zonas.py [--fecha "DD/MM/YYYY HH:MM"] [--salida meteo_zonas.csv] [--max-conexiones 4]
+"""
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+from datetime import datetime, date
+from urllib.parse import urlsplit
+
+import numpy as np
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+
+from aemet_scraper import AemetScraper, PrevisionHoraria, RefrescoPrevision, pagina_vigente, caducidad_pagina
+from aemet_mapper import AemetMapper
+from algorithms import FORMATO_FECHA, cubo_prediccion
+
+URL_MUNICIPIO = "https://www.aemet.es/es/eltiempo/prediccion/municipios/horas/tabla/{municipio}"
+RUTA_ZONAS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "12-2024_TrafficZones.csv")
+MAX_CONEXIONES = 4
+INTERVALO_HOST_S = 0.25
+
+# Madrid y los municipios limítrofes: las zonas del borde de la ciudad quedan
+# más cerca de su centro que del de Madrid. Cada estación admite "url" para
+# sustituir a la página de AEMET.
+ESTACIONES_DEFECTO = [
+    {"nombre": "Madrid", "municipio": "madrid-id28079", "lat": 40.4168, "lon": -3.7038},
+    {"nombre": "Alcobendas", "municipio": "alcobendas-id28006", "lat": 40.5475, "lon": -3.6420},
+    {"nombre": "San Sebastián de los Reyes", "municipio": "san-sebastian-de-los-reyes-id28134", "lat": 40.5474, "lon": -3.6261},
+    {"nombre": "Coslada", "municipio": "coslada-id28049", "lat": 40.4238, "lon": -3.5613},
+    {"nombre": "Rivas-Vaciamadrid", "municipio": "rivas-vaciamadrid-id28123", "lat": 40.3580, "lon": -3.5290},
+    {"nombre": "Getafe", "municipio": "getafe-id28065", "lat": 40.3057, "lon": -3.7329},
+    {"nombre": "Leganés", "municipio": "leganes-id28074", "lat": 40.3272, "lon": -3.7635},
+    {"nombre": "Alcorcón", "municipio": "alcorcon-id28007", "lat": 40.3458, "lon": -3.8249},
+    {"nombre": "Pozuelo de Alarcón", "municipio": "pozuelo-de-alarcon-id28115", "lat": 40.4350, "lon": -3.8137},
+]
+
+# Puerta del Sol (km 0), para zonas sin coordenadas válidas
+CENTRO_MADRID = (40.4168, -3.7038)
+
+
+def url_estacion(estacion: dict) -> str:
+    return estacion.get("url") or URL_MUNICIPIO.format(municipio=estacion["municipio"])
+
+
+class _LimitadorHost:
+    """Intervalo mínimo entre el inicio de dos peticiones al mismo servidor."""
+
+    def __init__(self, intervalo_s: float):
+        self.intervalo_s = intervalo_s
+        self._siguiente = {}
+        self._cerrojos = {}
+
+    async def esperar(self, host: str):
+        cerrojo = self._cerrojos.setdefault(host, asyncio.Lock())
+        async with cerrojo:
+            espera = self._siguiente.get(host, 0.0) - time.monotonic()
+            if espera > 0:
+                await asyncio.sleep(espera)
+            self._siguiente[host] = time.monotonic() + self.intervalo_s
+
+
+async def _descargar_previsiones(estaciones, max_conexiones, intervalo_host_s, timeout):
+    sesion = requests.Session()
+    sesion.headers.update(AemetScraper.HEADERS)
+    adaptador = HTTPAdapter(pool_connections=max_conexiones, pool_maxsize=max_conexiones, pool_block=True)
+    sesion.mount("http://", adaptador)
+    sesion.mount("https://", adaptador)
+    semaforo = asyncio.Semaphore(max_conexiones)
+    limitador = _LimitadorHost(intervalo_host_s)
+
+    async def descargar(estacion):
+        url = url_estacion(estacion)
+        scraper = AemetScraper(timeout=timeout, url_horaria=url, session=sesion)
+        async with semaforo:
+            try:
+                # Las páginas vigentes salen de la caché sin tocar la red
+                if not pagina_vigente(url):
+                    await limitador.esperar(urlsplit(url).netloc)
+                return await asyncio.to_thread(scraper.get_forecast_table)
+            except Exception:
+                # Una estación mal configurada o una página inesperada no hace fallar al resto
+                return PrevisionHoraria([], date.today())
+
+    try:
+        return await asyncio.gather(*(descargar(estacion) for estacion in estaciones))
+    finally:
+        sesion.close()
+
+
+def descargar_previsiones(estaciones=ESTACIONES_DEFECTO, max_conexiones: int = MAX_CONEXIONES,
+                          intervalo_host_s: float = INTERVALO_HOST_S, timeout: int = 10) -> list:
+    """
+    Tabla horaria (PrevisionHoraria) de cada estación, en el mismo orden.
+
+    Como mucho max_conexiones descargas a la vez y, para cada servidor, al
+    menos intervalo_host_s segundos entre el inicio de dos peticiones. Una
+    estación que no se puede descargar o analizar devuelve una tabla vacía.
+    """
+    return asyncio.run(_descargar_previsiones(list(estaciones), max_conexiones, intervalo_host_s, timeout))
+
+
+class RefrescoEstaciones(RefrescoPrevision):
+    """
+    RefrescoPrevision de varias estaciones: actual() devuelve una
+    PrevisionHoraria por estación, en el orden de estaciones.
+
+    Cada intento descarga (o revalida) todas con descargar_previsiones; una
+    estación que falla conserva su última tabla buena o queda vacía, y el
+    intento solo cuenta como fallo si ninguna tiene tabla. Se revalida al
+    caducar la primera página.
+    """
+
+    def __init__(self, estaciones=ESTACIONES_DEFECTO, max_conexiones: int = MAX_CONEXIONES,
+                 intervalo_host_s: float = INTERVALO_HOST_S, timeout: int = 10, **opciones):
+        super().__init__(**opciones)
+        self.estaciones = list(estaciones)
+        self.max_conexiones = max_conexiones
+        self.intervalo_host_s = intervalo_host_s
+        self.timeout = timeout
+
+    def _descargar_tabla(self) -> tuple:
+        nuevas = descargar_previsiones(self.estaciones, self.max_conexiones, self.intervalo_host_s, self.timeout)
+        with self._cerrojo:
+            anteriores = self._tabla or [None] * len(nuevas)
+        tablas = [n if len(n) or a is None else a for n, a in zip(nuevas, anteriores)]
+        if not any(len(t) for t in tablas):
+            raise ValueError("ninguna estación de AEMET tiene tabla horaria")
+        caducidades = [caducidad_pagina(url_estacion(e)) for e, n in zip(self.estaciones, nuevas) if len(n)]
+        return tablas, min(caducidades, default=0.0)
+
+
+def cargar_zonas(path_zonas: str = RUTA_ZONAS) -> pd.DataFrame:
+    """Catálogo de zonas (id, distrito y coordenadas tal como vienen en el CSV)."""
+    zonas = pd.read_csv(path_zonas, sep=";", encoding="latin-1", usecols=["id", "distrito", "latitud", "longitud"])
+    return zonas.drop_duplicates("id").reset_index(drop=True)
+
+
+def _grados(valores: pd.Series) -> np.ndarray:
+    """
+    Coordenadas WGS84 del catálogo, que vienen con los puntos de miles como
+    separadores ("4.048.137.411.763.500" -> 40.481374...). Versión vectorizada
+    de UserMode._parse_coordinate: las que empiezan por 3 son longitudes
+    (un dígito entero) y el resto latitudes (dos).
+    """
+    texto = valores.astype(str).str.strip()
+    negativo = texto.str.startswith("-").to_numpy()
+    digitos = texto.str.lstrip("-").str.replace(".", "", regex=False)
+    enteros = np.where(digitos.str.startswith("3").to_numpy(), 1, 2)
+    decimales = digitos.str.len().to_numpy(dtype=float) - enteros
+    valor = pd.to_numeric(digitos, errors="coerce").to_numpy(dtype=float) / 10.0 ** decimales
+    return np.where(negativo, -valor, valor)
+
+
+def seleccionar_zonas(catalogo: pd.DataFrame, ids) -> pd.DataFrame:
+    """Filas del catálogo de las zonas ids, en ese orden (sin coordenadas si no están en él)."""
+    catalogo = catalogo.drop_duplicates("id")[["id", "latitud", "longitud"]]
+    return pd.DataFrame({"id": list(ids)}).merge(catalogo, on="id", how="left")
+
+
+def coordenadas_zonas(zonas: pd.DataFrame):
+    """Latitud y longitud en grados de cada zona (Puerta del Sol si no se pueden interpretar)."""
+    lat, lon = _grados(zonas["latitud"]), _grados(zonas["longitud"])
+    validas = np.isfinite(lat) & np.isfinite(lon)
+    return np.where(validas, lat, CENTRO_MADRID[0]), np.where(validas, lon, CENTRO_MADRID[1])
+
+
+def estacion_mas_cercana(lat, lon, lat_estaciones, lon_estaciones) -> np.ndarray:
+    """
+    Índice de la estación más cercana a cada punto.
+
+    Distancia equirectangular: a la escala de una ciudad ordena igual que la
+    de círculo máximo y se calcula como una sola matriz puntos × estaciones.
+    """
+    lat, lon = np.asarray(lat, dtype=float), np.asarray(lon, dtype=float)
+    lat_estaciones, lon_estaciones = np.asarray(lat_estaciones, dtype=float), np.asarray(lon_estaciones, dtype=float)
+    escala = np.cos(np.radians(lat_estaciones.mean()))
+    dy = lat[:, None] - lat_estaciones[None, :]
+    dx = (lon[:, None] - lon_estaciones[None, :]) * escala
+    return np.argmin(dx * dx + dy * dy, axis=1)
+
+
+def _asignar_estaciones(zonas: pd.DataFrame, estaciones, con_datos) -> np.ndarray:
+    """Índice en estaciones de la más cercana a cada zona entre las de con_datos (-1 si no hay ninguna)."""
+    con_datos = np.asarray(con_datos, dtype=int)
+    if len(con_datos) == 0:
+        return np.full(len(zonas), -1)
+    lat, lon = coordenadas_zonas(zonas)
+    cercana = estacion_mas_cercana(
+        lat, lon,
+        [estaciones[i]["lat"] for i in con_datos],
+        [estaciones[i]["lon"] for i in con_datos],
+    )
+    return con_datos[cercana]
+
+
+def meteo_por_zona(instante: datetime, zonas: pd.DataFrame = None, estaciones=ESTACIONES_DEFECTO,
+                   previsiones=None, **opciones) -> pd.DataFrame:
+    """
+    Meteorología de cada zona para instante (misma forma que AemetMapper.create_prediction_dict).
+
+    Cada zona toma la de la estación más cercana que tiene predicción para
+    esa fecha y hora. previsiones permite reutilizar las tablas ya
+    descargadas; si no se pasan, se descargan (opciones se pasan a
+    descargar_previsiones). Devuelve un DataFrame con id, estacion y las
+    columnas meteorológicas; si ninguna estación tiene datos, solo id y
+    estacion (None).
+    """
+    estaciones = list(estaciones)
+    if zonas is None:
+        zonas = cargar_zonas()
+    if previsiones is None:
+        previsiones = descargar_previsiones(estaciones, **opciones)
+
+    filas = [prevision.buscar(instante) for prevision in previsiones]
+    con_datos = [i for i, fila in enumerate(filas) if fila is not None]
+    resultado = pd.DataFrame({"id": zonas["id"].to_numpy()})
+    if not con_datos:
+        resultado["estacion"] = None
+        return resultado
+
+    # Una fila meteorológica por estación y una sola indexación para todas las zonas
+    mapper = AemetMapper()
+    meteo = pd.DataFrame([mapper.create_prediction_dict(filas[i]) for i in con_datos], index=con_datos)
+    asignada = _asignar_estaciones(zonas, estaciones, con_datos)
+    resultado["estacion"] = [estaciones[i]["nombre"] for i in asignada]
+    return pd.concat([resultado, meteo.loc[asignada].reset_index(drop=True)], axis=1)
+
+
+def grupos_por_estacion(meteo: pd.DataFrame) -> list:
+    """
+    [(ids, meteorología)] de un resultado de meteo_por_zona, una entrada por
+    estación en orden de aparición: cada grupo se predice con un solo dict,
+    como una zona suelta.
+    """
+    if "estacion" not in meteo.columns or meteo["estacion"].isna().all():
+        return []
+    columnas = [c for c in meteo.columns if c not in ("id", "estacion")]
+    grupos = []
+    for _, grupo in meteo.groupby("estacion", sort=False):
+        # to_dict("records") devuelve tipos de Python, como create_prediction_dict
+        grupos.append((grupo["id"].tolist(), grupo[columnas].head(1).to_dict("records")[0]))
+    return grupos
+
+
+def cubo_prediccion_zonas(paquete, ids, inicio, horas: int = 24, zonas: pd.DataFrame = None,
+                          estaciones=ESTACIONES_DEFECTO, previsiones=None, meteo_defecto: dict = None,
+                          paso_minutos: int = 15) -> dict:
+    """
+    cubo_prediccion con la meteorología de la estación más cercana a cada zona.
+
+    Las zonas se asignan a la estación más cercana con tabla horaria y se
+    predicen por grupos; cada instante que no está en la tabla de su
+    estación usa meteo_defecto (las medianas de entrenamiento si es None).
+    zonas es el catálogo con las coordenadas (cargar_zonas() si no se pasa);
+    sin previsiones, todo el horizonte usa meteo_defecto.
+    """
+    ids = np.asarray(ids)
+    if previsiones is None or not any(len(p) for p in previsiones):
+        return cubo_prediccion(paquete, ids, inicio, horas=horas, meteo=meteo_defecto, paso_minutos=paso_minutos)
+
+    estaciones = list(estaciones)
+    catalogo = seleccionar_zonas(cargar_zonas() if zonas is None else zonas, ids)
+    asignada = _asignar_estaciones(catalogo, estaciones, [i for i, p in enumerate(previsiones) if len(p)])
+    fechas = pd.date_range(pd.Timestamp(inicio), periods=horas * 60 // paso_minutos, freq=f"{paso_minutos}min")
+    mapper = AemetMapper()
+    intensidad = np.empty((len(ids), len(fechas)), dtype=np.float32)
+    for estacion in np.unique(asignada):
+        # Cada hora se mapea una vez y la usan sus cuatro cuartos
+        por_hora = {}
+        for f in fechas:
+            clave = (f.date(), f.hour)
+            if clave not in por_hora:
+                datos = previsiones[estacion].buscar(f)
+                por_hora[clave] = mapper.create_prediction_dict(datos) if datos else meteo_defecto or {}
+        meteo = [por_hora[(f.date(), f.hour)] for f in fechas]
+        filas = np.flatnonzero(asignada == estacion)
+        cubo = cubo_prediccion(paquete, ids[filas], inicio, horas=horas, meteo=meteo, paso_minutos=paso_minutos)
+        intensidad[filas] = cubo["intensidad"]
+    return {"ids": ids, "fechas": fechas, "intensidad": intensidad}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Meteorología de AEMET por zona (estación más cercana)")
+    parser.add_argument("--fecha", default=None, help='Fecha y hora "DD/MM/YYYY HH:MM" (por defecto, ahora)')
+    parser.add_argument("--salida", default=None, help="CSV de salida (separador ';')")
+    parser.add_argument("--zonas", default=RUTA_ZONAS, help="CSV de zonas")
+    parser.add_argument("--max-conexiones", type=int, default=MAX_CONEXIONES)
+    parser.add_argument("--intervalo-host", type=float, default=INTERVALO_HOST_S,
+                        help="Segundos mínimos entre peticiones al mismo servidor")
+    args = parser.parse_args(argv)
+
+    instante = datetime.strptime(args.fecha, FORMATO_FECHA) if args.fecha else datetime.now()
+    inicio = time.perf_counter()
+    previsiones = descargar_previsiones(
+        ESTACIONES_DEFECTO, max_conexiones=args.max_conexiones, intervalo_host_s=args.intervalo_host
+    )
+    print(f"{len(previsiones)} estaciones en {time.perf_counter() - inicio:.2f} s")
+    for estacion, prevision in zip(ESTACIONES_DEFECTO, previsiones):
+        print(f"  {estacion['nombre']:28s} {len(prevision):3d} horas")
+
+    resultado = meteo_por_zona(instante, cargar_zonas(args.zonas), ESTACIONES_DEFECTO, previsiones)
+    print(resultado["estacion"].value_counts(dropna=False).to_string())
+    if args.salida:
+        resultado.to_csv(args.salida, sep=";", index=False)
+        print(f"[OK] {len(resultado):,} zonas -> {args.salida}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
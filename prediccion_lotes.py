@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+Predicción por lotes sin interfaz gráfica.
+
+Hace lo mismo que la pestaña de predicción del Modo Técnico (redondeo de la
+hora al :15, preparar_datos_prediccion, predict y clasificación
+Bajo/Medio/Alto), pero recorriendo el CSV por bloques y escribiendo la
+salida a medida que avanza, de modo que la memoria no depende del tamaño
+del fichero. Tras cada bloque se guarda un punto de control: si el proceso
+se interrumpe, volver a lanzarlo continúa desde el último bloque completo.
+
+Uso:
+    python prediccion_lotes.py ejemplares.csv modelo.mdl salida.csv [--tam-bloque 200000] [--sin-reanudar]
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import itertools
+
+import pandas as pd
+
+from algorithms import preparar_datos_prediccion, cargar_paquete_modelo, niveles_trafico, redondear_fechas_a_15
+
+TAM_BLOQUE_PREDICCION = 200_000
+EXTENSION_PROGRESO = ".progreso.json"
+RUTA_ZONAS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "12-2024_TrafficZones.csv")
+
+
+def _nombres_zonas(path_zonas):
+    """Serie id -> nombre de zona, o None si no hay fichero de zonas."""
+    if not path_zonas or not os.path.exists(path_zonas):
+        return None
+    zonas = pd.read_csv(path_zonas, sep=";", encoding="latin-1", usecols=["id", "nombre"])
+    return zonas.drop_duplicates("id").set_index("id")["nombre"].astype(str)
+
+
+def predecir_bloque(df: pd.DataFrame, paquete, nombres_zonas=None) -> pd.DataFrame:
+    """Predicción, nivel de tráfico y nombre de zona para un bloque de ejemplares."""
+    df = df.copy()
+    if "fecha" in df.columns:
+        df["fecha"] = redondear_fechas_a_15(df["fecha"])
+    X = preparar_datos_prediccion(df, paquete)
+    pred = paquete["modelo"].predict(X)
+
+    df["prediccion_intensidad"] = pred
+    df["nivel_trafico"] = niveles_trafico(pred, paquete, df["id"] if "id" in df.columns else None)["niveles"]
+    if nombres_zonas is not None:
+        df["zona_nombre"] = df["id"].map(nombres_zonas).fillna("Desconocida")
+    return df
+
+
+def _cabecera_salida(path_csv: str, nombres_zonas=None) -> bytes:
+    """Cabecera del CSV de salida: las columnas de la entrada más las que añade predecir_bloque."""
+    with open(path_csv, "rb") as f:
+        cabecera = f.readline()
+    if not cabecera.strip():
+        return b""
+    columnas = list(pd.read_csv(io.BytesIO(cabecera), sep=";").columns)
+    nuevas = ["prediccion_intensidad", "nivel_trafico"] + (["zona_nombre"] if nombres_zonas is not None else [])
+    columnas += [c for c in nuevas if c not in columnas]
+    return pd.DataFrame(columns=columnas).to_csv(sep=";", index=False).encode("utf-8")
+
+
+def _identidad(path: str) -> dict:
+    st = os.stat(path)
+    return {"ruta": os.path.abspath(path), "tamano": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+def _leer_progreso(path_progreso, trabajo):
+    """Punto de control de una ejecución anterior del mismo trabajo, o None."""
+    try:
+        with open(path_progreso, encoding="utf-8") as f:
+            progreso = json.load(f)
+    except (OSError, ValueError):
+        return None
+    # Los puntos de control sin posición en la entrada no se pueden reanudar sin releerla
+    return progreso if progreso.get("trabajo") == trabajo and "bytes_entrada" in progreso else None
+
+
+def _bloques_csv(path_csv: str, tam_bloque: int, desde: int = 0):
+    """
+    Bloques de tam_bloque filas del CSV como (DataFrame, posición en bytes tras el bloque).
+
+    Con desde > 0 empieza en ese byte (el de un punto de control) sin leer ni
+    analizar las filas anteriores. Cada fila debe ocupar una línea, como en
+    los CSV de ejemplares (sin saltos de línea dentro de campos).
+    """
+    with open(path_csv, "rb") as f:
+        cabecera = f.readline()
+        if desde:
+            f.seek(desde)
+        while True:
+            lineas = list(itertools.islice(f, tam_bloque))
+            if not lineas:
+                return
+            bloque = pd.read_csv(io.BytesIO(cabecera + b"".join(lineas)), sep=";")
+            if len(bloque):
+                yield bloque, f.tell()
+
+
+def _guardar_progreso(path_progreso, progreso):
+    temporal = path_progreso + ".tmp"
+    with open(temporal, "w", encoding="utf-8") as f:
+        json.dump(progreso, f)
+    os.replace(temporal, path_progreso)
+
+
+def predecir_csv(path_csv: str, path_modelo: str, path_salida: str, tam_bloque: int = TAM_BLOQUE_PREDICCION,
+                 reanudar: bool = True, path_zonas: str = RUTA_ZONAS, progreso_cb=None) -> dict:
+    """
+    Predice un CSV de ejemplares por bloques y escribe el resultado en path_salida (separador ';').
+
+    El punto de control (path_salida + ".progreso.json") registra los bloques
+    terminados, la posición en bytes alcanzada en la entrada y el tamaño de
+    la salida en ese momento; al reanudar se descarta lo escrito después y la
+    lectura salta directamente a esa posición, sin recorrer las filas ya
+    hechas. Cambiar el CSV, el modelo o el tamaño de bloque invalida el punto
+    de control.
+
+    progreso_cb(filas_hechas) se llama tras cada bloque. Devuelve un resumen
+    con filas, bloques, bloques reanudados y velocidad.
+    """
+    inicio = time.perf_counter()
+    paquete, _ = cargar_paquete_modelo(path_modelo)
+    nombres_zonas = _nombres_zonas(path_zonas)
+
+    path_progreso = path_salida + EXTENSION_PROGRESO
+    trabajo = {"entrada": _identidad(path_csv), "modelo": _identidad(path_modelo), "tam_bloque": tam_bloque}
+    progreso = _leer_progreso(path_progreso, trabajo) if reanudar and os.path.exists(path_salida) else None
+    if progreso is None:
+        progreso = {"trabajo": trabajo, "bloques": 0, "filas": 0, "bytes_entrada": 0, "bytes_salida": 0}
+    bloques_reanudados = progreso["bloques"]
+
+    with open(path_salida, "r+b" if progreso["bytes_salida"] else "wb") as salida:
+        # Lo escrito tras el último punto de control pertenece a un bloque incompleto
+        salida.truncate(progreso["bytes_salida"])
+        salida.seek(progreso["bytes_salida"])
+        if not progreso["bytes_salida"]:
+            # La cabecera se escribe al crear la salida: un CSV sin filas da una salida con cabecera
+            salida.write(_cabecera_salida(path_csv, nombres_zonas))
+        for bloque, bytes_entrada in _bloques_csv(path_csv, tam_bloque, progreso["bytes_entrada"]):
+            resultado = predecir_bloque(bloque, paquete, nombres_zonas)
+            texto = resultado.to_csv(sep=";", index=False, header=False)
+            salida.write(texto.encode("utf-8"))
+            salida.flush()
+            os.fsync(salida.fileno())
+
+            progreso["bloques"] += 1
+            progreso["filas"] += len(bloque)
+            progreso["bytes_entrada"] = bytes_entrada
+            progreso["bytes_salida"] = salida.tell()
+            _guardar_progreso(path_progreso, progreso)
+            if progreso_cb is not None:
+                progreso_cb(progreso["filas"])
+
+    tiempo = time.perf_counter() - inicio
+    if os.path.exists(path_progreso):
+        os.remove(path_progreso)
+    return {
+        "filas": progreso["filas"],
+        "bloques": progreso["bloques"],
+        "bloques_reanudados": bloques_reanudados,
+        "tiempo_s": tiempo,
+        "filas_por_s": progreso["filas"] / tiempo if tiempo > 0 else float("nan"),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Predicción por lotes de SafeDrive sin interfaz gráfica")
+    parser.add_argument("ejemplares", help="CSV de ejemplares a predecir (separador ';')")
+    parser.add_argument("modelo", help="Modelo entrenado (.mdl)")
+    parser.add_argument("salida", help="CSV de resultados")
+    parser.add_argument("--tam-bloque", type=int, default=TAM_BLOQUE_PREDICCION, help="Filas por bloque")
+    parser.add_argument("--sin-reanudar", action="store_true", help="Empezar desde cero aunque haya un punto de control")
+    parser.add_argument("--zonas", default=RUTA_ZONAS, help="CSV de zonas para añadir el nombre de cada zona")
+    args = parser.parse_args(argv)
+
+    resumen = predecir_csv(
+        args.ejemplares, args.modelo, args.salida, tam_bloque=args.tam_bloque,
+        reanudar=not args.sin_reanudar, path_zonas=args.zonas,
+        progreso_cb=lambda filas: print(f"  {filas:,} filas", flush=True)
+    )
+    if resumen["bloques_reanudados"]:
+        print(f"Reanudado tras {resumen['bloques_reanudados']} bloques")
+    print(f"[OK] {resumen['filas']:,} filas en {resumen['tiempo_s']:.1f} s ({resumen['filas_por_s']:,.0f} filas/s) -> {args.salida}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""
+Servicio HTTP local de predicción.
+
+Carga un modelo una vez y atiende peticiones de otras herramientas sin abrir
+la interfaz gráfica. Las peticiones que llegan con pocos milisegundos de
+diferencia se agrupan en un único lote (micro-batching): una sola llamada a
+predict amortiza el coste fijo del preprocesado y del modelo.
+
+Endpoints (JSON):
+    POST /predecir      {"ids": [...], "fecha": "DD/MM/YYYY HH:MM", "meteo": {...}}
+                        -> {"intensidades": [...], "niveles": [...]}
+    GET  /estadisticas  contadores de peticiones, lotes, filas, latencia y rendimiento
+
+Uso:
+    python servicio_prediccion.py modelo.mdl [--puerto 8765] [--ventana-ms 5]
+"""
+
+import sys
+import json
+import time
+import queue
+import argparse
+import threading
+from datetime import datetime
+from concurrent.futures import Future
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import numpy as np
+import pandas as pd
+
+from algorithms import (
+    preparar_datos_prediccion, cargar_paquete_modelo, niveles_trafico, redondear_fechas_a_15, FORMATO_FECHA
+)
+from inferencia import cargar_modelo_compilado
+
+PUERTO_DEFECTO = 8765
+VENTANA_MS_DEFECTO = 5
+MAX_FILAS_LOTE = 20_000
+MAX_LATENCIAS = 10_000
+
+
+class _ServidorHTTP(ThreadingHTTPServer):
+    # Cola de conexiones mayor que la de socketserver (5) para ráfagas de clientes concurrentes
+    request_queue_size = 128
+    daemon_threads = True
+
+
+class ServicioPrediccion:
+    """
+    Modelo cargado, cola de peticiones y un hilo que las agrupa en lotes.
+
+    predecir() puede usarse también dentro del proceso: devuelve un Future
+    con el resultado de la petición una vez procesado su lote.
+    """
+
+    def __init__(self, path_modelo: str, ventana_ms: float = VENTANA_MS_DEFECTO, max_filas_lote: int = MAX_FILAS_LOTE):
+        self.paquete, self.info_carga = cargar_paquete_modelo(path_modelo)
+        self.compilado = cargar_modelo_compilado(path_modelo)
+
+        self.ventana_s = ventana_ms / 1000
+        self.max_filas_lote = max_filas_lote
+        self._cola = queue.Queue()
+        self._cerrojo = threading.Lock()
+        self._latencias = []
+        self._contadores = {"peticiones": 0, "lotes": 0, "filas": 0, "errores": 0, "lotes_repetidos": 0,
+                            "tiempo_prediccion_s": 0.0}
+        self._inicio = time.perf_counter()
+        self._hilo = None
+        self._servidor = None
+
+    # ---------- Lotes ----------
+
+    def predecir(self, ids, fecha: str, meteo: dict) -> Future:
+        futuro = Future()
+        self._cola.put((list(ids), fecha, dict(meteo or {}), futuro, time.perf_counter()))
+        return futuro
+
+    def _siguiente_lote(self):
+        """Espera una petición y recoge las que lleguen durante la ventana."""
+        primera = self._cola.get()
+        if primera is None:
+            return None
+        lote, filas = [primera], len(primera[0])
+        limite = time.perf_counter() + self.ventana_s
+        while filas < self.max_filas_lote:
+            restante = limite - time.perf_counter()
+            if restante <= 0:
+                break
+            try:
+                peticion = self._cola.get(timeout=restante)
+            except queue.Empty:
+                break
+            if peticion is None:
+                self._cola.put(None)
+                break
+            lote.append(peticion)
+            filas += len(peticion[0])
+        return lote
+
+    def _predecir_lote(self, lote) -> np.ndarray:
+        """
+        Una única predicción para todas las filas del lote.
+
+        Las fechas se redondean al siguiente :15, como en la predicción por
+        lotes y en el Modo Usuario, para que una petición dé lo mismo por
+        cualquier camino.
+        """
+        fechas = redondear_fechas_a_15(pd.Series([peticion[1] for peticion in lote])).tolist()
+        if self.compilado is not None:
+            X = np.vstack([
+                self.compilado.matriz(ids, fecha, meteo) for (ids, _, meteo, _, _), fecha in zip(lote, fechas)
+            ])
+            return self.compilado.predecir(X)
+        filas = [
+            {"id": i, "fecha": fecha, **meteo} for (ids, _, meteo, _, _), fecha in zip(lote, fechas) for i in ids
+        ]
+        return self.paquete["modelo"].predict(preparar_datos_prediccion(pd.DataFrame(filas), self.paquete))
+
+    def _resolver(self, lote):
+        """Predice el lote y entrega a cada petición su parte; lanza la excepción si falla."""
+        inicio = time.perf_counter()
+        pred = self._predecir_lote(lote)
+        ids = [i for peticion in lote for i in peticion[0]]
+        niveles = niveles_trafico(pred, self.paquete, ids)["niveles"]
+        fin = time.perf_counter()
+
+        desde = 0
+        for ids, _, _, futuro, llegada in lote:
+            hasta = desde + len(ids)
+            futuro.set_result({
+                "intensidades": pred[desde:hasta].tolist(),
+                "niveles": niveles[desde:hasta].tolist(),
+            })
+            desde = hasta
+        with self._cerrojo:
+            self._contadores["peticiones"] += len(lote)
+            self._contadores["lotes"] += 1
+            self._contadores["filas"] += len(pred)
+            self._contadores["tiempo_prediccion_s"] += fin - inicio
+            self._latencias.extend(fin - llegada for *_, llegada in lote)
+            del self._latencias[:-MAX_LATENCIAS]
+
+    def _procesar(self):
+        while True:
+            lote = self._siguiente_lote()
+            if lote is None:
+                return
+            try:
+                self._resolver(lote)
+            except Exception as e:
+                if len(lote) == 1:
+                    self._fallo(lote[0], e)
+                else:
+                    self._resolver_por_separado(lote)
+
+    def _resolver_por_separado(self, lote):
+        """
+        Repite una a una las peticiones de un lote que ha fallado: una petición
+        inválida no hace fallar a las demás y solo ella recibe el error.
+        """
+        with self._cerrojo:
+            self._contadores["lotes_repetidos"] += 1
+        for peticion in lote:
+            try:
+                self._resolver([peticion])
+            except Exception as e:
+                self._fallo(peticion, e)
+
+    def _fallo(self, peticion, error: Exception):
+        peticion[3].set_exception(error)
+        with self._cerrojo:
+            self._contadores["errores"] += 1
+
+    def estadisticas(self) -> dict:
+        """Contadores acumulados y percentiles de latencia (de las últimas peticiones)."""
+        with self._cerrojo:
+            c = dict(self._contadores)
+            latencias = np.array(self._latencias) * 1000
+        activo = time.perf_counter() - self._inicio
+        return {
+            **c,
+            "filas_por_lote": c["filas"] / c["lotes"] if c["lotes"] else 0.0,
+            "peticiones_por_s": c["peticiones"] / activo if activo > 0 else 0.0,
+            "filas_por_s_prediccion": c["filas"] / c["tiempo_prediccion_s"] if c["tiempo_prediccion_s"] else 0.0,
+            "latencia_p50_ms": float(np.percentile(latencias, 50)) if len(latencias) else None,
+            "latencia_p95_ms": float(np.percentile(latencias, 95)) if len(latencias) else None,
+            "modelo_compilado": self.compilado is not None,
+        }
+
+    # ---------- HTTP ----------
+
+    def iniciar(self, host: str = "127.0.0.1", puerto: int = PUERTO_DEFECTO):
+        """Arranca el hilo de lotes y el servidor HTTP en segundo plano; devuelve (host, puerto)."""
+        self._hilo = threading.Thread(target=self._procesar, daemon=True)
+        self._hilo.start()
+        self._servidor = _ServidorHTTP((host, puerto), _crear_manejador(self))
+        threading.Thread(target=self._servidor.serve_forever, daemon=True).start()
+        return self._servidor.server_address
+
+    def detener(self):
+        if self._servidor is not None:
+            self._servidor.shutdown()
+            self._servidor.server_close()
+        self._cola.put(None)
+        if self._hilo is not None:
+            self._hilo.join()
+
+
+def _crear_manejador(servicio: ServicioPrediccion):
+    class Manejador(BaseHTTPRequestHandler):
+        def _responder(self, codigo, cuerpo):
+            datos = json.dumps(cuerpo).encode("utf-8")
+            self.send_response(codigo)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(datos)))
+            self.end_headers()
+            self.wfile.write(datos)
+
+        def do_GET(self):
+            if self.path == "/estadisticas":
+                self._responder(200, servicio.estadisticas())
+            else:
+                self._responder(404, {"error": "Ruta no encontrada"})
+
+        def do_POST(self):
+            if self.path != "/predecir":
+                self._responder(404, {"error": "Ruta no encontrada"})
+                return
+            try:
+                peticion = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                ids, fecha = [int(i) for i in peticion["ids"]], peticion["fecha"]
+                if not ids:
+                    raise ValueError("ids no puede estar vacío")
+                datetime.strptime(fecha, FORMATO_FECHA)
+                meteo = peticion.get("meteo") or {}
+                if not isinstance(meteo, dict):
+                    raise TypeError("meteo debe ser un objeto JSON")
+            except (ValueError, KeyError, TypeError) as e:
+                self._responder(400, {"error": f"Petición inválida: {e}"})
+                return
+            try:
+                self._responder(200, servicio.predecir(ids, fecha, meteo).result())
+            except Exception as e:
+                self._responder(500, {"error": str(e)})
+
+        def log_message(self, formato, *args):
+            pass
+
+    return Manejador
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Servicio HTTP local de predicción de SafeDrive")
+    parser.add_argument("modelo", help="Modelo entrenado (.mdl)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--puerto", type=int, default=PUERTO_DEFECTO)
+    parser.add_argument("--ventana-ms", type=float, default=VENTANA_MS_DEFECTO, help="Espera máxima para agrupar peticiones")
+    args = parser.parse_args(argv)
+
+    servicio = ServicioPrediccion(args.modelo, ventana_ms=args.ventana_ms)
+    host, puerto = servicio.iniciar(args.host, args.puerto)
+    print(f"Servicio de predicción en http://{host}:{puerto} (Ctrl+C para salir)")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        servicio.detener()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
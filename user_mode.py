@@ -5,12 +5,16 @@ Componentes y funcionalidad para el modo Predicción (Usuario) en SafeDrive.
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
 from datetime import datetime, timedelta
+import numpy as np
 import pandas as pd
 import json
-from aemet_scraper import AemetScraper
-from aemet_mapper import AemetMapper
-from algorithms import preparar_datos_prediccion
-import joblib
+from meteo_zonas import RefrescoEstaciones, meteo_por_zona, grupos_por_estacion, cubo_prediccion_zonas, seleccionar_zonas
+from algorithms import (
+    preparar_datos_prediccion, obtener_lookups, cargar_paquete_modelo, describir_carga_modelo,
+    huella_modelo, niveles_trafico, redondear_fechas_a_15, DIRECTORIO_CACHE, NIVELES_TRAFICO
+)
+from cache_predicciones import CachePredicciones
+from inferencia import cargar_modelo_compilado, compilar_modelo
 import os
 import webbrowser
 import threading
@@ -29,6 +33,26 @@ except Exception:
     FOLIUM_AVAILABLE = False
 
 
+# Valores meteorológicos razonables cuando AEMET no está disponible (mismas claves que AemetMapper)
+METEO_POR_DEFECTO = {
+    'temp': 15.0,           # Temperatura media
+    'feelslike': 15.0,      # Sensación térmica
+    'dew': 10.0,            # Punto de rocío
+    'humidity': 60.0,       # Humedad media
+    'precip': 0.0,          # Sin precipitación
+    'precipprob': 0.0,      # Probabilidad de precipitación
+    'windgust': 15.0,       # Ráfaga de viento
+    'windspeed': 10.0,      # Velocidad del viento moderada
+    'winddir': 180.0,       # Dirección del viento (Sur)
+    'cloudcover': 50.0,     # Parcialmente nublado
+    'visibility': 10.0,     # Buena visibilidad (km)
+    'conditionsDay': 'Partially cloudy'  # Condición del día
+}
+
+HORIZONTES_PREVISION = {"24 h": 24, "48 h": 48}
+RUTA_CACHE_PREDICCIONES = os.path.join(DIRECTORIO_CACHE, "predicciones.sqlite")
+
+
 class LoadingDialog(tk.Toplevel):
     """Diálogo de carga con spinner animado."""
     def __init__(self, parent, title="Cargando", message="Por favor espera..."):
@@ -273,11 +297,21 @@ class UserModeTab:
         
         self.trained_model = None
         self.trained_results = None
+        self.modelo_compilado = None
+        self.huella_modelo = None
+        # Línea base del .mdl: responde mientras el estimador completo se carga en segundo plano
+        self.linea_base = None
+        self.modelo_listo = threading.Event()
+        self.cache_predicciones = CachePredicciones(path_disco=RUTA_CACHE_PREDICCIONES)
         self.last_aemet_data = None
         self.last_predictions = None
         self.last_zone_coords = []
+        # Tablas horarias de AEMET (Madrid y municipios limítrofes) mantenidas en
+        # segundo plano: predecir no espera a la red y cada zona usa su estación más cercana
+        self.refresco_aemet = RefrescoEstaciones().iniciar()
         
         self._create_widgets()
+        self._actualizar_estado_aemet()
     
     def _create_widgets(self):
         """Crea los widgets de la pestaña."""
@@ -338,6 +372,20 @@ class UserModeTab:
             command=self._make_prediction
         )
         btn_predict.grid(row=3, column=2, padx=(10, 15), pady=(10, 5), sticky="e")
+
+        # Previsión por horas (cubo zonas × cuartos de hora)
+        forecast_frame = ttk.Frame(tab)
+        forecast_frame.grid(row=3, column=1, pady=(10, 5), sticky="e")
+        ttk.Label(forecast_frame, text="Horizonte:").pack(side="left", padx=5)
+        self.horizon_var = tk.StringVar(value="24 h")
+        ttk.Combobox(
+            forecast_frame, textvariable=self.horizon_var, values=list(HORIZONTES_PREVISION),
+            state="readonly", width=6
+        ).pack(side="left", padx=5)
+        ttk.Button(
+            forecast_frame, text="Previsión por horas",
+            command=self._make_forecast
+        ).pack(side="left", padx=5)
         
         # Fila 4: Tabla y Resumen
         center_frame = ttk.Frame(tab)
@@ -394,6 +442,12 @@ class UserModeTab:
         
         self.lbl_tiempo_pred = ttk.Label(resumen_card, text="Tiempo: -")
         self.lbl_tiempo_pred.grid(row=7, column=0, sticky="w", pady=2, padx=5)
+
+        self.lbl_cache_pred = ttk.Label(resumen_card, text="Caché: -")
+        self.lbl_cache_pred.grid(row=8, column=0, sticky="w", pady=2, padx=5)
+
+        self.lbl_aemet = ttk.Label(resumen_card, text="AEMET: -")
+        self.lbl_aemet.grid(row=9, column=0, sticky="w", pady=2, padx=5)
         
         # Gráfico pie chart
         if MATPLOTLIB_AVAILABLE:
@@ -444,42 +498,90 @@ class UserModeTab:
             return
         
         try:
-            model_package = joblib.load(filepath)
+            # Con el formato v2 solo se leen aquí la cabecera y las estadísticas;
+            # el estimador se carga en segundo plano
+            model_package, info_carga = cargar_paquete_modelo(filepath)
             self.trained_model = model_package
             self.trained_results = {
-                'modelo': model_package['modelo'],
                 'features_numericas': model_package.get('features_numericas', []),
                 'features_categoricas': model_package.get('features_categoricas', []),
                 'zona_stats': model_package.get('zona_stats', {}),
                 'hora_stats': model_package.get('hora_stats', {}),
                 'median_values': model_package.get('median_values', {}),
+                'zona_defaults': model_package.get('zona_defaults', {}),
+                'hora_defaults': model_package.get('hora_defaults', {}),
+                'zona_lookup': model_package.get('zona_lookup'),
+                'hora_lookup': model_package.get('hora_lookup'),
             }
-            
-            model_name = os.path.basename(filepath)
-            self.lbl_model_status.config(
-                text=f"✓ Modelo cargado: {model_name}",
-                foreground="green"
-            )
+            # Los modelos antiguos no traen las lookups: se construyen una vez al cargar
+            zona_lookup, hora_lookup = obtener_lookups(self.trained_results)
+            self.trained_results['zona_lookup'] = zona_lookup
+            self.trained_results['hora_lookup'] = hora_lookup
+
+            # Identifica el modelo en la caché de predicciones leyendo solo la cabecera
+            self.huella_modelo = huella_modelo(filepath)
+            self.linea_base = model_package.get('linea_base')
+            self.modelo_compilado = None
+            self.modelo_listo = threading.Event()
         except Exception as e:
             messagebox.showerror("Error", f"No se pudo cargar el modelo:\n{e}")
             self.lbl_model_status.config(text="Error cargando modelo", foreground="red")
+            return
+
+        model_name = os.path.basename(filepath)
+        texto = f"Cargando modelo: {model_name}..."
+        if self.linea_base is not None:
+            texto += " (mientras tanto se predice con la línea base)"
+        self.lbl_model_status.config(text=texto, foreground="orange")
+        Thread(
+            target=self._cargar_estimador, args=(filepath, model_package, info_carga, self.modelo_listo), daemon=True
+        ).start()
+
+    def _cargar_estimador(self, filepath, model_package, info_carga, listo):
+        """Carga el estimador y el modelo compilado en segundo plano."""
+        try:
+            modelo = model_package['modelo']
+
+            # Modelo compilado para predecir sin pandas ni Pipeline: se usa el
+            # .infer.npz guardado junto al .mdl o se compila en memoria
+            compilado = cargar_modelo_compilado(filepath)
+            if compilado is None:
+                try:
+                    compilado = compilar_modelo(model_package)
+                except (ValueError, KeyError, AttributeError):
+                    compilado = None
+        except Exception as e:
+            if self.trained_model is model_package:
+                self.trained_model = None
+                self.tab.after(0, lambda: messagebox.showerror("Error", f"No se pudo cargar el modelo:\n{e}"))
+                self.tab.after(0, lambda: self.lbl_model_status.config(text="Error cargando modelo", foreground="red"))
+            listo.set()
+            return
+
+        # Si mientras tanto se ha elegido otro modelo, este se descarta
+        if self.trained_model is not model_package:
+            return
+        self.trained_results['modelo'] = modelo
+        self.modelo_compilado = compilado
+        listo.set()
+        model_name = os.path.basename(filepath)
+        self.tab.after(0, lambda: self.lbl_model_status.config(
+            text=f"✓ Modelo cargado: {model_name} ({describir_carga_modelo(info_carga)})",
+            foreground="green"
+        ))
     
-    def _fetch_aemet_data(self) -> dict:
-        """Obtiene datos meteorológicos de AEMET.
+    def _fetch_aemet_data(self, zonas) -> dict:
+        """Obtiene datos meteorológicos de AEMET para cada zona (estación más cercana).
+        
+        Deja en last_aemet_data el resultado de meteo_por_zona.
         
         Returns:
             dict: {
                 'success': bool,
-                'error_type': str ('network', 'no_data', None)
+                'error_type': str ('network', 'pending', 'no_data', None)
             }
         """
         try:
-            scraper = AemetScraper()
-            
-            if not scraper.test_connection():
-                # Error de conexión/red
-                return {'success': False, 'error_type': 'network'}
-            
             # Validar que la fecha esté en el rango válido para AEMET
             # AEMET tiene datos actuales y predicciones hasta ~7 días en el futuro
             try:
@@ -506,20 +608,33 @@ class UserModeTab:
             except:
                 return {'success': False, 'error_type': 'no_data'}
             
-            # Obtener datos horarios
-            hourly_data = scraper.get_hourly_data()
+            # Últimas tablas descargadas en segundo plano (aunque estén caducadas)
+            previsiones = self.refresco_aemet.actual()
+            if previsiones is None:
+                # Sin ninguna descarga correcta todavía: fallo de red o primera descarga en curso
+                fallos = self.refresco_aemet.estado()['fallos']
+                return {'success': False, 'error_type': 'network' if fallos else 'pending'}
             
-            hour_str = str(hour).zfill(2)
-            if hour_str not in hourly_data:
+            # Buscar la fecha y hora en las tablas de todo el horizonte
+            meteo = meteo_por_zona(
+                date_obj.replace(hour=hour), seleccionar_zonas(self.traffic_zones, zonas),
+                self.refresco_aemet.estaciones, previsiones
+            )
+            if meteo['estacion'].isna().all():
                 return {'success': False, 'error_type': 'no_data'}
             
-            self.last_aemet_data = hourly_data[hour_str]
+            self.last_aemet_data = meteo
             return {'success': True, 'error_type': None}
             
         except Exception as e:
             # Cualquier excepción no controlada probablemente sea de red
             return {'success': False, 'error_type': 'network'}
     
+    def _actualizar_estado_aemet(self):
+        """Muestra la antigüedad de los datos de AEMET y se vuelve a programar."""
+        self.lbl_aemet.config(text=self.refresco_aemet.describir())
+        self.tab.after(30_000, self._actualizar_estado_aemet)
+
     def _make_prediction(self):
         """Realiza predicción con datos seleccionados."""
         # Validaciones
@@ -556,7 +671,7 @@ class UserModeTab:
                 return
             
             # Obtener datos de AEMET automáticamente
-            aemet_result = self._fetch_aemet_data()
+            aemet_result = self._fetch_aemet_data(selected_zones)
             aemet_available = aemet_result['success']
             error_type = aemet_result['error_type']
             
@@ -571,6 +686,14 @@ class UserModeTab:
                         "Se usarán valores meteorológicos por defecto.\n" +
                         "Las predicciones pueden ser menos precisas."
                     ))
+                elif error_type == 'pending':
+                    # La primera descarga en segundo plano aún no ha terminado
+                    self.tab.after(0, lambda: messagebox.showwarning(
+                        "Datos AEMET no disponibles",
+                        "Los datos de AEMET todavía se están descargando.\n\n" +
+                        "Se usarán valores meteorológicos por defecto.\n" +
+                        "Las predicciones pueden ser menos precisas."
+                    ))
                 else:
                     # Sin datos para esa fecha/hora
                     self.tab.after(0, lambda: messagebox.showwarning(
@@ -581,48 +704,73 @@ class UserModeTab:
                     ))
             
             start_time = time.time()
+
+            # Redondeo al :15 una sola vez, como en la predicción por lotes: la misma
+            # fecha se usa en el modelo, en la línea base y en la clave de la caché
+            fecha_str = redondear_fechas_a_15(pd.Series([fecha_str])).iloc[0]
             
-            # Mapear datos AEMET o usar valores por defecto
+            # Zonas agrupadas por estación de AEMET, o todas con valores por defecto
             if aemet_available:
-                mapper = AemetMapper()
-                aemet_mapped = mapper.create_prediction_dict(self.last_aemet_data)
+                grupos = grupos_por_estacion(self.last_aemet_data)
             else:
                 # Usar valores por defecto razonables (mismas claves que AemetMapper)
-                aemet_mapped = {
-                    'temp': 15.0,           # Temperatura media
-                    'feelslike': 15.0,      # Sensación térmica
-                    'dew': 10.0,            # Punto de rocío
-                    'humidity': 60.0,       # Humedad media
-                    'precip': 0.0,          # Sin precipitación
-                    'precipprob': 0.0,      # Probabilidad de precipitación
-                    'windgust': 15.0,       # Ráfaga de viento
-                    'windspeed': 10.0,      # Velocidad del viento moderada
-                    'winddir': 180.0,       # Dirección del viento (Sur)
-                    'cloudcover': 50.0,     # Parcialmente nublado
-                    'visibility': 10.0,     # Buena visibilidad (km)
-                    'conditionsDay': 'Partially cloudy'  # Condición del día
-                }
+                grupos = [(list(selected_zones), dict(METEO_POR_DEFECTO))]
+            
+            meteo_zona = {zone_id: aemet_mapped for zonas_grupo, aemet_mapped in grupos for zone_id in zonas_grupo}
             
             # Crear filas para cada zona
             rows = []
             for zone_id in selected_zones:
                 row = {'id': zone_id, 'fecha': fecha_str}
-                row.update(aemet_mapped)
+                row.update(meteo_zona[zone_id])
                 rows.append(row)
             
             df_pred = pd.DataFrame(rows)
             
-            # Preparar datos para predicción
-            df_prepared = preparar_datos_prediccion(df_pred, self.trained_results)
-            
-            # Realizar predicción
-            modelo = self.trained_results['modelo']
-            pred = modelo.predict(df_prepared)
+            # Sin línea base hay que esperar a que termine de cargarse el estimador
+            listo = self.modelo_listo
+            if self.linea_base is None:
+                listo.wait()
+            usa_linea_base = not listo.is_set()
+
+            # Cada grupo comparte meteorología: una consulta a la caché y una matriz por estación
+            encontradas = {}
+            for zonas_grupo, aemet_mapped in grupos:
+                faltan = []
+                if usa_linea_base:
+                    # Respuesta inmediata indexando la tabla zona × día × cuarto de hora (no se cachea)
+                    encontradas.update(zip(zonas_grupo, self.linea_base.predecir_zonas(
+                        zonas_grupo, fecha_str, aemet_mapped.get('precip')
+                    )))
+                else:
+                    en_cache, faltan = self.cache_predicciones.buscar(
+                        self.huella_modelo, zonas_grupo, fecha_str, aemet_mapped
+                    )
+                    encontradas.update(en_cache)
+                if faltan:
+                    if self.modelo_compilado is not None:
+                        # Camino rápido: matriz numérica directa y árboles/red en NumPy
+                        X = self.modelo_compilado.matriz(faltan, fecha_str, aemet_mapped)
+                        pred_faltan = self.modelo_compilado.predecir(X)
+                    else:
+                        # Preparar datos para predicción
+                        df_prepared = preparar_datos_prediccion(df_pred[df_pred['id'].isin(faltan)], self.trained_results)
+                        
+                        # Realizar predicción
+                        modelo = self.trained_results['modelo']
+                        pred_faltan = modelo.predict(df_prepared)
+                    self.cache_predicciones.guardar(self.huella_modelo, faltan, fecha_str, aemet_mapped, pred_faltan)
+                    encontradas.update(zip(faltan, pred_faltan))
+            pred = np.array([encontradas[zone_id] for zone_id in selected_zones], dtype=float)
             
             elapsed = time.time() - start_time
             
             # Actualizar resultados en el hilo principal, pasando si AEMET está disponible
             self.tab.after(0, lambda: self._update_prediction_results(df_pred, selected_zones, pred, elapsed, aemet_available))
+            if usa_linea_base:
+                self.tab.after(0, lambda: self.lbl_tiempo_pred.config(
+                    text=f"Tiempo: {elapsed:.3f} s (línea base, modelo cargando)"
+                ))
             
             # Cerrar el diálogo de carga
             self.tab.after(100, lambda: loading_dialog.close())
@@ -632,6 +780,95 @@ class UserModeTab:
             self.tab.after(0, lambda: messagebox.showerror("Error", f"Error en predicción:\n{traceback.format_exc()}"))
             self.tab.after(0, lambda: loading_dialog.close())
 
+    def _make_forecast(self):
+        """Previsión cada 15 minutos desde las 00:00 de la fecha elegida (zonas seleccionadas o todas)."""
+        if not self.trained_model:
+            messagebox.showerror("Error", "Debe cargar un modelo primero")
+            return
+        try:
+            date_obj = datetime.strptime(self.date_var.get(), "%d/%m/%Y")
+        except ValueError:
+            messagebox.showerror("Error", "Formato de fecha inválido (DD/MM/YYYY)")
+            return
+
+        zonas = self.zone_selector.get_selected_ids() or [int(z) for z in self.traffic_zones['id']]
+        horas = HORIZONTES_PREVISION[self.horizon_var.get()]
+        loading_dialog = LoadingDialog(
+            self.tab.master.master, title="Previsión",
+            message=f"Calculando previsión de {horas} h\npara {len(zonas)} zonas..."
+        )
+        Thread(target=self._forecast_worker, args=(zonas, date_obj, horas, loading_dialog), daemon=True).start()
+
+    def _forecast_worker(self, zonas, date_obj, horas, loading_dialog):
+        try:
+            import time
+
+            # Cada zona con la tabla de su estación más cercana; sin tablas, valores por defecto
+            previsiones = self.refresco_aemet.actual()
+            self.modelo_listo.wait()
+            start_time = time.time()
+            cubo = cubo_prediccion_zonas(
+                self.trained_results, zonas, date_obj, horas=horas, zonas=self.traffic_zones,
+                estaciones=self.refresco_aemet.estaciones, previsiones=previsiones, meteo_defecto=METEO_POR_DEFECTO
+            )
+            elapsed = time.time() - start_time
+            self.tab.after(0, lambda: self._show_forecast(cubo, elapsed))
+            self.tab.after(100, lambda: loading_dialog.close())
+        except Exception:
+            import traceback
+            error = traceback.format_exc()
+            self.tab.after(0, lambda: messagebox.showerror("Error", f"Error en la previsión:\n{error}"))
+            self.tab.after(0, lambda: loading_dialog.close())
+
+    def _show_forecast(self, cubo, elapsed):
+        """Ventana con el perfil medio del horizonte y el resumen por zona."""
+        intensidad = cubo["intensidad"]
+        fechas = cubo["fechas"]
+        ventana = tk.Toplevel(self.tab)
+        ventana.title(f"Previsión {fechas[0]:%d/%m/%Y} · {len(fechas) // 4} h · {len(cubo['ids'])} zonas")
+        ventana.geometry("820x600")
+
+        ttk.Label(
+            ventana,
+            text=f"{intensidad.size:,} predicciones en {elapsed:.2f} s"
+        ).pack(anchor="w", padx=10, pady=(10, 0))
+
+        if MATPLOTLIB_AVAILABLE:
+            fig = Figure(figsize=(8, 2.6), dpi=100)
+            ax = fig.add_subplot(111)
+            ax.plot(fechas, intensidad.mean(axis=0), label="Media")
+            ax.fill_between(fechas, np.percentile(intensidad, 10, axis=0), np.percentile(intensidad, 90, axis=0),
+                            alpha=0.3, label="P10-P90")
+            ax.set_ylabel("Intensidad")
+            ax.legend(loc="upper left")
+            fig.autofmt_xdate()
+            fig.tight_layout()
+            canvas = FigureCanvasTkAgg(fig, master=ventana)
+            canvas.get_tk_widget().pack(fill="x", padx=10, pady=5)
+
+        columnas = ("zona", "media", "pico", "hora_pico")
+        frame = ttk.Frame(ventana)
+        frame.pack(fill="both", expand=True, padx=10, pady=(5, 10))
+        tree = ttk.Treeview(frame, columns=columnas, show="headings")
+        for col, texto in zip(columnas, ("Zona", "Media", "Pico", "Hora del pico")):
+            tree.heading(col, text=texto)
+            tree.column(col, anchor="w" if col == "zona" else "center", width=300 if col == "zona" else 110)
+        scrollbar = ttk.Scrollbar(frame, orient="vertical", command=tree.yview)
+        tree.configure(yscrollcommand=scrollbar.set)
+        tree.pack(side="left", fill="both", expand=True)
+        scrollbar.pack(side="right", fill="y")
+
+        # Zonas ordenadas por pico de intensidad
+        picos = intensidad.argmax(axis=1)
+        maximos = intensidad[np.arange(len(picos)), picos]
+        medias = intensidad.mean(axis=1)
+        for i in np.argsort(-maximos):
+            zona_id = int(cubo["ids"][i])
+            nombre = self.zones_dict[zona_id].get("nombre", "") if zona_id in self.zones_dict else "Desconocida"
+            tree.insert("", "end", values=(
+                f"{zona_id} - {nombre}", f"{medias[i]:.1f}", f"{maximos[i]:.1f}", f"{fechas[picos[i]]:%d/%m %H:%M}"
+            ))
+
     def _update_prediction_results(self, df_pred, selected_zones, pred, elapsed, aemet_available=True):
         """Actualiza los resultados de predicción en la UI.
         
@@ -647,33 +884,10 @@ class UserModeTab:
             df_out = df_pred.copy()
             df_out["prediccion_intensidad"] = pred
             
-            # Clasificar nivel de tráfico
-            bajos = medios = altos = 0
-            niveles = []
-            zona_stats = self.trained_results.get('zona_stats', {})
-            
-            for i, p in enumerate(pred):
-                zone_id = selected_zones[i]
-                if zone_id in zona_stats:
-                    media = zona_stats[zone_id].get('mean', 150)
-                    std = zona_stats[zone_id].get('std', 100)
-                else:
-                    media = 150
-                    std = 100
-                
-                std = std if std > 0 else 100
-                z = (p - media) / std
-                
-                if z <= -0.5:
-                    nivel = "Bajo"
-                    bajos += 1
-                elif z >= 0.5:
-                    nivel = "Alto"
-                    altos += 1
-                else:
-                    nivel = "Medio"
-                    medios += 1
-                niveles.append(nivel)
+            # Clasificar nivel de tráfico con las estadísticas por zona del modelo
+            clasificacion = niveles_trafico(pred, self.trained_results, selected_zones)
+            niveles = clasificacion["niveles"]
+            bajos, medios, altos = (clasificacion["conteos"][nivel] for nivel in NIVELES_TRAFICO)
             
             df_out["nivel_trafico"] = niveles
             
@@ -711,12 +925,8 @@ class UserModeTab:
             for item in self.tree.get_children():
                 self.tree.delete(item)
             
-            for idx, row in df_out.iterrows():
-                self.tree.insert("", "end", values=(
-                    row['zona_nombre'],
-                    f"{row['prediccion_intensidad']:.1f}",
-                    row['nivel_trafico']
-                ))
+            for nombre, valor, nivel in zip(zone_names, pred, niveles):
+                self.tree.insert("", "end", values=(nombre, f"{valor:.1f}", nivel))
             
             # Actualizar resumen
             total = len(pred)
@@ -725,6 +935,8 @@ class UserModeTab:
             self.lbl_medio.config(text=f"Medio: {medios}")
             self.lbl_alto.config(text=f"Alto: {altos}")
             self.lbl_tiempo_pred.config(text=f"Tiempo: {elapsed:.2f} s")
+            self.lbl_cache_pred.config(text=self.cache_predicciones.describir())
+            self.lbl_aemet.config(text=self.refresco_aemet.describir())
             
             # Actualizar gráfico
             if MATPLOTLIB_AVAILABLE: